@@ -7,7 +7,7 @@ from zipfile import BadZipfile
 
 from requests.exceptions import RequestException
 
-from catatom2osm import boundary, config
+from catatom2osm import boundary, config, download, profiler
 from catatom2osm.app import CatAtom2Osm, QgsSingleton
 from catatom2osm.catatom import Reader
 from catatom2osm.exceptions import CatException
@@ -54,11 +54,12 @@ def process(options):
     if options.list:
         boundary.list_code(options.list)
     elif options.download:
+        downloads = []
+        layers = ["address", "cadastralzoning", "building"]
         for a_path in options.path:
             cat = Reader(a_path)
-            cat.download("address")
-            cat.download("cadastralzoning")
-            cat.download("building")
+            downloads += cat.get_downloads(layers, force=True)
+        download.wget_all(downloads)
     else:
         if options.info:
             config.report_system_info = False
@@ -185,6 +186,24 @@ def run():
             "Select the log level between " "DEBUG, INFO, WARNING, ERROR or CRITICAL."
         ),
     )
+    parser.add_argument(
+        "--offline",
+        dest="offline",
+        action="store_true",
+        help=_("Read the Overpass queries only from the cache"),
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        metavar="PROFILER",
+        nargs="?",
+        const=profiler.PROFILERS[0],
+        choices=profiler.PROFILERS,
+        help=_(
+            "Profile each stage with cprofile (default) or sample and save "
+            "the results in the municipality folder"
+        ),
+    )
     msg = _("Path to the user configuration file. Defaults to '%s'")
     parser.add_argument(
         "-f",
@@ -212,6 +231,8 @@ def run():
     options.args = " ".join(sys.argv[1:])
     log_level = getattr(logging, options.log_level.upper())
     config.set_log_level(log, log_level)
+    if options.offline:
+        config.overpass_offline = True
     if not options.building and not options.address:
         options.address = True
         options.building = True
@@ -1,11 +1,9 @@
 """Main application processes."""
-import codecs
 import gzip
-import io
 import logging
 import os
 import shutil
-from collections import defaultdict
+from fnmatch import fnmatch
 from glob import glob
 from zipfile import ZIP_DEFLATED, ZipFile
 
@@ -18,8 +16,21 @@ from osgeo import gdal
 from qgis.core import QgsApplication, QgsGeometry, QgsVectorLayer
 
 from catatom2osm import cdau  # NOQA: F401 - Used in get_auxiliary_addresses
-from catatom2osm import boundary, catatom, cbcn, config, csvtools, geo, osmxml, overpass
+from catatom2osm import (
+    boundary,
+    catatom,
+    cbcn,
+    config,
+    csvtools,
+    geo,
+    osmpbf,
+    osmxml,
+    overpass,
+    profiler,
+    taskpool,
+)
 from catatom2osm.exceptions import CatIOError, CatValueError
+from catatom2osm.profiler import stage
 from catatom2osm.report import instance as report
 
 qgis.utils.uninstallErrorHook()
@@ -66,6 +77,8 @@ class CatAtom2Osm(object):
         self.cat = catatom.Reader(a_path)
         self.path = self.cat.path
         report.clear(options=self.options.args, mun_code=self.cat.zip_code)
+        if getattr(self.options, "profile", None):
+            profiler.start(self.options.profile, self.path)
         if config.report_system_info:
             report.qgs_version = qgis_utils.QGIS_VERSION
             report.gdal_version = gdal.__version__
@@ -120,6 +133,7 @@ class CatAtom2Osm(object):
         if self.options.comment:
             self.add_comments()
             return
+        self.cat.prefetch(self.get_prefetch_layers())
         if self.options.municipality:
             self.get_zoning()
         self.get_boundary()
@@ -164,6 +178,16 @@ class CatAtom2Osm(object):
         self.output_zoning()
         self.finish()
 
+    def get_prefetch_layers(self):
+        """Return the Cadastre layers that run will surely read."""
+        if self.options.address and not self.is_new and not self.options.info:
+            return []  # Resume processing reads the files of the first run
+        layers = ["cadastralparcel", "building"]
+        if self.options.address or self.options.info:
+            if self.cat.zip_code != "08900":  # Barcelona addresses from CBCN
+                layers.append("address")
+        return layers
+
     def export_municipality(self, rustic):
         """Create municipality <mun_code>.geojson geometry from cadastral zoning."""
         municipality = geo.PolygonLayer(
@@ -211,6 +235,7 @@ class CatAtom2Osm(object):
         if not tasks:
             log.info(_("No tasks found"))
 
+    @stage()
     def get_split(self):
         """Get boundary file for splitting."""
         if self.options.split:
@@ -245,6 +270,7 @@ class CatAtom2Osm(object):
                 msg = _("'%s' does not include any polygon") % self.options.split
                 raise CatValueError(msg)
 
+    @stage()
     def get_parcel(self):
         """Get parcels dataset."""
         parcel_gml = self.cat.read("cadastralparcel")
@@ -272,6 +298,7 @@ class CatAtom2Osm(object):
         if self.parcel.featureCount() == 0:
             raise CatValueError(_("No parcels data"))
 
+    @stage()
     def get_building(self):
         """Merge building, parts and pools."""
         building_gml = self.cat.read("building")
@@ -307,6 +334,7 @@ class CatAtom2Osm(object):
             report.inp_pools = inpo
             report.inp_parts = report.inp_features - inbu - inpo
 
+    @stage()
     def process_tasks(self, source):
         """Convert to osm for each task."""
         if not os.path.exists(self.tasks_path):
@@ -318,6 +346,14 @@ class CatAtom2Osm(object):
         to_change = {}
         report.parcel_parts = config.parcel_parts
         report.parcel_dist = config.parcel_dist
+        pool = None
+        address_index = None
+        # Task files on disk or queued, decided here before the writes finish
+        task_files = set(glob(os.path.join(self.tasks_path, "*.osm.gz")))
+        if taskpool.get_workers() > 1:
+            pool = taskpool.TaskPool()
+            if self.options.address and self.options.building:
+                address_index = taskpool.index_addresses(self.address_osm)
         for pa in self.parcel.getFeatures():
             label = pa["localId"]
             task = tasks.get(label, None)
@@ -329,26 +365,37 @@ class CatAtom2Osm(object):
             else:
                 tasks_u += 1
             comment = self.get_task_comment(label)
-            task_osm = task.to_osm(upload="yes", tags={"comment": comment})
-            if self.options.address and self.options.building:
-                self.merge_address(task_osm, self.address_osm)
-            if self.options.address:
-                report.address_stats(task_osm)
+            if pool is None:
+                task_osm = task.to_osm(upload="yes", tags={"comment": comment})
+                if self.options.address and self.options.building:
+                    self.merge_address(task_osm, self.address_osm)
+                if self.options.address:
+                    report.address_stats(task_osm)
             fp = self.cat.get_path(self.tasks_folder, label)
             if self.options.building:
                 if config.clean_fixmes:
                     task.export_fixmes(fp)
                 report.fixme_stats(task, label)
-                report.cons_stats(task_osm)
-                report.osm_stats(task_osm)
-            if self.split and os.path.exists(fp + ".osm.gz"):
+                if pool is None:
+                    report.cons_stats(task_osm)
+                    report.osm_stats(task_osm)
+            if self.split and fp + ".osm.gz" in task_files:
                 if not os.path.exists(self.bkp_path):
-                    n = len(glob(fp + "*.osm.gz"))
+                    n = len([f for f in task_files if fnmatch(f, fp + "*.osm.gz")])
                     label = f"{label}-{n}"
                     pa["localId"] = label
                     to_change[pa.id()] = geo.tools.get_attributes(pa)
-            self.write_osm(task_osm, self.tasks_folder, label + ".osm.gz")
+            task_files.add(self.cat.get_path(self.tasks_folder, label + ".osm.gz"))
+            if pool is None:
+                self.write_osm(task_osm, self.tasks_folder, label + ".osm.gz")
+            else:
+                self.submit_task(pool, task, label, comment, address_index)
             del task
+        if pool is not None:
+            for (osm_path, values, counts) in pool.close():
+                report.merge(values)
+                msg = _("Generated '%s': %d nodes, %d ways, %d relations")
+                log.info(msg, os.path.basename(osm_path), *counts)
         if to_clean:
             self.parcel.writer.deleteFeatures(to_clean)
             log.debug(_("Removed %d void parcels"), len(to_clean))
@@ -360,6 +407,34 @@ class CatAtom2Osm(object):
         report.tasks_r = tasks_r
         report.tasks_u = tasks_u
 
+    def submit_task(self, pool, task, label, comment, address_index=None):
+        """
+        Queue a task to generate its file in a worker process.
+
+        Args:
+            pool (TaskPool): pool of worker processes
+            task (BaseLayer): features of the task
+            label (str): task file name without extension
+            comment (str): changeset comment of the task
+            address_index (dict): addresses to merge indexed by 'ref'
+        """
+        features = task.to_wkb()
+        tags = dict(config.changeset_tags, comment=comment)
+        if getattr(task, "source_date", False):
+            tags["source:date"] = task.source_date
+        addresses = None
+        if self.options.address and self.options.building:
+            addresses = taskpool.get_addresses(features, address_index)
+        pool.submit(
+            self.cat.get_path(self.tasks_folder, label + ".osm.gz"),
+            features,
+            tags,
+            addresses=addresses,
+            address_tags=self.address_osm.tags if addresses is not None else None,
+            address_stats=bool(self.options.address),
+            building_stats=bool(self.options.building),
+        )
+
     def get_tasks(self, source):
         """Put each source feature into a task layer."""
         if os.path.exists(self.tasks_path):
@@ -388,6 +463,7 @@ class CatAtom2Osm(object):
             last_task = label
         return tasks
 
+    @stage()
     def get_zoning(self):
         """Get zoning data."""
         zoning_gml = self.cat.read("cadastralzoning")
@@ -405,6 +481,7 @@ class CatAtom2Osm(object):
             self.export_municipality(self.rustic_zoning)
         del zoning_gml
 
+    @stage()
     def get_boundary(self):
         """Get best boundary search area for overpass queries."""
         id = None
@@ -426,6 +503,7 @@ class CatAtom2Osm(object):
         report.mun_name = name
         log.info(_("Municipality: '%s'"), name)
 
+    @stage()
     def output_zoning(self):
         """Generate project zoning file."""
         if not self.options.parcel:
@@ -446,6 +524,7 @@ class CatAtom2Osm(object):
         log.info(_("Generated '%s'"), fn)
         del bpoly
 
+    @stage()
     def process_building(self):
         """Process all buildings dataset."""
         self.building.remove_outside_parts()
@@ -458,6 +537,7 @@ class CatAtom2Osm(object):
         if self.options.building:
             self.building.validate(report.max_level, report.min_level)
 
+    @stage()
     def process_parcel(self):
         """Process parcels dataset."""
         self.parcel.set_zones(self.urban_zoning)
@@ -497,6 +577,7 @@ class CatAtom2Osm(object):
 
     def exit(self):
         """Exit properly."""
+        profiler.stop()
         for propname in list(self.__dict__.keys()):
             if isinstance(getattr(self, propname), QgsVectorLayer):
                 delattr(self, propname)
@@ -518,6 +599,7 @@ class CatAtom2Osm(object):
         self.export_layer(self.address, "address.geojson", target_crs_id=4326)
         self.get_translations(self.address)
 
+    @stage()
     def get_address(self):
         """Read Address GML dataset."""
         if self.cat.zip_code == "08900":
@@ -563,6 +645,7 @@ class CatAtom2Osm(object):
         self.export_layer(self.address, "address.geojson", target_crs_id=4326)
         self.get_translations(self.address)
 
+    @stage()
     def process_address(self):
         """Fix street names, conflate and move addresses."""
         highway_names = self.get_translations(self.address)
@@ -648,46 +731,12 @@ class CatAtom2Osm(object):
             building_osm (Osm): OSM data set with buildings
             address_osm (Osm): OSM data set with addresses
         """
-        if "source:date" in address_osm.tags:
-            building_osm.tags["source:date:addr"] = address_osm.tags["source:date"]
-        address_index = defaultdict(list)
-        building_index = defaultdict(list)
-        for bu in building_osm.elements:
-            if "ref" in bu.tags:
-                building_index[bu.tags["ref"]].append(bu)
-        for ad in address_osm.nodes:
-            if ad.tags.get("ref", "") in building_index:
-                address_index[ad.tags["ref"]].append(ad)
-        md = 0
-        for (ref, group) in list(building_index.items()):
-            parcel_ad = []
-            entrance_count = 0
-            for ad in address_index[ref]:
-                entrance = False
-                if "entrance" in ad.tags:
-                    for w in building_osm.get_outline(group):
-                        entrance = w.search_node(ad.x, ad.y)
-                        if entrance:
-                            entrance.tags.update(ad.tags)
-                            if not config.show_refs:
-                                entrance.tags.pop("ref", None)
-                            entrance.tags.pop("image", None)
-                            break
-                if entrance:
-                    entrance_count += 1
-                else:
-                    parcel_ad.append(ad)
-            if len(parcel_ad) == 1 and entrance_count == 0:
-                ad = parcel_ad.pop()
-                bu = group[0]
-                bu.tags.update(ad.tags)
-                bu.tags.pop("image", None)
-                bu.tags.pop("entrance", None)
-            md += len(parcel_ad)
+        md = taskpool.merge_address(building_osm, address_osm)
         if md > 0:
             log.debug(_("Refused %d 'parcel' addresses not unique for it building"), md)
             report.inc("not_unique_addresses", md)
 
+    @stage()
     def get_translations(self, address):
         """
         Get the translate file.
@@ -734,7 +783,7 @@ class CatAtom2Osm(object):
             'way["place"]["name"]',
             'relation["place"]["name"]',
         ]
-        place_osm = self.read_osm("current_place.osm", ql=ql)
+        place_osm = self.read_osm("current_place.osm", ql=ql, meta=False)
         place = geo.PlaceLayer()
         place.read_from_osm(place_osm)
         del place_osm
@@ -748,12 +797,13 @@ class CatAtom2Osm(object):
             'way["place"="square"]["name"]',
             'relation["place"="square"]["name"]',
         ]
-        highway_osm = self.read_osm("current_highway.osm", ql=ql)
+        highway_osm = self.read_osm("current_highway.osm", ql=ql, meta=False)
         highway = geo.HighwayLayer()
         highway.read_from_osm(highway_osm)
         del highway_osm
         return highway
 
+    @stage()
     def get_current_ad_osm(self):
         """Get OSM address for conflation."""
         ql = [
@@ -761,20 +811,27 @@ class CatAtom2Osm(object):
             'wr["addr:street"]["addr:housenumber"][~"building"~".*"]',
             'nwr["addr:place"]["addr:housenumber"]',
         ]
-        address_osm = self.read_osm("current_address.osm", ql=ql)
         current_address = set()
         w = 0
         report.osm_addresses = 0
-        for d in address_osm.elements:
-            if "addr:housenumber" not in d.tags:
-                if "addr:street" in d.tags or "addr:place" in d.tags:
-                    w += 1
-            elif "addr:street" in d.tags:
-                current_address.add(d.tags["addr:street"] + d.tags["addr:housenumber"])
-                report.osm_addresses += 1
-            elif "addr:place" in d.tags:
-                current_address.add(d.tags["addr:place"] + d.tags["addr:housenumber"])
-                report.osm_addresses += 1
+        count = 0
+        filename = "current_address.osm"
+        with self.open_osm(filename, ql=ql) as fo:
+            for etype, eid, tags in osmxml.iter_tags(fo):
+                count += 1
+                if "addr:housenumber" not in tags:
+                    if "addr:street" in tags or "addr:place" in tags:
+                        w += 1
+                elif "addr:street" in tags:
+                    current_address.add(tags["addr:street"] + tags["addr:housenumber"])
+                    report.osm_addresses += 1
+                elif "addr:place" in tags:
+                    current_address.add(tags["addr:place"] + tags["addr:housenumber"])
+                    report.osm_addresses += 1
+        if count == 0:
+            msg = _("No OSM data were obtained from '%s'") % filename
+            log.warning(msg)
+            report.warnings.append(msg)
         if w > 0:
             msg = _("There are %d address without house number in the OSM data") % w
             log.warning(msg)
@@ -838,9 +895,9 @@ class CatAtom2Osm(object):
         else:
             raise CatIOError(_("Failed to write layer: '%s'") % filename)
 
-    def read_osm(self, *paths, **kwargs):
+    def open_osm(self, *paths, **kwargs):
         """
-        Read an OSM data set from an OSM XML file.
+        Open an OSM XML file for reading.
 
         If the file not exists, downloads data from overpass using ql query.
 
@@ -849,7 +906,7 @@ class CatAtom2Osm(object):
             ql (str): Query to put in the url for overpass
 
         Returns
-            Osm: OSM data set
+            file: binary file object or None if the file can't be obtained
         """
         ql = kwargs.get("ql", False)
         osm_path = self.cat.get_path(*paths)
@@ -867,10 +924,35 @@ class CatAtom2Osm(object):
             else:
                 query.download(osm_path)
         if osm_path.endswith(".gz"):
-            fo = gzip.open(osm_path, "rb")
+            return gzip.open(osm_path, "rb")
+        return open(osm_path, "rb")
+
+    def read_osm(self, *paths, **kwargs):
+        """
+        Read an OSM data set from an OSM XML or PBF (if ends with .pbf) file.
+
+        If the file not exists, downloads data from overpass using ql query.
+
+        Args:
+            paths (str): input filename components relative to self.path
+            ql (str): Query to put in the url for overpass
+            query (func): filter for the tags of the elements to read (XML only)
+            meta (bool): False to skip metadata attributes
+
+        Returns
+            Osm: OSM data set
+        """
+        fo = self.open_osm(*paths, ql=kwargs.get("ql", False))
+        if fo is None:
+            return None
+        osm_path = self.cat.get_path(*paths)
+        filename = os.path.basename(osm_path)
+        meta = kwargs.get("meta", True)
+        if osm_path.endswith(".pbf"):
+            data = osmpbf.deserialize(fo, meta=meta)
         else:
-            fo = open(osm_path, "rb")
-        data = osmxml.deserialize(fo)
+            query = kwargs.get("query", None)
+            data = osmxml.deserialize(fo, query=query, meta=meta)
         fo.close()
         if len(data.elements) == 0:
             msg = _("No OSM data were obtained from '%s'") % filename
@@ -888,25 +970,28 @@ class CatAtom2Osm(object):
 
     def write_osm(self, data, *paths):
         """
-        Generate an OSM XML file for an OSM data set.
+        Generate an OSM XML or PBF file for an OSM data set.
 
         Args:
             data (Osm): OSM data set
             paths (str): output filename components relative to self.path
-                            (compress if ends with .gz)
+                            (compress if ends with .gz, PBF if ends with .pbf)
+
+        The PBF format doesn't store the upload attribute, changeset tags
+        and the elements action and visible attributes, a warning is issued
+        if the data set has them.
         """
-        if not config.show_refs:
-            for e in data.elements:
-                if "ref" in e.tags:
-                    del e.tags["ref"]
-        data.merge_duplicated()
         osm_path = self.cat.get_path(*paths)
-        if osm_path.endswith(".gz"):
-            file_obj = codecs.getwriter("utf-8")(gzip.open(osm_path, "w"))
-        else:
-            file_obj = io.open(osm_path, "w", encoding="utf-8")
-        osmxml.serialize(file_obj, data)
-        file_obj.close()
+        if osm_path.endswith(".pbf"):
+            lost = osmpbf.get_lost_attributes(data)
+            if lost:
+                msg = _("The PBF format doesn't store %s in '%s'") % (
+                    ", ".join(lost),
+                    os.path.basename(osm_path),
+                )
+                log.warning(msg)
+                report.warnings.append(msg)
+        taskpool.write_osm(data, osm_path)
         msg = _("Generated '%s': %d nodes, %d ways, %d relations")
         log.info(
             msg,
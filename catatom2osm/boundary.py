@@ -32,7 +32,7 @@ def list_provincial_offices():
 
 def get_districts(code):
     id, name = get_municipality(code)
-    query = overpass.Query(id)
+    query = overpass.Query(id, kind="boundary")
     query.add('wr["boundary"="administrative"]["admin_level"="9"]')
     query.add('wr["boundary"="administrative"]["admin_level"="10"]')
     result = query.read()
@@ -98,7 +98,9 @@ def search_municipality(cat_path, mun_code, name, bounding_box):
             geojson = json.load(fo)
         mun = shape(geojson["features"][0]["geometry"]).buffer(0)
         bounding_box = "{1},{0},{3},{2}".format(*mun.buffer(0.01).bounds)
-    query = overpass.Query(bounding_box, "json", mun is not None, False)
+    query = overpass.Query(
+        bounding_box, "json", mun is not None, False, kind="boundary"
+    )
     query.add('rel["admin_level"="8"]')
     try:
         data = json.loads(query.read())
@@ -173,7 +175,7 @@ def list_municipalities(prov_code):
 
 
 def get_boundary(cat_path, boundary_search_area, id_or_name):
-    query = overpass.Query(boundary_search_area)
+    query = overpass.Query(boundary_search_area, kind="boundary")
     if re.search(r"^[0-9]+$", id_or_name):
         query.add(f"wr({id_or_name})")
     else:
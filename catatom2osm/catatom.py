@@ -1,4 +1,6 @@
 """Reader of Cadastre ATOM GML files."""
+import functools
+import json
 import logging
 import os
 import re
@@ -12,6 +14,14 @@ from catatom2osm.exceptions import CatIOError, CatValueError
 
 log = logging.getLogger(config.app_name)
 
+AMP_RE = re.compile(b"&(?=[<F])")  # Ampersands to escape in the address GML
+
+
+@functools.lru_cache(maxsize=None)
+def get_feed(url):
+    """Return the text of a Cadastre ATOM service, requested once for each url."""
+    return download.get_response(url).text
+
 
 class Reader(object):
     """Class to download and read Cadastre ATOM GML files."""
@@ -78,9 +88,9 @@ class Reader(object):
         gml_code = root.find(".//gmd:code/gco:CharacterString", namespace)
         self.crs_ref = int(gml_code.text.split("/")[-1])
 
-    def get_atom_file(self, url):
+    def get_atom_url(self, url):
         """
-        Try to download the ZIP file for self.zip_code.
+        Return the url of the ZIP file for self.zip_code.
 
         Given the url of a Cadastre ATOM service.
         """
@@ -90,8 +100,7 @@ class Reader(object):
             s.group(1),
             self.zip_code,
         )
-        response = download.get_response(url)
-        s = re.search(r"http.+/%s.+zip" % self.zip_code, response.text)
+        s = re.search(r"http.+/%s.+zip" % self.zip_code, get_feed(url))
         if not s:
             msg = _("Municipality code '%s' don't exists") % self.zip_code
             raise CatValueError(msg)
@@ -101,12 +110,46 @@ class Reader(object):
         # Some URLs have 2 or 3 spaces, mainly because of diacritics.
         # https://codefather.tech/blog/python-replace-multiple-spaces-with-one
         url = re.sub(' +', ' ', url)
+        return url
+
+    def get_atom_file(self, url):
+        """
+        Try to download the ZIP file for self.zip_code.
 
+        Given the url of a Cadastre ATOM service.
+        """
+        url = self.get_atom_url(url)
         filename = url.split("/")[-1]
         out_path = self.get_path(filename)
         log.info(_("Downloading '%s'"), out_path)
         download.wget(url, out_path)
 
+    def get_downloads(self, layernames, force=False):
+        """
+        Return the url and path of the ZIP files needed to read some layers.
+
+        Args:
+            layernames (list): Short names of the Cadastre layers.
+            force (bool): Include the files already downloaded.
+
+        Returns:
+            (list) url and path of each ZIP file.
+        """
+        downloads = {}
+        for layername in layernames:
+            (md_path, gml_path, zip_path, group) = self.get_layer_paths(layername)
+            if not force and (os.path.exists(zip_path) or os.path.exists(gml_path)):
+                continue
+            url = self.get_atom_url(config.prov_url[group].format(code=self.prov_code))
+            if url not in downloads:
+                downloads[url] = self.get_path(url.split("/")[-1])
+                log.info(_("Downloading '%s'"), downloads[url])
+        return list(downloads.items())
+
+    def prefetch(self, layernames):
+        """Download concurrently the missing ZIP files to read some layers."""
+        download.wget_all(self.get_downloads(layernames))
+
     def get_layer_paths(self, layername):
         if layername in ["building", "buildingpart", "otherconstruction"]:
             group = "BU"
@@ -175,31 +218,92 @@ class Reader(object):
             gml = None
         return gml
 
+    def get_fix_marker(self, gml_path, zip_path, fix):
+        """
+        Return the path of the marker of a fix and its content.
+
+        The content is the size and modification time of the source file, so
+        the marker is outdated if the source changes.
+        """
+        src_path = gml_path if os.path.exists(gml_path) else zip_path
+        stat = os.stat(src_path)
+        return gml_path + "." + fix, "%d %d\n" % (stat.st_size, stat.st_mtime_ns)
+
+    def is_fixed(self, gml_path, zip_path, fix):
+        """Return True if the source has an updated marker of fix."""
+        (marker_path, content) = self.get_fix_marker(gml_path, zip_path, fix)
+        if not os.path.exists(marker_path):
+            return False
+        with open(marker_path, "r") as fo:
+            return fo.read() == content
+
+    def set_fixed(self, gml_path, zip_path, fix):
+        """Write the marker of fix for the source."""
+        (marker_path, content) = self.get_fix_marker(gml_path, zip_path, fix)
+        with open(marker_path, "w") as fo:
+            fo.write(content)
+
+    def get_chunks(self, fo):
+        """Return an iterator over the chunks of a file object."""
+        return iter(functools.partial(fo.read, config.gml_chunk_size), b"")
+
     def fix_encoding(self, gml_path, zip_path):
-        """Test if source needs to be converted to utf-8."""
+        """
+        Test if source needs to be converted to utf-8.
+
+        The source is scanned in chunks and rewritten in chunks if some of
+        them isn't ASCII. Each ISO-8859-1 byte is one character, so the chunks
+        can be decoded separately.
+        """
+        if self.is_fixed(gml_path, zip_path, "fix_encoding"):
+            return
         with self.get_file_object(gml_path, zip_path) as fo:
-            data = fo.read()
-        try:
-            data.decode("ascii")
-        except UnicodeDecodeError:
-            text = data.decode("ISO-8859-1")
-            with open(gml_path, "w") as fo:
-                fo.write(text)
+            is_ascii = all(chunk.isascii() for chunk in self.get_chunks(fo))
+        if not is_ascii:
+            tmp_path = gml_path + ".part"
+            with self.get_file_object(gml_path, zip_path) as fo:
+                with open(tmp_path, "wb") as fw:
+                    for chunk in self.get_chunks(fo):
+                        fw.write(chunk.decode("ISO-8859-1").encode("utf-8"))
+            os.replace(tmp_path, gml_path)
+        self.set_fixed(gml_path, zip_path, "fix_encoding")
+
+    def get_amp_chunks(self, fo):
+        """
+        Return an iterator over the chunks of a file object for fix_amp.
+
+        A trailing ampersand is moved to the next chunk, so the patterns
+        escaped by fix_amp are never split between two chunks.
+        """
+        tail = b""
+        for chunk in self.get_chunks(fo):
+            data = tail + chunk
+            tail = b""
+            if data.endswith(b"&"):
+                (data, tail) = (data[:-1], b"&")
+            yield data
+        if tail:
+            yield tail
 
     def fix_amp(self, gml_path, zip_path):
-        """Test if source needs to be escape ampersand."""
+        """
+        Test if source needs to be escape ampersand.
+
+        The source is scanned in chunks and rewritten in chunks if some of
+        them has an ampersand followed by '<' or 'F'.
+        """
+        if self.is_fixed(gml_path, zip_path, "fix_amp"):
+            return
         with self.get_file_object(gml_path, zip_path) as fo:
-            data = fo.read()
-        save = False
-        if b"&<" in data:
-            data = re.sub(b"&<", b"&amp;<", data)
-            save = True
-        if b"&F" in data:
-            data = re.sub(b"&F", b"&amp;F", data)
-            save = True
+            save = any(AMP_RE.search(data) for data in self.get_amp_chunks(fo))
         if save:
-            with open(gml_path, "wb") as fo:
-                fo.write(data)
+            tmp_path = gml_path + ".part"
+            with self.get_file_object(gml_path, zip_path) as fo:
+                with open(tmp_path, "wb") as fw:
+                    for data in self.get_amp_chunks(fo):
+                        fw.write(AMP_RE.sub(b"&amp;", data))
+            os.replace(tmp_path, gml_path)
+        self.set_fixed(gml_path, zip_path, "fix_amp")
 
     def download(self, layername):
         """
@@ -213,12 +317,69 @@ class Reader(object):
         url = config.prov_url[group].format(code=self.prov_code)
         self.get_atom_file(url)
 
+    def get_cache_paths(self, layername):
+        """Return the paths of a converted layer and its key in the cache."""
+        cache_path = self.get_path(config.gml_cache_dir, layername + ".gpkg")
+        key_path = self.get_path(config.gml_cache_dir, layername + ".json")
+        return cache_path, key_path
+
+    def get_cache_key(self, gml_path, zip_path):
+        """
+        Return the key of the source of a layer in the cache.
+
+        It's the size and modification time of the ZIP file (or the GML file
+        if there isn't a ZIP file) and the date of the metadata.
+        """
+        src_path = zip_path if os.path.exists(zip_path) else gml_path
+        stat = os.stat(src_path)
+        return {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "date": self.src_date,
+        }
+
+    def read_cache(self, layername, key):
+        """Return the cached layer if it matches the key of its source or None."""
+        if not config.gml_cache:
+            return None
+        (cache_path, key_path) = self.get_cache_paths(layername)
+        if not os.path.exists(cache_path) or not os.path.exists(key_path):
+            return None
+        try:
+            with open(key_path, "r") as fo:
+                cached_key = json.load(fo)
+        except (OSError, ValueError):
+            return None
+        if cached_key != key:
+            return None
+        gml = geo.BaseLayer(cache_path, layername + ".gml", "ogr")
+        if not gml.isValid():
+            return None
+        log.debug(_("Read '%s' from cache"), cache_path)
+        return gml
+
+    def write_cache(self, layername, key, gml):
+        """Convert a layer to GeoPackage in the cache with the key of its source."""
+        if not config.gml_cache:
+            return
+        (cache_path, key_path) = self.get_cache_paths(layername)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        if os.path.exists(key_path):
+            os.remove(key_path)
+        if gml.export(cache_path, "GPKG"):
+            with open(key_path, "w") as fo:
+                json.dump(key, fo)
+        else:
+            log.warning(_("Failed to write '%s'"), cache_path)
+
     def read(self, layername, allow_empty=False, force_zip=False):
         """
         Create a QGIS vector layer for a Cadastre layername.
 
         Derive the GML filename from layername. Downloads the file if not is
         present. First try to read the ZIP file, if fails try with the GML file.
+        The layer is converted to GeoPackage the first time it's read and the
+        next reads use the converted layer until the source file changes.
 
         Args:
             layername (str): Short name of the Cadastre layer. Any of
@@ -236,29 +397,35 @@ class Reader(object):
         url = config.prov_url[group].format(code=self.prov_code)
         if not os.path.exists(zip_path) and (not os.path.exists(gml_path) or force_zip):
             self.get_atom_file(url)
-        if layername == "cadastralparcel":
-            self.fix_encoding(gml_path, zip_path)
-        if layername == "address":
-            self.fix_amp(gml_path, zip_path)
         self.get_metadata(md_path, zip_path)
-        if self.is_empty(gml_path, zip_path):
-            if not allow_empty:
-                raise CatIOError(_("The layer '%s' is empty") % gml_path)
-            else:
-                log.info(_("The layer '%s' is empty"), gml_path)
-                return None
-        fn = gml_path
-        if group == "AD":
-            fn += "|layername=" + layername
-        gml = geo.BaseLayer(fn, layername + ".gml", "ogr")
-        if not gml.isValid():
-            gml = self.get_gml_from_zip(gml_path, zip_path, group, layername)
-            if gml is None:
-                raise CatIOError(_("Failed to load layer '%s'") % gml_path)
+        cache_key = self.get_cache_key(gml_path, zip_path)
+        gml = self.read_cache(layername, cache_key)
+        if gml is None:
+            if layername == "cadastralparcel":
+                self.fix_encoding(gml_path, zip_path)
+            if layername == "address":
+                self.fix_amp(gml_path, zip_path)
+            if self.is_empty(gml_path, zip_path):
+                if not allow_empty:
+                    raise CatIOError(_("The layer '%s' is empty") % gml_path)
+                else:
+                    log.info(_("The layer '%s' is empty"), gml_path)
+                    return None
+            fn = gml_path
+            if group == "AD":
+                fn += "|layername=" + layername
+            gml = geo.BaseLayer(fn, layername + ".gml", "ogr")
+            if not gml.isValid():
+                gml = self.get_gml_from_zip(gml_path, zip_path, group, layername)
+                if gml is None:
+                    raise CatIOError(_("Failed to load layer '%s'") % gml_path)
+            cache_key = None
         crs = QgsCoordinateReferenceSystem.fromEpsgId(self.crs_ref)
         if not crs.isValid():
             raise CatIOError(_("Could not determine the CRS of '%s'") % gml_path)
         gml.setCrs(crs)
         log.info(_("Read %d features in '%s'"), gml.featureCount(), gml_path)
         gml.source_date = self.src_date
+        if cache_key is None:
+            self.write_cache(layername, self.get_cache_key(gml_path, zip_path), gml)
         return gml
@@ -33,8 +33,18 @@ log_format = "%(asctime)s - %(levelname)s - %(message)s"
 show_progress_bars = True
 report_system_info = True
 clean_fixmes = False
+sort_osm = False  # Write OSM elements sorted by id instead of by creation order
+compression_level = 6  # Gzip compression level (1-9) of the OSM files
+compression_threads = 0  # Threads to compress OSM files, 0 for number of CPUs
+task_processes = 1  # Processes to generate tasks files, 0 for number of CPUs
+clean_processes = 1  # Processes to clean geometries in tiles, 0 for number of CPUs
+clean_tile_size = 2000  # Side in meters of the tiles to clean geometries
+profile_interval = 0.005  # Seconds between samples of the sampling profiler
 
 fn_prefix = "A.ES.SDGC"  # Inspire Atom file name prefix
+gml_cache = True  # Keep the Cadastre layers converted to GeoPackage
+gml_cache_dir = "cache"  # Folder in the municipality to keep the converted layers
+gml_chunk_size = 4 * 1024 * 1024  # Bytes read at once to fix the GML files
 
 silence_gdal = False
 
@@ -52,6 +62,18 @@ entrance_thr = 0.4  # Minimum distance in meters from a entrance to the nearest
 bbox_buffer = 0.002  # Buffer in degrees around overpass bounding boxes
 parcel_buffer = 200  # Buffer in meters around parcel to search adjacents
 
+overpass_cache = True  # Keep the Overpass responses in a cache
+overpass_cache_path = "overpass_cache"  # Folder of the cache
+overpass_ttl = {  # Seconds to reuse the cached responses of each type of query
+    "data": 3600,
+    "boundary": 30 * 86400,
+}
+overpass_stale = {  # Seconds to use an expired response while it's updated
+    "data": 0,
+    "boundary": 7 * 86400,
+}
+overpass_offline = False  # Read the Overpass queries only from the cache
+
 changeset_tags = {
     "comment": "#Spanish_Cadastre_Buildings_Import",
     "source": "Dirección General del Catastro",
@@ -1,37 +1,219 @@
+import json
 import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ChunkedEncodingError
 
 from catatom2osm import progressbar
+from catatom2osm.exceptions import CatIOError
 
 number_of_retries = 3
 default_timeout = 30
-chunk_size = 1024
+backoff_factor = 1  # Seconds to wait before the first retry, doubled in each one
+chunk_size = 1024 * 1024  # Bytes to write at once
+max_workers = 4  # Files to download at once
+host_connections = 2  # Files to download at once from the same host
 
+TRANSFER_ERRORS = (requests.ConnectionError, requests.Timeout, ChunkedEncodingError)
 
-def get_response(url, stream=False):
-    """Try many times to get a http response or raise exception."""
+_session = None  # HTTP session shared by all the downloads
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the HTTP session shared by all the downloads."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=max_workers)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+    return _session
+
+
+def get_backoff(retry):
+    """Return the seconds to wait before a retry (starting with 0)."""
+    return backoff_factor * 2**retry
+
+
+def get_response(url, stream=False, headers=None):
+    """
+    Try many times to get a http response or raise exception.
+
+    Connection errors, timeouts, server errors and 'Too Many Requests'
+    responses are retried after an exponential backoff. Any status other
+    than 'OK' or 'Partial Content' raises requests.HTTPError.
+    """
+    session = get_session()
     for i in range(number_of_retries):
-        response = requests.get(url, stream=stream, timeout=default_timeout)
-        if response.status_code == requests.codes.ok:
+        if i > 0:
+            time.sleep(get_backoff(i - 1))
+        try:
+            response = session.get(
+                url, stream=stream, timeout=default_timeout, headers=headers
+            )
+        except (requests.ConnectionError, requests.Timeout):
+            if i == number_of_retries - 1:
+                raise
+            continue
+        status = response.status_code
+        if status in (requests.codes.ok, requests.codes.partial_content):
             return response
-    response.raise_for_status()
+        if status != requests.codes.too_many and status < 500:
+            break
+        if i < number_of_retries - 1:
+            response.close()
+    try:
+        response.raise_for_status()
+    finally:
+        response.close()
+    msg = _("Unexpected status %d for url: %s") % (status, url)
+    raise requests.HTTPError(msg, response=response)
+
+
+def get_total(response):
+    """Return the size of the file in a response, 0 if unknown."""
+    if response.headers.get("Content-Encoding", "identity") != "identity":
+        return 0
+    if response.status_code == requests.codes.partial_content:
+        content_range = response.headers.get("Content-Range", "")
+        s = re.match(r"bytes \d+-\d+/(\d+)$", content_range)
+        return int(s.group(1)) if s else 0
+    return int(response.headers.get("Content-Length", 0))
+
+
+def get_validator(response):
+    """Return the ETag or date to resume a download, None if not resumable."""
+    if response.headers.get("Accept-Ranges") != "bytes":
+        return None
+    if response.headers.get("Content-Encoding", "identity") != "identity":
+        return None
+    return response.headers.get("ETag") or response.headers.get("Last-Modified")
+
 
+def read_part(part_path, url):
+    """Return the size and validator of a partial download of url or None."""
+    try:
+        with open(part_path + ".json", "r") as fo:
+            meta = json.load(fo)
+        size = os.path.getsize(part_path)
+    except (OSError, ValueError):
+        return None
+    if meta.get("url") != url or not meta.get("validator"):
+        return None
+    return size, meta["validator"]
 
-def wget(url, filename):
-    """Download url to filename."""
-    response = get_response(url, stream=True)
-    total = 0
-    if "Content-Length" in response.headers:
-        total = int(response.headers["Content-Length"])
+
+def write_part(part_path, url, validator):
+    """Save the validator to resume a partial download of url."""
+    meta_path = part_path + ".json"
+    if validator is None:
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        return
+    with open(meta_path, "w") as fo:
+        json.dump({"url": url, "validator": validator}, fo)
+
+
+def wget(url, filename, position=None):
+    """
+    Download url to filename.
+
+    position is the line of the progress bar, to show many of them at once.
+
+    The data is written in filename.part, renamed to filename when its size
+    matches the size sent by the server. If the transfer fails, it's resumed
+    with a Range request while the ETag (or modification date) doesn't
+    change and the server supports it, or restarted.
+    """
+    part_path = filename + ".part"
     pbar = progressbar.get(
-        total=total, unit="B", unit_scale=True, unit_divisor=chunk_size
+        total=0, unit="B", unit_scale=True, unit_divisor=1024, position=position
     )
     pbar.set_description(_("Downloading"))
     pbar.set_postfix(file=os.path.basename(filename), refresh=False)
-    with open(filename, "wb") as fo:
-        for chunk in response.iter_content(chunk_size):
-            pbar.update(chunk_size)
-            fo.write(chunk)
-    pbar.close()
-    response.close()
+    error = None
+    try:
+        for i in range(number_of_retries):
+            if error is not None:
+                time.sleep(get_backoff(i - 1))
+            part = read_part(part_path, url)
+            headers = {}
+            if part and part[0] > 0:
+                headers = {"Range": "bytes=%d-" % part[0], "If-Range": part[1]}
+            try:
+                response = get_response(url, stream=True, headers=headers)
+            except requests.HTTPError as e:
+                status = getattr(e.response, "status_code", None)
+                if not headers or status != requests.codes.range_not_satisfiable:
+                    raise
+                write_part(part_path, url, None)
+                error = e
+                continue
+            offset = part[0] if headers else 0
+            if response.status_code != requests.codes.partial_content:
+                offset = 0
+            total = get_total(response)
+            write_part(part_path, url, get_validator(response))
+            pbar.reset(total=total)
+            pbar.update(offset)
+            try:
+                with response, open(part_path, "ab" if offset else "wb") as fo:
+                    for chunk in response.iter_content(chunk_size):
+                        fo.write(chunk)
+                        pbar.update(len(chunk))
+            except TRANSFER_ERRORS as e:
+                error = e
+                continue
+            if total and os.path.getsize(part_path) != total:
+                error = CatIOError(_("Incomplete download of '%s'") % url)
+                continue
+            os.replace(part_path, filename)
+            write_part(part_path, url, None)
+            return
+    finally:
+        pbar.close()
+    raise error
+
+
+def wget_all(downloads):
+    """
+    Download concurrently a list of files.
+
+    Uses a pool of max_workers threads with at most host_connections
+    downloads from the same host. Each running download shows its progress
+    bar in a different line. Raises the first exception found after all the
+    downloads end.
+
+    Args:
+        downloads (list): url and filename of each file.
+    """
+    downloads = list(downloads)
+    hosts = {
+        urlsplit(url).netloc: threading.BoundedSemaphore(host_connections)
+        for (url, filename) in downloads
+    }
+    positions = queue.SimpleQueue()  # free lines for the progress bars
+    for position in range(max_workers):
+        positions.put(position)
+
+    def fetch(url, filename):
+        with hosts[urlsplit(url).netloc]:
+            position = positions.get()
+            try:
+                wget(url, filename, position=position)
+            finally:
+                positions.put(position)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch, url, fn) for (url, fn) in downloads]
+    for future in futures:
+        future.result()
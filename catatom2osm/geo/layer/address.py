@@ -66,6 +66,10 @@ class AddressLayer(BaseLayer):
             translate.address_tags, data, tags=tags, upload=upload
         )
 
+    def to_wkb(self):
+        """Export to WKB."""
+        return super(AddressLayer, self).to_wkb(translate.address_tags)
+
     def conflate(self, current_address):
         """
         Delete address existing in current_address.
@@ -17,7 +17,7 @@ from qgis.core import (
     QgsWkbTypes,
 )
 
-from catatom2osm import config, osm, progressbar, translate
+from catatom2osm import config, progressbar, taskpool, translate
 from catatom2osm.exceptions import CatIOError
 from catatom2osm.geo import BUFFER_SIZE
 from catatom2osm.geo.geometry import Geometry
@@ -420,8 +420,7 @@ class BaseLayer(QgsVectorLayer):
             Osm: OSM data set
         """
         if data is None:
-            generator = config.app_name + " " + config.app_version
-            data = osm.Osm(upload, generator=generator)
+            data = taskpool.new_osm(upload)
             nodes = ways = relations = 0
         else:
             nodes = len(data.nodes)
@@ -431,16 +430,10 @@ class BaseLayer(QgsVectorLayer):
             geom = feature.geometry()
             e = None
             if geom.wkbType() == WKBPoint:
-                e = data.Node(geom.asPoint())
+                e = taskpool.add_element(data, taskpool.WKB_POINT, geom.asPoint())
             elif geom.wkbType() in [WKBPolygon, WKBMultiPolygon]:
                 mp = Geometry.get_multipolygon(geom)
-                if len(mp) == 1:
-                    if len(mp[0]) == 1:
-                        e = data.Way(mp[0][0])
-                    else:
-                        e = data.Polygon(mp[0])
-                else:
-                    e = data.MultiPolygon(mp)
+                e = taskpool.add_element(data, taskpool.WKB_MULTIPOLYGON, mp)
             else:
                 msg = _("Detected a %s geometry in the '%s' layer") % (
                     QgsWkbTypes.displayString(geom.wkbType()),
@@ -464,6 +457,31 @@ class BaseLayer(QgsVectorLayer):
         )
         return data
 
+    def to_wkb(self, tags_translation=translate.all_tags):
+        """
+        Export this layer as WKB geometries with OSM tags.
+
+        Args:
+            tags_translation (function): Function to translate fields to tags.
+                By defaults convert all fields.
+
+        Returns:
+            list: pairs of WKB geometry and tags for each feature
+        """
+        features = []
+        for feature in self.getFeatures():
+            geom = feature.geometry()
+            if geom.wkbType() in [WKBPoint, WKBPolygon, WKBMultiPolygon]:
+                features.append((bytes(geom.asWkb()), tags_translation(feature)))
+            else:
+                msg = _("Detected a %s geometry in the '%s' layer") % (
+                    QgsWkbTypes.displayString(geom.wkbType()),
+                    self.name(),
+                )
+                log.warning(msg)
+                report.warnings.append(msg)
+        return features
+
     def search(self, expression=""):
         """Return a features iterator for this search expression."""
         if expression == "":
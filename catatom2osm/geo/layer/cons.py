@@ -5,12 +5,13 @@ from qgis.core import QgsFeatureRequest, QgsField, QgsGeometry
 from qgis.PyQt.QtCore import QVariant
 
 from catatom2osm import config, translate
-from catatom2osm.geo import BUFFER_SIZE, SIMPLIFY_BUILDING_PARTS
+from catatom2osm.geo import BUFFER_SIZE, SIMPLIFY_BUILDING_PARTS, tiles
 from catatom2osm.geo.geometry import Geometry
 from catatom2osm.geo.layer.fixme import FixmeLayer
 from catatom2osm.geo.layer.polygon import PolygonLayer
 from catatom2osm.geo.point import Point
 from catatom2osm.geo.tools import get_attributes, is_inside
+from catatom2osm.profiler import stage
 from catatom2osm.report import instance as report
 
 log = logging.getLogger(config.app_name)
@@ -76,6 +77,10 @@ class ConsLayer(PolygonLayer):
         """Trim to parcel id."""
         return feat["localId"].split("_")[0].split(".")[-1]
 
+    def get_tile_key(self, feature):
+        """Clean each building with its parts and pools in the same tile."""
+        return self.get_id(feature)
+
     def explode_multi_parts(self, address=False):
         request = QgsFeatureRequest()
         if address:
@@ -90,6 +95,10 @@ class ConsLayer(PolygonLayer):
             translate.building_tags, data, tags=tags, upload=upload
         )
 
+    def to_wkb(self):
+        """Export to WKB."""
+        return super(ConsLayer, self).to_wkb(translate.building_tags)
+
     def index_of_parts(self):
         """Index parts of building by building localid."""
         parts = defaultdict(list)
@@ -136,6 +145,7 @@ class ConsLayer(PolygonLayer):
             log.debug(_("Removed %d parts without building"), len(to_clean))
             report.parts_wo_building = len(to_clean)
 
+    @stage(features=True)
     def remove_outside_parts(self):
         """
         Remove parts outside the outline of it building.
@@ -267,6 +277,7 @@ class ConsLayer(PolygonLayer):
             new_geom = Geometry().fromPolygonXY(new_poly)
         return delete, new_geom
 
+    @stage(features=True)
     def merge_building_parts(self):
         """
         Apply merge_adjacent_parts to each set of building and its parts.
@@ -353,13 +364,17 @@ class ConsLayer(PolygonLayer):
             log.debug(_("Merged %d adjacent parts"), adjacent_parts_deleted)
             report.adjacent_parts = adjacent_parts_deleted
 
+    @stage(features=True)
     def clean(self):
         """
         Clean geometries.
 
         Delete invalid geometries and close vertices, add topological points,
-        merge building parts and simplify vertices.
+        merge building parts and simplify vertices. Use tiles if
+        config.clean_processes is not 1.
         """
+        if tiles.clean_in_tiles(self):
+            return
         self.delete_invalid_geometries(
             query_small_area=lambda feat: "_part" not in feat["localId"]
         )
@@ -425,6 +440,7 @@ class ConsLayer(PolygonLayer):
                         part.setGeometry(pg)
                         break
 
+    @stage(features=True)
     def move_address(self, address):
         """
         Try to move each entrance address to the nearest point in the building outline.
@@ -521,6 +537,7 @@ class ConsLayer(PolygonLayer):
         if to_change:
             self.writer.changeAttributeValues(to_change)
 
+    @stage(features=True)
     def conflate(self, current_bu_osm, delete=True):
         """
         Remove from current_bu_osm the buildings that don't have conflicts.
@@ -566,8 +583,7 @@ class ConsLayer(PolygonLayer):
                         el.tags["conflict"] = "yes"
             pbar.update()
         pbar.close()
-        for el in to_clean:
-            current_bu_osm.remove(el)
+        current_bu_osm.remove_many(to_clean)
         log.debug(
             _("Detected %d conflicts in %d buildings/pools from OSM"),
             conflicts,
@@ -5,10 +5,12 @@ from qgis.core import QgsFeature, QgsField, QgsGeometry, QgsRectangle
 from qgis.PyQt.QtCore import QVariant
 
 from catatom2osm import config
+from catatom2osm.geo import tiles
 from catatom2osm.geo.geometry import Geometry
 from catatom2osm.geo.layer.cons import ConsLayer
 from catatom2osm.geo.layer.polygon import PolygonLayer
 from catatom2osm.geo.tools import get_attributes, is_inside_area, merge_groups
+from catatom2osm.profiler import stage
 
 log = logging.getLogger(config.app_name)
 
@@ -41,6 +43,12 @@ class ParcelLayer(PolygonLayer):
         self.source_date = source_date
         self.mun_code = mun_code
 
+    def get_tile_kwargs(self):
+        """Return the arguments to create this layer in a tile worker."""
+        kwargs = super(ParcelLayer, self).get_tile_kwargs()
+        kwargs["mun_code"] = self.mun_code
+        return kwargs
+
     def delete_void_parcels(self, *sources):
         """Remove parcels without buildings (or pools)/addresses."""
         refs = []
@@ -176,6 +184,7 @@ class ParcelLayer(PolygonLayer):
         self.commitChanges()
         return tasks
 
+    @stage(features=True)
     def merge_by_adjacent_buildings(self, buildings):
         """Merge parcels with buildings sharing walls with in another parcel."""
 
@@ -254,6 +263,7 @@ class ParcelLayer(PolygonLayer):
                 pa_groups.append(group)
         return pa_groups, pa_refs, geometries, parts_count
 
+    @stage(features=True)
     def merge_by_parts_count(self, max_parts, buffer):
         """Merge parcels in groups with less than max_parts."""
         pa_groups, pa_refs, geometries, parts_count = self.get_groups_by_parts_count(
@@ -263,13 +273,16 @@ class ParcelLayer(PolygonLayer):
         tasks = self.update_parts_count(pa_groups, pa_refs, parts_count)
         return tasks
 
+    @stage(features=True)
     def clean(self):
         """
         Clean geometries.
 
         Delete invalid geometries and close vertices, add topological points
-        and simplify vertices.
+        and simplify vertices. Use tiles if config.clean_processes is not 1.
         """
+        if tiles.clean_in_tiles(self):
+            return
         self.delete_invalid_geometries()
         self.topology()
         self.simplify()
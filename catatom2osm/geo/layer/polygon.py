@@ -1,7 +1,14 @@
 import logging
 from collections import Counter, defaultdict
 
-from qgis.core import QgsFeature, QgsFeatureRequest, QgsFields, QgsGeometry
+from qgis.core import (
+    QgsFeature,
+    QgsFeatureRequest,
+    QgsFields,
+    QgsGeometry,
+    QgsWkbTypes,
+)
+from qgis.PyQt.QtCore import QVariant
 
 from catatom2osm import config
 from catatom2osm.geo import BUFFER_SIZE
@@ -9,12 +16,25 @@ from catatom2osm.geo.debug import DebugWriter
 from catatom2osm.geo.geometry import Geometry
 from catatom2osm.geo.layer.base import BaseLayer
 from catatom2osm.geo.point import Point
+from catatom2osm.geo.rings import CornerContext, SpikeContext
+from catatom2osm.geo.snap import SnapIndex
 from catatom2osm.geo.tools import is_inside, is_inside_area, merge_groups
 from catatom2osm.geo.types import WKBPolygon
+from catatom2osm.profiler import stage
 from catatom2osm.report import instance as report
 
 log = logging.getLogger(config.app_name)
 
+# Memory provider type of each field type, string for the others
+MEMORY_TYPES = {
+    QVariant.Int: "integer",
+    QVariant.LongLong: "long",
+    QVariant.Double: "double",
+    QVariant.Date: "date",
+    QVariant.DateTime: "datetime",
+    QVariant.Bool: "boolean",
+}
+
 
 class PolygonLayer(BaseLayer):
     """Base class for polygon layers."""
@@ -29,6 +49,34 @@ class PolygonLayer(BaseLayer):
         self.straight_thr = config.straight_thr
         # Threshold for topological points
         self.dist_thr = config.dist_thr
+        # Threshold in degrees to remove acute angle vertices
+        self.acute_thr = config.acute_thr
+        # Threshold in degrees of acute angles for invalid geometries
+        self.acute_inv = config.acute_inv
+        # Threshold in meters to filter angles for zig-zag and spikes
+        self.dist_inv = config.dist_inv
+
+    def get_tile_key(self, feature):
+        """Return the key of the group of features to clean in the same tile."""
+        return feature.id()
+
+    def get_tile_kwargs(self):
+        """
+        Return the arguments to create this layer in a tile worker.
+
+        The worker layer is a memory layer with the geometry type and the
+        fields of this one, in the same order.
+        """
+        fields = []
+        for field in self.fields():
+            ftype = MEMORY_TYPES.get(field.type(), "string")
+            if field.length() > 0:
+                ftype += "({},{})".format(field.length(), field.precision())
+            fields.append("field={}:{}".format(field.name(), ftype))
+        path = QgsWkbTypes.displayString(self.wkbType())
+        if fields:
+            path += "?" + "&".join(fields)
+        return {"path": path, "baseName": self.name(), "providerLib": "memory"}
 
     def get_area(self):
         """Return sum of all features area."""
@@ -92,8 +140,12 @@ class PolygonLayer(BaseLayer):
         geometry of feature with id 'feature_id' is shared with another
         geometry.
         """
-        parents = [gid for gid in parents_per_vx[va.asWkt()] if gid != feature_id]
-        parents += [gid for gid in parents_per_vx[vb.asWkt()] if gid != feature_id]
+        parents = [
+            gid
+            for v in (va, vb)
+            for gid in parents_per_vx[(v.x(), v.y())]
+            if gid != feature_id
+        ]
         return any([c > 1 for c in Counter(parents).values()])
 
     def get_parents_per_vertex_and_geometries(self, expression=""):
@@ -101,7 +153,8 @@ class PolygonLayer(BaseLayer):
         Auxiliary indexes for vertex of geometries.
 
         Returns:
-            (dict) parent fids for each vertex, (dict) geometry for each fid.
+            (dict) parent fids for each vertex coordinates pair,
+            (dict) geometry for each fid.
         Precondition:
             Called before reproject.
         """
@@ -111,7 +164,7 @@ class PolygonLayer(BaseLayer):
             geom = QgsGeometry(feature.geometry())
             geometries[feature.id()] = geom
             for point in Geometry.get_vertices_list(feature):
-                parents_per_vertex[point.asWkt()].append(feature.id())
+                parents_per_vertex[(point.x(), point.y())].append(feature.id())
         return (parents_per_vertex, geometries)
 
     def get_contacts_and_geometries(self, expression=""):
@@ -143,14 +196,14 @@ class PolygonLayer(BaseLayer):
             expression
         )
         adjs = []
-        for (wkt, parents) in parents_per_vertex.items():
-            point = Point(wkt)
+        for (vertex, parents) in parents_per_vertex.items():
             if len(parents) > 1:
+                point = Point(vertex)
                 for fid in parents:
                     geom = geometries[fid]
                     (point, ndx, ndxa, ndxb, dist) = geom.closestVertex(point)
-                    next = Point(geom.vertexAt(ndxb))
-                    parents_next = parents_per_vertex[next.asWkt()]
+                    next = geom.vertexAt(ndxb)
+                    parents_next = parents_per_vertex[(next.x(), next.y())]
                     common = set(x for x in parents if x in parents_next)
                     if len(common) > 1:
                         adjs.append(common)
@@ -158,6 +211,7 @@ class PolygonLayer(BaseLayer):
         groups = merge_groups(adjs)
         return (groups, geometries)
 
+    @stage(features=True)
     def topology(self, dup_thr=False):
         """Add to nearest segments each vertex in a polygon layer."""
         threshold = self.dist_thr  # Distance threshold to create nodes
@@ -168,7 +222,7 @@ class PolygonLayer(BaseLayer):
         if log.app_level <= logging.DEBUG:
             debshp = DebugWriter("debug_topology.shp", self)
         geometries = {f.id(): QgsGeometry(f.geometry()) for f in self.getFeatures()}
-        index = self.get_index()
+        snap = SnapIndex(geometries, threshold, dup_thr)
         to_change = {}
         nodes = set()
         pbar = self.get_progressbar(_("Topology"), len(geometries))
@@ -176,9 +230,9 @@ class PolygonLayer(BaseLayer):
             if geom.area() < config.min_area:
                 continue
             for point in frozenset(Geometry.get_outer_vertices(geom)):
-                if point not in nodes:
-                    area_of_candidates = Point(point).boundingBox(threshold)
-                    fids = index.intersects(area_of_candidates)
+                key = (point.x(), point.y())
+                if key not in nodes:
+                    fids = snap.get_candidates(key, dup_thr, threshold)
                     for fid in fids:
                         g = QgsGeometry(geometries[fid])
                         (p, ndx, ndxa, ndxb, dist_v) = g.closestVertex(point)
@@ -202,8 +256,8 @@ class PolygonLayer(BaseLayer):
                                         point.x(),
                                         point.y(),
                                     )
-                                    nodes.add(p)
-                                    nodes.add(va)
+                                    nodes.add((p.x(), p.y()))
+                                    nodes.add((va.x(), va.y()))
                                     td += 1
                             if dist_b < dup_thr**2:
                                 g.deleteVertex(ndxb)
@@ -216,8 +270,8 @@ class PolygonLayer(BaseLayer):
                                         point.x(),
                                         point.y(),
                                     )
-                                    nodes.add(p)
-                                    nodes.add(vb)
+                                    nodes.add((p.x(), p.y()))
+                                    nodes.add((vb.x(), vb.y()))
                                     td += 1
                         elif dist_v < dup_thr**2:
                             g.moveVertex(point.x(), point.y(), ndx)
@@ -230,7 +284,7 @@ class PolygonLayer(BaseLayer):
                                     point.x(),
                                     point.y(),
                                 )
-                                nodes.add(p)
+                                nodes.add((p.x(), p.y()))
                                 td += 1
                         elif (
                             dist_s < threshold**2 and closest != va and closest != vb
@@ -253,6 +307,7 @@ class PolygonLayer(BaseLayer):
                         if note.startswith("Merge") or note.startswith("Add"):
                             to_change[fid] = g
                             geometries[fid] = g
+                            snap.update(fid, g)
                         if note and log.app_level <= logging.DEBUG:
                             debshp.add_point(point, note)
             if len(to_change) > BUFFER_SIZE:
@@ -280,6 +335,7 @@ class PolygonLayer(BaseLayer):
         if len(to_change) > 0:
             self.writer.changeGeometryValues(to_change)
 
+    @stage(features=True)
     def delete_small_geometries(self):
         to_clean = []
         for feat in self.getFeatures():
@@ -293,12 +349,15 @@ class PolygonLayer(BaseLayer):
             log.debug(msg, len(to_clean), self.name())
             report.inc("geom_invalid_" + self.name(), len(to_clean))
 
+    @stage(features=True)
     def delete_invalid_geometries(self, query_small_area=lambda feat: True):
         """
         Delete invalid geometries.
 
         Test if any of it acute angle vertex could be deleted.
         Also removes zig-zag and spike vertex (see Point.get_spike_context).
+        The context of the vertices is computed for all the geometry at once
+        with SpikeContext.
         """
         if log.app_level <= logging.DEBUG:
             debshp = DebugWriter("debug_notvalid.shp", self, QgsFields(), WKBPolygon)
@@ -316,6 +375,7 @@ class PolygonLayer(BaseLayer):
         for feat in self.getFeatures():
             fid = feat.id()
             geom = feat.geometry()
+            context = None
             badgeom = False
             pn = 0
             for polygon in Geometry.get_multipolygon(geom):
@@ -324,6 +384,7 @@ class PolygonLayer(BaseLayer):
                 if g.area() < config.min_area and query_small_area(feat):
                     parts += 1
                     geom.deletePart(pn)
+                    context = None
                     to_change[fid] = geom
                     f.setGeometry(QgsGeometry(g))
                     if log.app_level <= logging.DEBUG:
@@ -335,6 +396,10 @@ class PolygonLayer(BaseLayer):
                         break
                     skip = False
                     for n, v in enumerate(ring[0:-1]):
+                        if context is None:
+                            context = SpikeContext(
+                                geom, self.acute_inv, self.straight_thr, self.dist_inv
+                            )
                         (
                             angle_v,
                             angle_a,
@@ -344,7 +409,7 @@ class PolygonLayer(BaseLayer):
                             is_zigzag,
                             is_spike,
                             vx,
-                        ) = Point(v).get_spike_context(geom)
+                        ) = context.get_spike_context((v.x(), v.y()))
                         if skip or not is_acute:
                             skip = False
                             continue
@@ -355,6 +420,7 @@ class PolygonLayer(BaseLayer):
                             if i > 0:
                                 rings += 1
                                 geom.deleteRing(i)
+                                context = None
                                 to_change[fid] = geom
                                 if log.app_level <= logging.DEBUG:
                                     debshp.addFeature(f)
@@ -378,6 +444,7 @@ class PolygonLayer(BaseLayer):
                                 valid = g.isGeosValid()
                                 if valid:
                                     geom = g
+                                    context = None
                                     zz += 1
                                     to_change[fid] = g
                                 if log.app_level <= logging.DEBUG:
@@ -399,6 +466,7 @@ class PolygonLayer(BaseLayer):
                                     spikes += 1
                                     skip = ndxa > ndx
                                     geom = g
+                                    context = None
                                     to_change[fid] = g
                                 if log.app_level <= logging.DEBUG:
                                     debshp2.add_point(vx, "vx %d %d" % (fid, ndx))
@@ -459,6 +527,7 @@ class PolygonLayer(BaseLayer):
             log.debug(msg, spikes, self.name())
             report.values["vertex_spike_" + self.name()] = spikes
 
+    @stage(features=True)
     def simplify(self):
         """
         Reduce the number of vertices in a polygon layer.
@@ -475,13 +544,15 @@ class PolygonLayer(BaseLayer):
         to_change = {}
         # Clean non corners
         (parents_per_vertex, geometries) = self.get_parents_per_vertex_and_geometries()
+        corners = CornerContext(
+            geometries, self.acute_thr, self.straight_thr, self.cath_thr
+        )
         pbar = self.get_progressbar(_("Simplify"), len(parents_per_vertex))
-        for wkt, parents in parents_per_vertex.items():
-            point = Point(wkt)
+        for vertex, parents in parents_per_vertex.items():
             # Test if this vertex is a 'corner' in any of its parent polygons
             for fid in parents:
-                geom = geometries[fid]
-                (angle, is_acute, is_corner, cath) = point.get_corner_context(geom)
+                context = corners.get_corner_context(fid, vertex)
+                (angle, is_acute, is_corner, cath) = context
                 debmsg = "angle=%.1f, is_acute=%s, is_corner=%s, cath=%.4f" % (
                     angle,
                     is_acute,
@@ -490,6 +561,7 @@ class PolygonLayer(BaseLayer):
                 )
                 if is_corner:
                     break
+            point = Point(vertex)
             msg = "Keep"
             if not is_corner:
                 killed += 1  # delete the vertex from all its parents.
@@ -506,6 +578,7 @@ class PolygonLayer(BaseLayer):
                     if Geometry.is_valid(g) and not invalid_ring:
                         parents.remove(fid)
                         geometries[fid] = g
+                        corners.reset(fid)
                         to_change[fid] = g
                         msg = "Deleted"
             if log.app_level <= logging.DEBUG:
@@ -568,6 +641,7 @@ class PolygonLayer(BaseLayer):
             log.debug(msg, count_adj, count_com, self.name())
         return to_change, to_clean
 
+    @stage(features=True)
     def merge_adjacents(self):
         """Merge polygons with shared segments."""
         (groups, geometries) = self.get_adjacents_and_geometries()
@@ -595,6 +669,7 @@ class PolygonLayer(BaseLayer):
                 self.writer.changeGeometryValues({feat.id(): g1})
         pbar.close()
 
+    @stage(features=True)
     def clean(self):
         """
         Clean geometries.
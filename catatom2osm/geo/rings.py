@@ -0,0 +1,328 @@
+"""Vectorized analysis of the vertices of polygon rings with NumPy."""
+import struct
+
+import numpy as np
+
+from catatom2osm import config
+from catatom2osm.geo.point import Point
+
+WKB_POLYGON = 3
+WKB_MULTIPOLYGON = 6
+
+
+def get_rings(geom):
+    """
+    Return the rings of a polygon or multipolygon geometry.
+
+    Args:
+        geom (QgsGeometry): Geometry to read.
+
+    Returns:
+        (list) array of coordinates with shape (n, 2) for each ring, without
+        the closing vertex, in the same order as the geometry vertices.
+    """
+    buf = bytes(geom.asWkb())
+    rings = []
+    if buf:
+        _read_rings(buf, 0, rings)
+    return rings
+
+
+def _read_rings(buf, pos, rings):
+    bo = "<" if buf[pos] == 1 else ">"
+    (code,) = struct.unpack_from(bo + "I", buf, pos + 1)
+    pos += 5
+    dims = 2
+    if code & 0xE0000000:
+        dims += bool(code & 0x80000000) + bool(code & 0x40000000)
+        if code & 0x20000000:
+            pos += 4
+        code &= 0xFFFF
+    dims += (code // 1000 + 1) // 2
+    geom_type = code % 1000
+    (count,) = struct.unpack_from(bo + "I", buf, pos)
+    pos += 4
+    if geom_type == WKB_MULTIPOLYGON:
+        for i in range(count):
+            pos = _read_rings(buf, pos, rings)
+    elif geom_type == WKB_POLYGON:
+        dtype = np.dtype(bo + "f8")
+        for i in range(count):
+            (size,) = struct.unpack_from(bo + "I", buf, pos)
+            pos += 4
+            coords = np.frombuffer(buf, dtype, size * dims, pos)
+            rings.append(coords.reshape(size, dims)[:-1, :2].astype(float))
+            pos += 8 * size * dims
+    else:
+        raise ValueError("Unsupported WKB geometry type %d" % code)
+    return pos
+
+
+def get_positions(rings):
+    """
+    Index the vertices of the rings by its coordinates.
+
+    Returns:
+        (dict) position in the concatenated rings of the vertex that
+        QgsGeometry.closestVertex returns for each pair of coordinates (the
+        last one if there are duplicates, the first vertex of a ring counts
+        as its closing vertex).
+    """
+    positions = {}
+    offset = 0
+    for ring in rings:
+        vertices = list(map(tuple, ring.tolist()))
+        for (i, vertex) in enumerate(vertices[1:] + vertices[:1], 1):
+            positions[vertex] = offset + i % len(vertices)
+        offset += len(vertices)
+    return positions
+
+
+def azimuth(p, q):
+    """Azimuth in degrees from each point in p to each point in q."""
+    d = q - p
+    return np.degrees(np.arctan2(d[:, 0], d[:, 1]))
+
+
+def get_corner_context(ring):
+    """
+    Angles and cathetus of all the vertices of a ring.
+
+    Same values as Point.get_corner_context for each vertex.
+
+    Args:
+        ring (array): coordinates of the ring without the closing vertex.
+
+    Returns:
+        (array) Angle between each vertex and their adjacents.
+        (array) Distance from each vertex to the segment of their adjacents.
+    """
+    va = np.roll(ring, 1, axis=0)
+    vb = np.roll(ring, -1, axis=0)
+    angle = np.abs(azimuth(ring, va) - azimuth(ring, vb))
+    a = np.abs(azimuth(va, ring) - azimuth(va, vb))
+    h = np.sqrt(((ring - va) ** 2).sum(axis=1))
+    cath = np.abs(h * np.sin(np.radians(a)))
+    return angle, cath
+
+
+def get_spike_context(
+    rings,
+    acute_thr=None,
+    straight_thr=None,
+    threshold=None,
+):
+    """
+    Spike and zig-zag context of all the vertices of a geometry.
+
+    Same values as Point.get_spike_context for each vertex, also for the not
+    acute ones.
+
+    Args:
+        rings (list): coordinates of each ring without the closing vertex.
+        acute_thr (float): Acute angle threshold, config.acute_inv if None.
+        straight_thr (float): Straight angle threshold, config.straight_thr
+            if None.
+        threshold (float): # Filter for angles, config.dist_inv if None.
+
+    Returns:
+        (array) angle_v, angle_a, ndx, ndxa, is_acute, is_zigzag, is_spike
+        and vx (with shape (n, 2)) for the concatenated vertices of the rings.
+    """
+    if acute_thr is None:
+        acute_thr = config.acute_inv
+    if straight_thr is None:
+        straight_thr = config.straight_thr
+    if threshold is None:
+        threshold = config.dist_inv
+    positions = get_positions(rings)
+    v = np.concatenate(rings)
+    va = np.concatenate([np.roll(ring, 1, axis=0) for ring in rings])
+    vb = np.concatenate([np.roll(ring, -1, axis=0) for ring in rings])
+    ndx = []
+    ndx_a = []
+    ndx_b = []
+    pos_a = []
+    pos_b = []
+    (offset, pos) = (0, 0)
+    for ring in rings:
+        n = len(ring)
+        i = np.arange(n)
+        ndx.append(np.where(i == 0, offset + n, offset + i))
+        ndx_a.append(np.where(i == 0, offset + n - 1, offset + i - 1))
+        ndx_b.append(np.where(i == 0, offset + 1, offset + i + 1))
+        pos_a.append(pos + (i - 1) % n)
+        pos_b.append(pos + (i + 1) % n)
+        offset += n + 1
+        pos += n
+    (ndx, ndx_a, ndx_b, pos_a, pos_b) = map(
+        np.concatenate, (ndx, ndx_a, ndx_b, pos_a, pos_b)
+    )
+    last = np.array([positions[vertex] for vertex in map(tuple, v.tolist())])
+    angle_v = np.abs(azimuth(v, va) - azimuth(v, vb))
+    na = np.where(angle_v < 180, angle_v, 360 - angle_v)
+    is_acute = na < acute_thr
+    dist_a = np.sqrt(((va - v) ** 2).sum(axis=1))
+    dist_b = np.sqrt(((vb - v) ** 2).sum(axis=1))
+    swap = dist_a > dist_b  # set va as the closest adjacent
+    ndxa = np.where(swap, ndx_b, ndx_a)
+    angle_a = angle_v[last[np.where(swap, pos_b, pos_a)]]
+    (dist_a, dist_b) = (np.minimum(dist_a, dist_b), np.maximum(dist_a, dist_b))
+    vb = np.where(swap[:, None], va, vb)
+    c = np.abs(np.sin(np.radians(angle_v))) * dist_a
+    is_zigzag = is_acute & (angle_a < acute_thr) & (c < threshold)
+    is_spike = is_acute & (np.abs(180 - angle_a) > straight_thr) & (c < threshold)
+    gamma = np.abs(90 + angle_v - angle_a)
+    dx = np.abs(
+        dist_a
+        * (
+            np.cos(np.radians(angle_v))
+            + np.tan(np.radians(gamma)) * np.sin(np.radians(angle_v))
+        )
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vx = v + (vb - v) * (dx / dist_b)[:, None]
+    return angle_v, angle_a, ndx, ndxa, is_acute, is_zigzag, is_spike, vx
+
+
+class SpikeContext(object):
+    """Spike and zig-zag context of the vertices of a geometry."""
+
+    def __init__(
+        self,
+        geom,
+        acute_thr=None,
+        straight_thr=None,
+        threshold=None,
+    ):
+        """
+        Compute the context of all the vertices of the geometry.
+
+        Args:
+            geom (QgsGeometry): Geometry to test.
+            acute_thr (float): Acute angle threshold, config.acute_inv if None.
+            straight_thr (float): Straight angle threshold, config.straight_thr
+                if None.
+            threshold (float): # Filter for angles, config.dist_inv if None.
+        """
+        self.geom = geom
+        self.acute_thr = config.acute_inv if acute_thr is None else acute_thr
+        self.straight_thr = (
+            config.straight_thr if straight_thr is None else straight_thr
+        )
+        self.threshold = config.dist_inv if threshold is None else threshold
+        rings = [ring for ring in get_rings(geom) if len(ring)]
+        self.positions = get_positions(rings)
+        self.context = []
+        if rings:
+            context = get_spike_context(
+                rings, self.acute_thr, self.straight_thr, self.threshold
+            )
+            self.context = [values.tolist() for values in context]
+
+    def get_spike_context(self, vertex):
+        """
+        Test if a vertex of the geometry is spike.
+
+        Equivalent to Point.get_spike_context for the vertex of the geometry
+        with the given coordinates.
+
+        Args:
+            vertex (tuple): coordinates of the vertex.
+
+        Returns:
+            Same values as Point.get_spike_context.
+        """
+        i = self.positions.get(vertex)
+        if i is None:
+            return Point(vertex).get_spike_context(
+                self.geom, self.acute_thr, self.straight_thr, self.threshold
+            )
+        (angle_v, angle_a, ndx, ndxa, is_acute, is_zigzag, is_spike, vx) = [
+            values[i] for values in self.context
+        ]
+        if not is_acute:
+            return angle_v, None, ndx, None, is_acute, False, False, None
+        if is_zigzag:
+            vx = None
+        else:
+            vx = Point(*vx)
+        return angle_v, angle_a, ndx, ndxa, is_acute, is_zigzag, is_spike, vx
+
+
+class CornerContext(object):
+    """Corner context of the vertices of a set of geometries."""
+
+    def __init__(
+        self,
+        geometries,
+        acute_thr=None,
+        straight_thr=None,
+        cath_thr=None,
+    ):
+        """
+        Prepare an empty cache for the geometries.
+
+        Args:
+            geometries (dict): geometry for each feature id.
+            acute_thr (float): Acute angle threshold, config.acute_thr if None.
+            straight_thr (float): Straight angle threshold, config.straight_thr
+                if None.
+            cath_thr (float): Cathetus threshold, config.dist_thr if None.
+        """
+        self.geometries = geometries
+        self.acute_thr = config.acute_thr if acute_thr is None else acute_thr
+        self.straight_thr = (
+            config.straight_thr if straight_thr is None else straight_thr
+        )
+        self.cath_thr = config.dist_thr if cath_thr is None else cath_thr
+        self.cache = {}
+
+    def get_rings_context(self, fid):
+        """Position of each vertex, angles and cathetus of a geometry."""
+        if fid not in self.cache:
+            rings = get_rings(self.geometries[fid])
+            positions = get_positions(rings)
+            angles = []
+            caths = []
+            for ring in rings:
+                (angle, cath) = get_corner_context(ring)
+                angles += angle.tolist()
+                caths += cath.tolist()
+            self.cache[fid] = (positions, angles, caths)
+        return self.cache[fid]
+
+    def reset(self, fid):
+        """Discard the context of a geometry after a change."""
+        self.cache.pop(fid, None)
+
+    def get_corner_context(self, fid, vertex):
+        """
+        Test if a vertex of a geometry is a corner.
+
+        Equivalent to Point.get_corner_context for the vertex of the geometry
+        with the given coordinates.
+
+        Args:
+            fid (int): feature id of the geometry in geometries.
+            vertex (tuple): coordinates of the vertex.
+
+        Returns:
+            (float) Angle between the vertex and their adjacents.
+            (bool)  True if the angle is too low (< acute_thr).
+            (bool)  True for a corner
+            (float) Distance to the nearest segment.
+        """
+        (positions, angles, caths) = self.get_rings_context(fid)
+        i = positions.get(vertex)
+        if i is None:
+            return Point(vertex).get_corner_context(
+                self.geometries[fid], self.acute_thr, self.straight_thr, self.cath_thr
+            )
+        angle = angles[i]
+        cath = caths[i]
+        is_corner = abs(180 - angle) > self.straight_thr and cath > self.cath_thr
+        is_acute = (
+            angle < self.acute_thr if angle < 180 else 360 - angle < self.acute_thr
+        )
+        return (angle, is_acute, is_corner, cath)
@@ -0,0 +1,136 @@
+"""Spatial hash of the vertices and segments of polygons for snapping."""
+import math
+from collections import defaultdict
+
+import numpy as np
+
+from catatom2osm.geo.rings import get_rings
+
+CELL_SIZE = 10  # Side in meters of the cells of the grid
+
+
+class SnapIndex(object):
+    """
+    Grid of the segments of a set of polygon geometries.
+
+    Finds the geometries that could be snapped to a point without copying them
+    or querying QGIS. The candidates are the geometries whose bounding box
+    intersects the square around the point (like a QgsSpatialIndex built with
+    the original geometries) and that have a vertex or segment close enough
+    to merge the point or insert it as a topological point.
+    """
+
+    def __init__(self, geometries, radius, reach=0, cell_size=CELL_SIZE):
+        """
+        Build the grid with the vertices and segments of the geometries.
+
+        Args:
+            geometries (dict): geometry for each feature id.
+            radius (float): Half the side of the square to search candidates.
+            reach (float): Maximum distance to snap if greater than radius.
+            cell_size (float): Side of the cells of the grid.
+        """
+        self.radius = radius
+        self.cell_size = max(cell_size, 2 * radius, 2 * reach)
+        self.grid = defaultdict(set)
+        self.bboxes = {}
+        self.rings = {}
+        for (fid, geom) in geometries.items():
+            self.update(fid, geom)
+            if fid in self.rings:
+                v = self.rings[fid][0]
+                self.bboxes[fid] = np.concatenate([v.min(axis=0), v.max(axis=0)])
+
+    def update(self, fid, geom):
+        """Add to the grid the vertices and segments of a changed geometry."""
+        rings = [ring for ring in get_rings(geom) if len(ring)]
+        if not rings:
+            self.rings.pop(fid, None)
+            return
+        v = np.concatenate(rings)
+        va = np.concatenate([np.roll(ring, 1, axis=0) for ring in rings])
+        vb = np.concatenate([np.roll(ring, -1, axis=0) for ring in rings])
+        self.rings[fid] = (v, va, vb)
+        # Sample each segment at steps of half a cell
+        d = vb - v
+        step = self.cell_size / 2
+        n = np.ceil(np.sqrt((d**2).sum(axis=1)) / step).astype(int) + 1
+        ndx = np.repeat(np.arange(len(v)), n)
+        k = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        t = k / np.repeat(np.maximum(n - 1, 1), n)
+        samples = v[ndx] + d[ndx] * t[:, None]
+        cells = np.unique(np.floor(samples / self.cell_size).astype(np.int64), axis=0)
+        for cell in map(tuple, cells.tolist()):
+            self.grid[cell].add(fid)
+
+    def get_fids(self, point):
+        """Return the geometries with segments near to the point coordinates."""
+        (x, y) = point
+        cx = math.floor(x / self.cell_size)
+        cy = math.floor(y / self.cell_size)
+        fids = set()
+        for i in (cx - 1, cx, cx + 1):
+            for j in (cy - 1, cy, cy + 1):
+                fids.update(self.grid.get((i, j), ()))
+        (x0, y0, x1, y1) = (
+            x - self.radius,
+            y - self.radius,
+            x + self.radius,
+            y + self.radius,
+        )
+        return [
+            fid
+            for fid in fids
+            if fid in self.bboxes
+            and fid in self.rings
+            and not (
+                self.bboxes[fid][0] > x1
+                or self.bboxes[fid][2] < x0
+                or self.bboxes[fid][1] > y1
+                or self.bboxes[fid][3] < y0
+            )
+        ]
+
+    def get_candidates(self, point, dup_thr, threshold):
+        """
+        Return the geometries that could be snapped to a point.
+
+        A geometry is a candidate if it has a vertex in the point with an
+        adjacent vertex closer than dup_thr, a vertex closer than dup_thr or
+        a segment closer than threshold. All the candidates are tested at
+        once. The distances are enlarged by a tiny factor so that no geometry
+        that QGIS would snap is missed.
+
+        Args:
+            point (tuple): coordinates of the point.
+            dup_thr (float): Distance to merge vertices.
+            threshold (float): Distance to insert topological points.
+
+        Returns:
+            (list) feature ids.
+        """
+        fids = self.get_fids(point)
+        if not fids:
+            return []
+        rings = [self.rings[fid] for fid in fids]
+        sizes = [len(v) for (v, va, vb) in rings]
+        offsets = np.cumsum([0] + sizes[:-1])
+        (v, va, vb) = [np.concatenate(arrays) for arrays in zip(*rings)]
+        p = np.array(point, dtype=float)
+        dup2 = dup_thr**2 * (1 + 1e-9)
+        thr2 = threshold**2 * (1 + 1e-9)
+        dist_v = ((v - p) ** 2).sum(axis=1)
+        d = vb - v
+        length = (d**2).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.clip(((p - v) * d).sum(axis=1) / length, 0, 1)
+        t = np.where(length > 0, t, 0)
+        dist_s = ((v + d * t[:, None] - p) ** 2).sum(axis=1)
+        dupe = (dist_v == 0) & (
+            (((va - p) ** 2).sum(axis=1) < dup2) | (((vb - p) ** 2).sum(axis=1) < dup2)
+        )
+        min_v = np.minimum.reduceat(dist_v, offsets)
+        min_s = np.minimum.reduceat(dist_s, offsets)
+        has_dupe = np.logical_or.reduceat(dupe, offsets)
+        near = np.where(min_v == 0, has_dupe, (min_v < dup2) | (min_s < thr2))
+        return [fid for (fid, is_near) in zip(fids, near.tolist()) if is_near]
@@ -0,0 +1,303 @@
+"""
+Parallel cleaning of polygon layers in spatial tiles.
+
+The features that must be cleaned together (for example a building with its
+parts and pools) are grouped, and the groups whose bounding boxes enlarged
+with a halo intersect are joined in clusters. No cleaning step moves or
+relates vertices farther than the halo, so each cluster can be cleaned
+apart with the same result as the whole layer. The clusters go to the tile
+containing the center of their bounding box, and a pool of processes cleans
+the tiles, each one in a memory layer of the same class.
+"""
+import logging
+import math
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+from qgis.core import (
+    QgsApplication,
+    QgsCoordinateReferenceSystem,
+    QgsFeature,
+    QgsGeometry,
+)
+from qgis.PyQt.QtCore import QVariant
+
+from catatom2osm import config
+from catatom2osm.report import instance as report
+
+log = logging.getLogger(config.app_name)
+
+SETTINGS = (
+    "dup_thr",
+    "dist_thr",
+    "straight_thr",
+    "acute_thr",
+    "min_area",
+    "acute_inv",
+    "dist_inv",
+)
+
+CLUSTER_CELLS = 20  # Cells by tile side of the grid to find the near groups
+
+_qgs = None  # QGIS application of the worker processes
+
+
+def get_workers():
+    """Return the number of processes to clean geometries."""
+    return config.clean_processes or os.cpu_count() or 1
+
+
+def get_clusters(bboxes, halo, cell):
+    """
+    Join the groups of features near each other.
+
+    Args:
+        bboxes (dict): Bounding box (xmin, ymin, xmax, ymax) of each group.
+        halo (float): Distance to enlarge the bounding boxes.
+        cell (float): Side of the cells of the grid used to find the groups.
+
+    Returns:
+        (list) keys of the groups of each cluster. The enlarged bounding
+        boxes of groups in different clusters don't intersect.
+    """
+    keys = list(bboxes.keys())
+    parent = list(range(len(keys)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    grid = defaultdict(list)
+    boxes = []
+    for (i, key) in enumerate(keys):
+        (xmin, ymin, xmax, ymax) = bboxes[key]
+        box = (xmin - halo, ymin - halo, xmax + halo, ymax + halo)
+        boxes.append(box)
+        for cx in range(math.floor(box[0] / cell), math.floor(box[2] / cell) + 1):
+            for cy in range(math.floor(box[1] / cell), math.floor(box[3] / cell) + 1):
+                for j in grid[(cx, cy)]:
+                    b = boxes[j]
+                    if find(j) != find(i) and not (
+                        b[0] > box[2] or b[2] < box[0] or b[1] > box[3] or b[3] < box[1]
+                    ):
+                        parent[find(j)] = find(i)
+                grid[(cx, cy)].append(i)
+    clusters = defaultdict(list)
+    for (i, key) in enumerate(keys):
+        clusters[find(i)].append(key)
+    return list(clusters.values())
+
+
+def partition(bboxes, size):
+    """
+    Distribute bounding boxes in tiles.
+
+    Args:
+        bboxes (dict): Bounding box (xmin, ymin, xmax, ymax) of each cluster.
+        size (float): Side of the tiles.
+
+    Returns:
+        (dict) keys of the clusters with the center inside each tile.
+    """
+    tiles = defaultdict(list)
+    for (key, (xmin, ymin, xmax, ymax)) in bboxes.items():
+        i = math.floor((xmin + xmax) / 2 / size)
+        j = math.floor((ymin + ymax) / 2 / size)
+        tiles[(i, j)].append(key)
+    return tiles
+
+
+def union(bbox1, bbox2):
+    """Return the bounding box of two bounding boxes."""
+    return (
+        min(bbox1[0], bbox2[0]),
+        min(bbox1[1], bbox2[1]),
+        max(bbox1[2], bbox2[2]),
+        max(bbox1[3], bbox2[3]),
+    )
+
+
+def read_feature(feat):
+    """Return the id, WKB geometry and attributes (NULL as None) of a feature."""
+    attrs = [None if isinstance(v, QVariant) else v for v in feat.attributes()]
+    return feat.id(), bytes(feat.geometry().asWkb()), attrs
+
+
+def read_features(features):
+    """Return the id, WKB geometry and attributes of each feature."""
+    return [read_feature(feat) for feat in features]
+
+
+def init_worker(settings, app_level):
+    """Apply the parent configuration and start QGIS in a worker process."""
+    global _qgs
+    for (key, value) in settings.items():
+        setattr(config, key, value)
+    config.clean_processes = 1
+    config.report_system_info = False
+    config.show_progress_bars = False
+    log.app_level = app_level
+    _qgs = QgsApplication([], False)
+    qgis_prefix = os.getenv("QGISHOME")
+    if qgis_prefix:
+        QgsApplication.setPrefixPath(qgis_prefix, True)
+    QgsApplication.initQgis()
+
+
+def clean_features(cls, kwargs, crs, features):
+    """
+    Clean a set of features in a memory layer.
+
+    Returns:
+        (PolygonLayer) cleaned layer.
+        (dict) original id of each feature in the layer.
+        (dict) numeric report values of the cleaning.
+    """
+    layer = cls(**kwargs)
+    layer.setCrs(QgsCoordinateReferenceSystem(crs))
+    to_add = []
+    for (fid, wkb, attrs) in features:
+        feat = QgsFeature(layer.fields())
+        geom = QgsGeometry()
+        geom.fromWkb(wkb)
+        feat.setGeometry(geom)
+        feat.setAttributes(attrs)
+        to_add.append(feat)
+    (res, added) = layer.writer.addFeatures(to_add)
+    ids = {feat.id(): fid for (feat, (fid, wkb, attrs)) in zip(added, features)}
+    report.clear()
+    keys = set(report.values.keys())
+    layer.clean()
+    values = {
+        k: v
+        for (k, v) in report.values.items()
+        if k not in keys and isinstance(v, (int, float))
+    }
+    return layer, ids, values
+
+
+def clean_tile(cls, kwargs, crs, features):
+    """
+    Clean a set of features in a memory layer.
+
+    Args:
+        cls (type): Class of the layer.
+        kwargs (dict): Arguments to create the layer.
+        crs (str): Authority identifier of the layer CRS.
+        features (list): id, WKB geometry and attributes of each feature.
+
+    Returns:
+        (list) id, WKB geometry and attributes of the remaining features.
+        (list) ids of the deleted features.
+        (dict) report values.
+    """
+    (layer, ids, values) = clean_features(cls, kwargs, crs, features)
+    remaining = [
+        (ids[fid], wkb, attrs)
+        for (fid, wkb, attrs) in read_features(layer.getFeatures())
+    ]
+    deleted = {fid for (fid, wkb, attrs) in features}
+    deleted -= {fid for (fid, wkb, attrs) in remaining}
+    return remaining, sorted(deleted), values
+
+
+def update_layer(layer, originals, result):
+    """Write in the layer the changes of a cleaned tile."""
+    (features, deleted, values) = result
+    to_change = {}
+    to_change_g = {}
+    for (fid, wkb, attrs) in features:
+        (old_wkb, old_attrs) = originals[fid]
+        if wkb != old_wkb:
+            geom = QgsGeometry()
+            geom.fromWkb(wkb)
+            to_change_g[fid] = geom
+        if attrs != old_attrs:
+            to_change[fid] = {
+                i: v for (i, (v, old)) in enumerate(zip(attrs, old_attrs)) if v != old
+            }
+    if to_change:
+        layer.writer.changeAttributeValues(to_change)
+    if to_change_g:
+        layer.writer.changeGeometryValues(to_change_g)
+    if deleted:
+        layer.writer.deleteFeatures(deleted)
+    report.merge(values)
+
+
+def clean_in_tiles(layer, size=None):
+    """
+    Clean a polygon layer in tiles with a pool of processes.
+
+    Features with the same layer.get_tile_key value are cleaned together.
+    The layer is created again in the workers with its class and the
+    arguments from layer.get_tile_kwargs().
+
+    Args:
+        layer (PolygonLayer): Layer to clean.
+        size (float): Side of the tiles, config.clean_tile_size if None.
+
+    Returns:
+        (bool) False if the layer must be cleaned in a single pass.
+    """
+    workers = get_workers()
+    if workers < 2 or log.app_level <= logging.DEBUG:
+        return False
+    size = size or config.clean_tile_size
+    halo = max(layer.dist_thr, layer.dup_thr)
+    records = {}
+    groups = defaultdict(list)
+    bboxes = {}
+    for feat in layer.getFeatures():
+        (fid, wkb, attrs) = read_feature(feat)
+        records[fid] = (wkb, attrs)
+        key = layer.get_tile_key(feat)
+        groups[key].append(fid)
+        r = feat.geometry().boundingBox()
+        bbox = (r.xMinimum(), r.yMinimum(), r.xMaximum(), r.yMaximum())
+        if key in bboxes:
+            bbox = union(bboxes[key], bbox)
+        bboxes[key] = bbox
+    clusters = get_clusters(bboxes, halo, size / CLUSTER_CELLS)
+    cluster_bboxes = {}
+    for (i, keys) in enumerate(clusters):
+        cluster_bboxes[i] = bboxes[keys[0]]
+        for key in keys[1:]:
+            cluster_bboxes[i] = union(cluster_bboxes[i], bboxes[key])
+    tiles = partition(cluster_bboxes, size)
+    if len(tiles) < 2:
+        return False
+    cls = type(layer)
+    kwargs = layer.get_tile_kwargs()
+    crs = layer.crs().authid()
+    settings = {key: getattr(config, key) for key in SETTINGS}
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context("spawn"),
+        initializer=init_worker,
+        initargs=(settings, log.app_level),
+    )
+    with executor:
+        futures = []
+        for indexes in tiles.values():
+            fids = sorted(
+                fid for i in indexes for key in clusters[i] for fid in groups[key]
+            )
+            features = [(fid,) + records[fid] for fid in fids]
+            futures.append(executor.submit(clean_tile, cls, kwargs, crs, features))
+        pbar = layer.get_progressbar(_("Clean"), len(futures))
+        for future in as_completed(futures):
+            update_layer(layer, records, future.result())
+            pbar.update()
+        pbar.close()
+    log.debug(
+        _("Cleaned %d tiles with %d clusters in the '%s' layer"),
+        len(tiles),
+        len(clusters),
+        layer.name(),
+    )
+    return True
@@ -24,18 +24,47 @@ def get_attributes(feat):
 
 
 def merge_groups(adjs):
-    """Merge all sets in adjs with common members."""
-    groups = []
-    while adjs:
-        group = set(adjs.pop())
-        lastlen = -1
-        while len(group) > lastlen:
-            lastlen = len(group)
-            for adj in adjs[:]:
-                for p in adj:
-                    if p in group:
-                        group |= set(adj)
-                        adjs.remove(adj)
-                        break
-        groups.append(group)
-    return groups
+    """
+    Merge all sets in adjs with common members.
+
+    Uses a disjoint-set forest with path compression and union by rank. The
+    groups are ordered by the position in adjs of its last set, descending.
+    """
+    parent = {}
+    rank = {}
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def union(a, b):
+        (ra, rb) = (find(a), find(b))
+        if ra == rb:
+            return
+        if rank[ra] < rank[rb]:
+            (ra, rb) = (rb, ra)
+        parent[rb] = ra
+        if rank[ra] == rank[rb]:
+            rank[ra] += 1
+
+    for adj in adjs:
+        first = None
+        for p in adj:
+            if p not in parent:
+                parent[p] = p
+                rank[p] = 0
+            if first is None:
+                first = p
+            else:
+                union(first, p)
+    groups = {}
+    last = {}
+    for i, adj in enumerate(adjs):
+        key = find(next(iter(adj))) if adj else object()
+        groups.setdefault(key, set()).update(adj)
+        last[key] = i
+    return [groups[key] for key in sorted(groups, key=last.get, reverse=True)]
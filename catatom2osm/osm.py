@@ -1,41 +1,58 @@
 """OpenStreetMap data model."""
+from array import array
 from collections import Counter, defaultdict
+from collections.abc import MutableMapping
+from weakref import WeakValueDictionary
 
 # Number of significant decimal digits. 0 to cancel rounding. With a value
 # greater than 7, JOSM give duplicated points errors
 COOR_DIGITS = 0
+# Default for new data sets. If True, nodes coordinates, ids, tags and metadata
+# are stored in columns (see NodeStore) instead of in node objects. Coordinates
+# are kept as floats and the nodes are iterated before the other elements.
+COMPACT_NODES = False
 
 
 class Osm(object):
     """Class to implement a OSM data set."""
 
-    def __init__(self, upload="never", generator=None):
+    _attr_list = ("upload", "version", "generator")
+
+    def __init__(self, upload="never", generator=None, compact=None):
         self.upload = upload
         self.version = "0.6"
         self.generator = generator
         self.counter = 0
         self.parents = defaultdict(set)
-        self.elements = set()
+        self.elements = {}  # dictionary used as an insertion ordered set
         self.index = {}  # elements by id
+        # elements by type, dictionaries used as ordered sets
+        self.registry = {"node": {}, "way": {}, "relation": {}}
         self.tags = {}
         self.note = None
         self.meta = None
-        self._attr_list = ("upload", "version", "generator")
+        self.node_store = None
+        if COMPACT_NODES if compact is None else compact:
+            self.node_store = NodeStore(self)
+            self.parents = NodeParents(self.node_store)
+            self.elements = NodeElements(self.node_store)
+            self.index = NodeIndex(self.node_store)
+            self.registry["node"] = self.node_store
 
     @property
     def nodes(self):
-        """Return list of nodes in elements."""
-        return [e for e in self.elements if isinstance(e, Node)]
+        """Return a view of the nodes in elements."""
+        return self.registry["node"].keys()
 
     @property
     def ways(self):
-        """Return list of ways in elements."""
-        return [e for e in self.elements if isinstance(e, Way)]
+        """Return a view of the ways in elements."""
+        return self.registry["way"].keys()
 
     @property
     def relations(self):
-        """Return list of relations in elements."""
-        return [e for e in self.elements if isinstance(e, Relation)]
+        """Return a view of the relations in elements."""
+        return self.registry["relation"].keys()
 
     @property
     def attrs(self):
@@ -49,6 +66,11 @@ class Osm(object):
             attrs.pop("upload")
         return attrs
 
+    @staticmethod
+    def sort_key(el):
+        """Key to sort elements by id, existing ones first, then the new ones."""
+        return (el.id <= 0, abs(el.id))
+
     def get(self, eid, etype="n"):
         """Return element by its id."""
         eid = str(eid)
@@ -56,34 +78,107 @@ class Osm(object):
             eid = etype[0].lower() + eid
         return self.index[eid]
 
-    def remove(self, el):
-        """Remove el from element, from its parents and its orphaned children."""
-        self.elements.discard(el)
+    def register(self, el):
+        """Add el to elements, to the index and to the registry of its type."""
+        self.elements[el] = None
+        self.index[el.fid] = el
+        if el.kind is not None:
+            self.registry[el.kind][el] = None
+
+    def unregister(self, el):
+        """Remove el from elements, from the index and from its type registry."""
+        self.elements.pop(el, None)
         if el.fid in self.index:
             del self.index[el.fid]
-        for parent in frozenset(self.parents[el]):
-            parent.remove(el)
-        for child in el.childs:
-            if isinstance(child, Element):
-                if self.parents[child] == set([el]):
-                    self.remove(child)
-                else:
-                    try:
-                        self.parents[child].remove(el)
-                    except KeyError:
-                        pass
+        if el.kind is not None:
+            self.registry[el.kind].pop(el, None)
+
+    def remove(self, el):
+        """Remove el from element, from its parents and its orphaned children."""
+        self.remove_many([el])
+
+    def remove_many(self, elements):
+        """
+        Remove elements, their orphaned children and references from parents.
+
+        The orphaned children are searched iteratively and each parent is
+        updated only once, so removing a lot of elements is faster than
+        calling remove for each one.
+        """
+        removed = set()
+        pending = list(elements)
+        while pending:
+            el = pending.pop()
+            if el in removed:
+                continue
+            removed.add(el)
+            for child in el.childs:
+                if isinstance(child, Element) and child not in removed:
+                    parents = self.parents.get(child)
+                    if parents and parents <= removed:
+                        pending.append(child)
+        to_update = {}
+        for el in removed:
+            self.unregister(el)
+            for child in el.childs:
+                if child not in removed and child in self.parents:
+                    self.parents[child].discard(el)
+            for parent in self.parents.pop(el, ()):
+                if parent not in removed:
+                    to_update[parent] = None
+        for parent in to_update:
+            parent.remove_childs(removed)
 
     def replace(self, n1, n2):
         """Replace n1 witn n2 in elements."""
         n1.container = None
-        self.elements.discard(n1)
-        del self.index[n1.fid]
+        self.unregister(n1)
         n2.container = self
-        self.elements.add(n2)
-        self.index[n2.fid] = n2
+        self.register(n2)
         self.parents[n2] = self.parents[n1]
         del self.parents[n1]
 
+    def resolve_references(self, ways, relations):
+        """
+        Link ways and relations read from a file to their nodes and members.
+
+        Missing references are discarded and the version of the referencing
+        element is increased. The lists are emptied while they are processed.
+
+        Args:
+            ways (list): pairs of way and sequence of nodes ids
+            relations (list): pairs of relation and list of members as tuples
+                of type initial letter, id and role
+        """
+        if not (ways or relations):
+            return
+        ids = {
+            kind[0]: {el.id: el for el in elements}
+            for kind, elements in self.registry.items()
+            if elements is not self.node_store
+        }
+        if self.node_store is not None:
+            ids["n"] = self.node_store.by_id()
+        nodes = ids["n"]
+        while ways:
+            way, refs = ways.pop()
+            way.nodes = [nodes[ref] for ref in refs if ref in nodes]
+            for n in way.nodes:
+                self.parents[n].add(way)
+            if len(way.nodes) < len(refs) and way.version is not None:
+                way.version = str(int(way.version) + 1)
+        while relations:
+            rel, refs = relations.pop()
+            rel.members = [
+                Relation.Member(ids[etype][ref], role)
+                for (etype, ref, role) in refs
+                if ref in ids.get(etype, {})
+            ]
+            for m in rel.members:
+                self.parents[m.element].add(rel)
+            if len(rel.members) < len(refs) and rel.version is not None:
+                rel.version = str(int(rel.version) + 1)
+
     def merge_duplicated(self):
         """Merge elements with the same geometry."""
         geomdupes = defaultdict(list)
@@ -143,6 +238,8 @@ class Osm(object):
         """
         if name in ["Node", "Way", "Relation", "Polygon", "MultiPolygon"]:
             cls = globals()[name]
+            if name == "Node" and self.__dict__.get("node_store") is not None:
+                cls = StoredNode
             return lambda *args, **kwargs: cls(self, *args, **kwargs)
         raise AttributeError
 
@@ -158,54 +255,83 @@ class Osm(object):
         return outline
 
 
+def _meta_attribute(key, default=None):
+    """Return a property for a metadata attribute stored in the _meta slot."""
+
+    def fget(self):
+        meta = self._meta
+        return default if meta is None else meta.get(key, default)
+
+    def fset(self, value):
+        meta = self._meta
+        if value == default:
+            if meta is not None:
+                meta.pop(key, None)
+                if not meta:
+                    self._meta = None
+        elif meta is None:
+            self._meta = {key: value}
+        else:
+            meta[key] = value
+
+    return property(fget, fset)
+
+
 class Element(object):
     """Base class for Osm elements."""
 
+    __slots__ = ("container", "id", "_tags", "_meta")
+    _attr_list = (
+        "id",
+        "action",
+        "visible",
+        "version",
+        "timestamp",
+        "changeset",
+        "uid",
+        "user",
+    )
+    _geom_attrs = ()  # Attributes with the element geometry
+    kind = None  # Key of the container registry for this type of element
+
     def __init__(self, container, tags={}, attrs={}):
         """Each element must belong to a container OSM dataset."""
         self.container = container
-        self.action = "modify"
-        self.visible = "true"
-        self.tags = dict((k, v) for (k, v) in list(tags.items()))
-        self.version = None
-        self.timestamp = None
-        self.changeset = None
-        self.uid = None
-        self.user = None
-        self._attr_list = (
-            "id",
-            "action",
-            "visible",
-            "version",
-            "timestamp",
-            "changeset",
-            "uid",
-            "user",
-        )
-        self.attrs = dict((k, v) for (k, v) in list(attrs.items()))
+        self._tags = dict(tags) if tags else None
+        self._meta = None
+        if attrs:
+            self.attrs = attrs
         if not hasattr(self, "id"):
             container.counter -= 1
             self.id = container.counter
-        container.elements.add(self)
-        container.index[self.fid] = self
+        container.register(self)
+
+    action = _meta_attribute("action", "modify")
+    visible = _meta_attribute("visible", "true")
+    version = _meta_attribute("version")
+    timestamp = _meta_attribute("timestamp")
+    changeset = _meta_attribute("changeset")
+    uid = _meta_attribute("uid")
+    user = _meta_attribute("user")
+
+    @property
+    def tags(self):
+        """Return the tags dictionary, created on first access."""
+        if self._tags is None:
+            self._tags = {}
+        return self._tags
+
+    @tags.setter
+    def tags(self, value):
+        self._tags = value
 
     def __eq__(self, other):
         """Test equality to determine if two elements could be merged."""
         if isinstance(other, self.__class__):
-            a = dict(self.__dict__)
-            b = dict(other.__dict__)
-            a.pop("container", None)
-            b.pop("container", None)
-            if other.is_new() or self.is_new():
-                a["id"] = 0
-            if other.is_new() or self.is_new():
-                b["id"] = 0
-            if b["tags"] == {}:
-                a["tags"] = {}
-            if a["tags"] == {}:
-                b["tags"] = {}
-            return a == b
-        elif self.is_new() and self.tags == {}:
+            return self._same_data(other) and all(
+                getattr(self, k) == getattr(other, k) for k in self._geom_attrs
+            )
+        elif self.is_new() and not self._tag_dict():
             return self.geometry() == other
         return False
 
@@ -215,6 +341,29 @@ class Element(object):
     def __hash__(self):
         return id(self)
 
+    def _tag_dict(self):
+        """Return the tags without creating an empty dictionary."""
+        return self._tags or {}
+
+    def _meta_dict(self):
+        """Return the metadata attributes with a value other than default."""
+        return self._meta or {}
+
+    def _same_data(self, other):
+        """
+        Compare id, tags and metadata of two elements.
+
+        Ids are ignored if any element is new and tags are only compared if
+        both elements have them.
+        """
+        if self.id != other.id and not (self.is_new() or other.is_new()):
+            return False
+        a = self._tag_dict()
+        b = other._tag_dict()
+        if a and b and a != b:
+            return False
+        return self._meta_dict() == other._meta_dict()
+
     def is_new(self):
         """Return true if this element is new to OSM."""
         return self.id <= 0
@@ -254,6 +403,11 @@ class Element(object):
 class Node(Element):
     """Define a node as a pair of coordinates."""
 
+    __slots__ = ("x", "y")
+    _attr_list = Element._attr_list + ("lon", "lat")
+    _geom_attrs = ("x", "y")
+    kind = "node"
+
     def __init__(self, container, x, y=0, *args, **kwargs):
         """
         Construct a node.
@@ -269,7 +423,6 @@ class Node(Element):
         if COOR_DIGITS:
             self.x = round(self.x, COOR_DIGITS)
             self.y = round(self.y, COOR_DIGITS)
-        self._attr_list = self._attr_list + ("lon", "lat")
 
     def __getitem__(self, key):
         """Commodity getter. n[0], n[1] is equivalent to n.x, n.y."""
@@ -315,9 +468,439 @@ class Node(Element):
         return str((self.x, self.y))
 
 
+class NodeStore(object):
+    """
+    Columnar storage for the nodes of a compact OSM data set.
+
+    Coordinates and ids are kept in contiguous arrays indexed by a slot
+    number, tags and metadata in sparse tables only for the nodes that have
+    them. The nodes are not kept as objects: a StoredNode proxy is created
+    when a node is accessed and it lives while it is referenced. Ways keep
+    the slots of their nodes.
+
+    It is also the registry of nodes of the data set, a view of the nodes
+    registered in insertion order followed by the nodes of other data sets
+    added with Osm.replace.
+    """
+
+    meta_defaults = {"action": "modify", "visible": "true"}
+
+    def __init__(self, container):
+        self.container = container
+        self.ids = array("q")
+        self.x = array("d")
+        self.y = array("d")
+        self.alive = bytearray()  # 1 for the nodes registered in container
+        self.count = 0  # number of registered nodes
+        self.tags = {}  # tags dictionary by slot
+        self.meta = {}  # metadata attributes dictionary by slot
+        self.proxies = WeakValueDictionary()  # nodes referenced by slot
+        self.slots = None  # slots by id, created on demand
+        self.others = {}  # registered nodes of other data sets
+
+    def __len__(self):
+        return self.count + len(self.others)
+
+    def __iter__(self):
+        alive = self.alive
+        get = self.get
+        yield from (get(slot) for slot in range(len(alive)) if alive[slot])
+        yield from list(self.others)
+
+    def __contains__(self, el):
+        if self.owns(el):
+            return self.alive[el._slot] == 1
+        return el in self.others
+
+    def __setitem__(self, el, value):
+        """Register el (value is ignored, like in a dictionary set)."""
+        if not self.owns(el):
+            self.others[el] = None
+        elif not self.alive[el._slot]:
+            self.alive[el._slot] = 1
+            self.count += 1
+
+    def pop(self, el, default=None):
+        """Unregister el."""
+        if not self.owns(el):
+            return self.others.pop(el, default)
+        if self.alive[el._slot]:
+            self.alive[el._slot] = 0
+            self.count -= 1
+        return default
+
+    def keys(self):
+        return self
+
+    def owns(self, el):
+        """Return True if el is a node in this store."""
+        return isinstance(el, StoredNode) and el._store is self
+
+    def add(self, x, y, eid=0):
+        """Append a new node and return its slot."""
+        slot = len(self.ids)
+        self.ids.append(eid)
+        self.x.append(x)
+        self.y.append(y)
+        self.alive.append(0)
+        if self.slots is not None:
+            self.slots[eid] = slot
+        return slot
+
+    def get(self, slot):
+        """Return the node proxy for slot."""
+        node = self.proxies.get(slot)
+        if node is None:
+            node = StoredNode.__new__(StoredNode)
+            node.container = self.container
+            node._store = self
+            node._slot = slot
+            self.proxies[slot] = node
+        return node
+
+    def set_id(self, slot, eid):
+        """Change the id of the node in slot."""
+        if self.slots is not None:
+            if self.slots.get(self.ids[slot]) == slot:
+                del self.slots[self.ids[slot]]
+            self.slots[eid] = slot
+        self.ids[slot] = eid
+
+    def find(self, eid):
+        """Return the slot of the registered node with id eid or None."""
+        if self.slots is None:
+            self.slots = {eid: slot for (slot, eid) in enumerate(self.ids)}
+        slot = self.slots.get(eid)
+        if slot is None or not self.alive[slot]:
+            return None
+        return slot
+
+    def by_id(self):
+        """Return a mapping of the registered nodes by id."""
+        return NodeIds(self)
+
+    def get_meta(self, slot, key):
+        """Return the value of a metadata attribute for the node in slot."""
+        meta = self.meta.get(slot)
+        if meta is not None and key in meta:
+            return meta[key]
+        return self.meta_defaults.get(key)
+
+    def set_meta(self, slot, key, value):
+        """Set the value of a metadata attribute for the node in slot."""
+        meta = self.meta.get(slot)
+        if value == self.meta_defaults.get(key):
+            if meta is not None:
+                meta.pop(key, None)
+                if not meta:
+                    del self.meta[slot]
+        elif meta is None:
+            self.meta[slot] = {key: value}
+        else:
+            meta[key] = value
+
+
+class NodeSlots(array):
+    """Slots of the nodes of a way in a NodeStore."""
+
+    __slots__ = ("store",)
+
+    def __new__(cls, store, slots=()):
+        self = super(NodeSlots, cls).__new__(cls, "q", slots)
+        self.store = store
+        return self
+
+
+class NodeIds(object):
+    """Read only mapping of the nodes in a NodeStore by id."""
+
+    __slots__ = ("_store",)
+
+    def __init__(self, store):
+        self._store = store
+
+    def __contains__(self, eid):
+        return self._store.find(eid) is not None
+
+    def __getitem__(self, eid):
+        slot = self._store.find(eid)
+        if slot is None:
+            raise KeyError(eid)
+        return self._store.get(slot)
+
+    def get(self, eid, default=None):
+        slot = self._store.find(eid)
+        return default if slot is None else self._store.get(slot)
+
+
+class NodeIndex(dict):
+    """Index of elements by fid of a compact data set, see Osm.index."""
+
+    def __init__(self, store):
+        super(NodeIndex, self).__init__()
+        self.store = store
+
+    def __setitem__(self, fid, el):
+        if not self.store.owns(el):
+            super(NodeIndex, self).__setitem__(fid, el)
+
+    def __getitem__(self, fid):
+        if isinstance(fid, str) and fid[0] == "n":
+            slot = self.store.find(int(fid[1:]))
+            if slot is not None:
+                return self.store.get(slot)
+        return super(NodeIndex, self).__getitem__(fid)
+
+    def __delitem__(self, fid):
+        if super(NodeIndex, self).__contains__(fid):
+            super(NodeIndex, self).__delitem__(fid)
+
+    def __contains__(self, fid):
+        if isinstance(fid, str) and fid[0] == "n":
+            if self.store.find(int(fid[1:])) is not None:
+                return True
+        return super(NodeIndex, self).__contains__(fid)
+
+    def __iter__(self):
+        ids = self.store.ids
+        alive = self.store.alive
+        yield from ("n%d" % ids[slot] for slot in range(len(ids)) if alive[slot])
+        yield from super(NodeIndex, self).__iter__()
+
+    def __len__(self):
+        return self.store.count + super(NodeIndex, self).__len__()
+
+    def keys(self):
+        return self
+
+
+class NodeElements(dict):
+    """Elements of a compact data set, see Osm.elements."""
+
+    def __init__(self, store):
+        super(NodeElements, self).__init__()
+        self.store = store
+
+    def __setitem__(self, el, value):
+        if self.store.owns(el):
+            self.store[el] = value
+        else:
+            super(NodeElements, self).__setitem__(el, value)
+
+    def pop(self, el, default=None):
+        if self.store.owns(el):
+            return self.store.pop(el, default)
+        return super(NodeElements, self).pop(el, default)
+
+    def __contains__(self, el):
+        if self.store.owns(el):
+            return el in self.store
+        return super(NodeElements, self).__contains__(el)
+
+    def __iter__(self):
+        yield from self.store
+        yield from super(NodeElements, self).__iter__()
+
+    def __len__(self):
+        return len(self.store) + super(NodeElements, self).__len__()
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def keys(self):
+        return self
+
+
+class NodeParents(MutableMapping):
+    """Parents of the elements of a compact data set, see Osm.parents."""
+
+    def __init__(self, store):
+        self.store = store
+        self.nodes = {}  # parents by slot of the nodes in store
+        self.others = {}
+
+    def _table(self, el):
+        if self.store.owns(el):
+            return self.nodes, el._slot
+        return self.others, el
+
+    def __getitem__(self, el):
+        """Return the set of parents of el, created if missing."""
+        (table, key) = self._table(el)
+        parents = table.get(key)
+        if parents is None:
+            parents = table[key] = set()
+        return parents
+
+    def __setitem__(self, el, parents):
+        (table, key) = self._table(el)
+        table[key] = parents
+
+    def __delitem__(self, el):
+        (table, key) = self._table(el)
+        del table[key]
+
+    def __contains__(self, el):
+        (table, key) = self._table(el)
+        return key in table
+
+    def get(self, el, default=None):
+        (table, key) = self._table(el)
+        return table.get(key, default)
+
+    def pop(self, el, *args):
+        (table, key) = self._table(el)
+        return table.pop(key, *args)
+
+    def __iter__(self):
+        get = self.store.get
+        yield from (get(slot) for slot in list(self.nodes))
+        yield from list(self.others)
+
+    def __len__(self):
+        return len(self.nodes) + len(self.others)
+
+
+class NodeTags(MutableMapping):
+    """Dictionary like view of the tags of a node in a NodeStore."""
+
+    __slots__ = ("_store", "_slot")
+
+    def __init__(self, store, slot):
+        self._store = store
+        self._slot = slot
+
+    def __getitem__(self, key):
+        return self._store.tags.get(self._slot, {})[key]
+
+    def __setitem__(self, key, value):
+        self._store.tags.setdefault(self._slot, {})[key] = value
+
+    def __delitem__(self, key):
+        tags = self._store.tags.get(self._slot, {})
+        del tags[key]
+        if not tags:
+            del self._store.tags[self._slot]
+
+    def __iter__(self):
+        return iter(list(self._store.tags.get(self._slot, {})))
+
+    def __len__(self):
+        return len(self._store.tags.get(self._slot, {}))
+
+    def __repr__(self):
+        return repr(self._store.tags.get(self._slot, {}))
+
+
+def _stored_meta(key):
+    """Return a property for a metadata attribute kept in the NodeStore."""
+
+    def fget(self):
+        return self._store.get_meta(self._slot, key)
+
+    def fset(self, value):
+        self._store.set_meta(self._slot, key, value)
+
+    return property(fget, fset)
+
+
+class StoredNode(Node):
+    """
+    Transient proxy for a node of a compact data set.
+
+    It only holds its container and its slot in the container NodeStore,
+    where coordinates, id, tags and metadata are stored. There is at most
+    one proxy for each node at a time, so nodes can be compared by identity.
+    """
+
+    __slots__ = ("_store", "_slot", "__weakref__")
+
+    def __init__(self, container, x, y=0, tags={}, attrs={}):
+        (x, y) = (x[0], x[1]) if hasattr(x, "__getitem__") else (x, y)
+        if COOR_DIGITS:
+            x = round(x, COOR_DIGITS)
+            y = round(y, COOR_DIGITS)
+        self.container = container
+        self._store = container.node_store
+        self._slot = self._store.add(x, y)
+        self._store.proxies[self._slot] = self
+        if tags:
+            self._store.tags[self._slot] = dict(tags)
+        if attrs:
+            self.attrs = attrs
+        if self.id == 0:
+            container.counter -= 1
+            self.id = container.counter
+        container.register(self)
+
+    type = "node"
+
+    @property
+    def id(self):
+        return self._store.ids[self._slot]
+
+    @id.setter
+    def id(self, value):
+        self._store.set_id(self._slot, value)
+
+    @property
+    def x(self):
+        return self._store.x[self._slot]
+
+    @x.setter
+    def x(self, value):
+        self._store.x[self._slot] = value
+
+    @property
+    def y(self):
+        return self._store.y[self._slot]
+
+    @y.setter
+    def y(self, value):
+        self._store.y[self._slot] = value
+
+    @property
+    def tags(self):
+        return NodeTags(self._store, self._slot)
+
+    @tags.setter
+    def tags(self, value):
+        if value:
+            self._store.tags[self._slot] = dict(value)
+        else:
+            self._store.tags.pop(self._slot, None)
+
+    action = _stored_meta("action")
+    visible = _stored_meta("visible")
+    version = _stored_meta("version")
+    timestamp = _stored_meta("timestamp")
+    changeset = _stored_meta("changeset")
+    uid = _stored_meta("uid")
+    user = _stored_meta("user")
+
+    def __eq__(self, other):
+        """Test equality to determine if two elements could be merged."""
+        if isinstance(other, Node) and not isinstance(other, StoredNode):
+            return other.__eq__(self)
+        return super(StoredNode, self).__eq__(other)
+
+    def __hash__(self):
+        return id(self)
+
+    def _tag_dict(self):
+        return self._store.tags.get(self._slot) or {}
+
+    def _meta_dict(self):
+        return self._store.meta.get(self._slot) or {}
+
+
 class Way(Element):
     """Define a way as a list of nodes."""
 
+    __slots__ = ("_nodes", "_geom")
+    _geom_attrs = ("nodes",)
+    kind = "way"
+
     def __init__(self, container, nodes=[], *args, **kwargs):
         """
         Construct a way.
@@ -334,6 +917,30 @@ class Way(Element):
         for n in nodes:
             self.append(n)
 
+    @property
+    def nodes(self):
+        """Return the list of nodes."""
+        nodes = self._nodes
+        if isinstance(nodes, NodeSlots):
+            get = nodes.store.get
+            return [get(slot) for slot in nodes]
+        return nodes
+
+    @nodes.setter
+    def nodes(self, value):
+        store = getattr(self.container, "node_store", None)
+        if store is not None and all(store.owns(n) for n in value):
+            value = NodeSlots(store, [n._slot for n in value])
+        self._nodes = value
+        self.reset_geometry()
+
+    def reset_geometry(self):
+        """Clear the cached geometry of this way and its parent relations."""
+        self._geom = None
+        for parent in self.container.parents.get(self, ()):
+            if getattr(parent, "_geom", None) is not None:
+                parent.reset_geometry()
+
     @property
     def childs(self):
         """Return set of unique nodes."""
@@ -341,34 +948,51 @@ class Way(Element):
 
     def is_closed(self):
         """Return true if the way is closed."""
-        return (len(self.nodes) > 2) and self.nodes[0] == self.nodes[-1]
+        nodes = self.nodes
+        return len(nodes) > 2 and (nodes[0] is nodes[-1] or nodes[0] == nodes[-1])
 
     def is_open(self):
         """Return true if the way is not closed."""
-        return (len(self.nodes) > 1) and self.nodes[0] != self.nodes[-1]
+        nodes = self.nodes
+        return len(nodes) > 1 and nodes[0] is not nodes[-1] and nodes[0] != nodes[-1]
 
     def shoelace(self):
         """Return the area for a closed way or 0, + for CCW nodes, - for CW."""
         s = 0
         if self.is_closed():
-            for i in range(len(self.nodes) - 1):
-                n1 = self.nodes[i]
-                n2 = self.nodes[i + 1]
+            nodes = self.nodes
+            for i in range(len(nodes) - 1):
+                n1 = nodes[i]
+                n2 = nodes[i + 1]
                 s += n1.x * n2.y - n2.x * n1.y
         return s
 
     def append(self, n):
         """Append n to nodes."""
         if not isinstance(n, Node):
-            n = Node(self.container, n)
-        self.nodes.append(n)
+            n = self.container.Node(n)
+        if not isinstance(self._nodes, NodeSlots):
+            self._nodes.append(n)
+        elif self._nodes.store.owns(n):
+            self._nodes.append(n._slot)
+        else:
+            self._nodes = self.nodes + [n]
         self.container.parents[n].add(self)
+        self.reset_geometry()
 
     def remove(self, n):
         """Remove n from nodes."""
         self.nodes = [o for o in self.nodes if o is not n]
         self.container.parents[n].remove(self)
 
+    def remove_childs(self, childs):
+        """Remove in one pass all the nodes included in the set childs."""
+        parents = self.container.parents
+        for n in self.childs & childs:
+            if n in parents:
+                parents[n].discard(self)
+        self.nodes = [n for n in self.nodes if n not in childs]
+
     def replace(self, n1, n2):
         """Replace first occurence of node n1 with n2."""
         self.nodes = [n2 if n is n1 else n for n in self.nodes]
@@ -380,22 +1004,8 @@ class Way(Element):
         if self.is_open():
             return super(Way, self).__eq__(other)
         elif isinstance(other, self.__class__):
-            a = dict(self.__dict__)
-            b = dict(other.__dict__)
-            a.pop("container", None)
-            b.pop("container", None)
-            if other.is_new() or self.is_new():
-                a["id"] = 0
-            if other.is_new() or self.is_new():
-                b["id"] = 0
-            if b["tags"] == {}:
-                a["tags"] = {}
-            if a["tags"] == {}:
-                b["tags"] = {}
-            a["nodes"] = self.geometry()
-            b["nodes"] = other.geometry()
-            return a == b
-        elif self.is_new() and self.tags == {}:
+            return self._same_data(other) and self.geometry() == other.geometry()
+        elif self.is_new() and not self._tag_dict():
             if hasattr(other, "index"):
                 i = other.index(min(other))
                 return self.geometry() == other[i:] + other[1 : i + 1]
@@ -408,23 +1018,45 @@ class Way(Element):
         return id(self)
 
     def geometry(self):
-        """Return tuple of coordinates."""
-        g = tuple(n.geometry() for n in self.nodes)
-        if self.is_closed():
-            i = g.index(min(g))
-            g = g[i:] + g[1 : i + 1]
-            if self.shoelace() < 0:
-                g = g[::-1]
-        return g
+        """
+        Return tuple of coordinates.
+
+        Closed ways start in the minimum vertex and are oriented CCW, so the
+        result is a canonical fingerprint of the way shape. It is cached until
+        the list of nodes changes.
+        """
+        if self._geom is None:
+            nodes = self._nodes
+            if isinstance(nodes, NodeSlots):
+                (x, y) = (nodes.store.x, nodes.store.y)
+                g = tuple((x[slot], y[slot]) for slot in nodes)
+            else:
+                g = tuple(n.geometry() for n in nodes)
+            if self.is_closed():
+                i = g.index(min(g))
+                g = g[i:] + g[1 : i + 1]
+                if self.shoelace() < 0:
+                    g = g[::-1]
+            self._geom = g
+        return self._geom
 
     def clean_duplicated_nodes(self):
         """Remove consecutive duplicated nodes."""
-        if self.nodes:
-            merged = [self.nodes[0]]
-            for i, n in enumerate(self.nodes[1:]):
-                if n != self.nodes[i]:
+        if isinstance(self._nodes, NodeSlots):
+            # Equal nodes have equal coordinates, skip the proxies if none has
+            slots = self._nodes
+            (x, y) = (slots.store.x, slots.store.y)
+            pairs = zip(slots, slots[1:])
+            if all(x[a] != x[b] or y[a] != y[b] for (a, b) in pairs):
+                return
+        nodes = self.nodes
+        if nodes:
+            merged = [nodes[0]]
+            for i, n in enumerate(nodes[1:]):
+                if n is not nodes[i] and n != nodes[i]:
                     merged.append(n)
-            self.nodes = merged
+            if len(merged) < len(nodes):
+                self.nodes = merged
 
     def search_node(self, x, y):
         """Return osm node of way in the given position or None."""
@@ -446,12 +1078,28 @@ class Way(Element):
 class Relation(Element):
     """A relation is a collection of nodes, ways or relations with a role."""
 
+    __slots__ = ("_members", "_geom")
+    _geom_attrs = ("members",)
+    kind = "relation"
+
     def __init__(self, container, members=[], *args, **kwargs):
         super(Relation, self).__init__(container, *args, **kwargs)
         self.members = []
         for m in members:
             self.append(m)
 
+    @property
+    def members(self):
+        """Return the list of members."""
+        return self._members
+
+    @members.setter
+    def members(self, value):
+        self._members = value
+        self.reset_geometry()
+
+    reset_geometry = Way.reset_geometry
+
     @property
     def childs(self):
         """Return set of unique members elements."""
@@ -463,12 +1111,21 @@ class Relation(Element):
             m = Relation.Member(m, role)
         self.members.append(m)
         self.container.parents[m.element].add(self)
+        self.reset_geometry()
 
     def remove(self, e):
         """Remove e from members."""
         self.members = [m for m in self.members if m.element is not e]
         self.container.parents[e].remove(self)
 
+    def remove_childs(self, childs):
+        """Remove in one pass all the members elements included in childs."""
+        parents = self.container.parents
+        for e in self.childs & childs:
+            if e in parents:
+                parents[e].discard(self)
+        self.members = [m for m in self.members if m.element not in childs]
+
     def replace(self, e1, e2):
         """Replace first occurrence of element e1 with e2."""
         self.members = [
@@ -492,8 +1149,10 @@ class Relation(Element):
         return is_conected
 
     def geometry(self):
-        """Return tuple of coordinates."""
-        return tuple(m.element.geometry() for m in self.members)
+        """Return tuple of members geometries, cached until members change."""
+        if self._geom is None:
+            self._geom = tuple(m.element.geometry() for m in self.members)
+        return self._geom
 
     def outer_geometry(self):
         """Return equivalent geometry removing inner rings."""
@@ -533,6 +1192,8 @@ class Relation(Element):
     class Member(object):
         """An element is member of a relation with a role."""
 
+        __slots__ = ("element", "role")
+
         def __init__(self, element, role=None):
             self.element = element
             self.role = role
@@ -540,7 +1201,7 @@ class Relation(Element):
         def __eq__(self, other):
             """Test equality to determine if two elements could be merged."""
             if isinstance(other, self.__class__):
-                return self.__dict__ == other.__dict__
+                return self.element == other.element and self.role == other.role
             else:
                 return False
 
@@ -570,6 +1231,8 @@ class Relation(Element):
 class Polygon(Relation):
     """Helper to create a multipolygon type relation with only one outer ring."""
 
+    __slots__ = ()
+
     def __init__(self, container, rings=[], *args, **kwargs):
         super(Polygon, self).__init__(container, *args, **kwargs)
         self.tags["type"] = "multipolygon"
@@ -585,6 +1248,8 @@ class Polygon(Relation):
 class MultiPolygon(Polygon):
     """Helper to create a multipolygon type relation."""
 
+    __slots__ = ()
+
     def __init__(self, container, parts=[], *args, **kwargs):
         super(MultiPolygon, self).__init__(container, *args, **kwargs)
         for part in parts:
@@ -0,0 +1,474 @@
+"""
+OSM PBF format serializer.
+
+Pure Python implementation of the subset of the OSM PBF format needed to
+store an OSM data set: a header block and primitive blocks of dense nodes,
+ways and relations compressed with zlib.
+
+The data set attributes other than the generator (upload, note, meta and
+changeset tags) and the element attributes action and visible are not part
+of the format and are not stored.
+"""
+import logging
+import struct
+import zlib
+from datetime import datetime, timezone
+
+from catatom2osm import config, osm
+from catatom2osm.exceptions import CatIOError
+
+log = logging.getLogger(config.app_name)
+
+BLOCK_SIZE = 8000  # Maximum number of elements in a primitive block
+GRANULARITY = 100  # Coordinates resolution in nanodegrees
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+MEMBER_TYPES = ("node", "way", "relation")
+
+
+def zigzag(value):
+    """Map a signed integer to an unsigned one for sint encoding."""
+    return (value << 1) ^ (value >> 63)
+
+
+def unzigzag(value):
+    """Inverse of zigzag."""
+    return (value >> 1) ^ -(value & 1)
+
+
+def to_signed(value):
+    """Convert a decoded varint to a signed 64 bits integer."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def write_varint(buf, value):
+    """Append value as a varint to the bytearray buf."""
+    value &= 0xFFFFFFFFFFFFFFFF
+    while value > 0x7F:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def read_varint(buf, pos):
+    """Return the varint in buf at pos and the position after it."""
+    result = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def write_field(buf, field, value):
+    """Append a varint field or a length delimited field for bytes values."""
+    if isinstance(value, int):
+        write_varint(buf, field << 3)
+        write_varint(buf, value)
+    else:
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        write_varint(buf, (field << 3) | 2)
+        write_varint(buf, len(value))
+        buf += value
+
+
+def write_packed(buf, field, values):
+    """Append a packed repeated field of varints."""
+    packed = bytearray()
+    for value in values:
+        write_varint(packed, value)
+    write_field(buf, field, packed)
+
+
+def delta(values):
+    """Return the zigzag encoded differences between consecutive values."""
+    last = 0
+    for value in values:
+        yield zigzag(value - last)
+        last = value
+
+
+def undelta(values):
+    """Inverse of delta."""
+    last = 0
+    result = []
+    for value in values:
+        last += unzigzag(value)
+        result.append(last)
+    return result
+
+
+def iter_fields(buf):
+    """Iterate over the (field number, value) pairs of a protobuf message."""
+    buf = memoryview(buf)
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        wire = key & 7
+        if wire == 0:
+            value, pos = read_varint(buf, pos)
+        elif wire == 2:
+            size, pos = read_varint(buf, pos)
+            value = buf[pos : pos + size]
+            pos += size
+        elif wire == 1:
+            value = buf[pos : pos + 8]
+            pos += 8
+        elif wire == 5:
+            value = buf[pos : pos + 4]
+            pos += 4
+        else:
+            raise CatIOError(_("Unsupported protobuf wire type %d") % wire)
+        yield key >> 3, value
+
+
+def unpack(buf):
+    """Return the list of varints in a packed repeated field."""
+    values = []
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        value, pos = read_varint(buf, pos)
+        values.append(value)
+    return values
+
+
+def to_epoch(timestamp):
+    """Return seconds since epoch for an OSM timestamp or 0 if not valid."""
+    try:
+        dt = datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+    except (TypeError, ValueError):
+        return 0
+    return int(dt.replace(tzinfo=timezone.utc).timestamp())
+
+
+def to_timestamp(seconds):
+    """Return the OSM timestamp for seconds since epoch."""
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+class StringTable(object):
+    """Strings of a primitive block, index 0 is reserved."""
+
+    def __init__(self):
+        self.index = {"": 0}
+
+    def __call__(self, value):
+        """Return index of value, adding it if it's not in the table."""
+        value = str(value)
+        i = self.index.get(value)
+        if i is None:
+            i = len(self.index)
+            self.index[value] = i
+        return i
+
+    def encode(self):
+        buf = bytearray()
+        for value in self.index:
+            write_field(buf, 1, value)
+        return buf
+
+
+def write_blob(outfile, blob_type, message):
+    """Write a zlib compressed blob with its header."""
+    blob = bytearray()
+    write_field(blob, 2, len(message))
+    write_field(blob, 3, zlib.compress(bytes(message)))
+    header = bytearray()
+    write_field(header, 1, blob_type)
+    write_field(header, 3, len(blob))
+    outfile.write(struct.pack(">I", len(header)))
+    outfile.write(header)
+    outfile.write(blob)
+
+
+def encode_header(data):
+    """Return the header block message."""
+    buf = bytearray()
+    write_field(buf, 4, "OsmSchema-V0.6")
+    write_field(buf, 4, "DenseNodes")
+    write_field(buf, 16, data.generator or config.app_name)
+    return buf
+
+
+def encode_info(el, strings):
+    """Return the Info message of an element or None if it has no metadata."""
+    if el.version is None:
+        return None
+    buf = bytearray()
+    write_field(buf, 1, int(el.version))
+    if el.timestamp is not None:
+        write_field(buf, 2, to_epoch(el.timestamp))
+    if el.changeset is not None:
+        write_field(buf, 3, int(el.changeset))
+    if el.uid is not None:
+        write_field(buf, 4, int(el.uid))
+    if el.user is not None:
+        write_field(buf, 5, strings(el.user))
+    return buf
+
+
+def encode_dense(nodes, strings):
+    """Return the DenseNodes message for a list of nodes."""
+    buf = bytearray()
+    write_packed(buf, 1, delta(n.id for n in nodes))
+    if any(n.version is not None for n in nodes):
+        info = bytearray()
+        write_packed(info, 1, (int(n.version or 0) for n in nodes))
+        write_packed(info, 2, delta(to_epoch(n.timestamp) for n in nodes))
+        write_packed(info, 3, delta(int(n.changeset or 0) for n in nodes))
+        write_packed(info, 4, delta(int(n.uid or 0) for n in nodes))
+        write_packed(info, 5, delta(strings(n.user or "") for n in nodes))
+        write_field(buf, 5, info)
+    scale = 1e9 / GRANULARITY
+    write_packed(buf, 8, delta(int(round(n.y * scale)) for n in nodes))
+    write_packed(buf, 9, delta(int(round(n.x * scale)) for n in nodes))
+    if any(n.tags for n in nodes):
+        keys_vals = []
+        for n in nodes:
+            for k, v in n.tags.items():
+                keys_vals.append(strings(k))
+                keys_vals.append(strings(v))
+            keys_vals.append(0)
+        write_packed(buf, 10, keys_vals)
+    return buf
+
+
+def encode_element(el, strings):
+    """Return the Way or Relation message for an element."""
+    buf = bytearray()
+    write_field(buf, 1, el.id)
+    tags = el.tags.items()
+    write_packed(buf, 2, (strings(k) for k, v in tags))
+    write_packed(buf, 3, (strings(v) for k, v in tags))
+    info = encode_info(el, strings)
+    if info is not None:
+        write_field(buf, 4, info)
+    if isinstance(el, osm.Way):
+        write_packed(buf, 8, delta(n.id for n in el.nodes))
+    else:
+        write_packed(buf, 8, (strings(m.role or "") for m in el.members))
+        write_packed(buf, 9, delta(m.ref for m in el.members))
+        write_packed(buf, 10, (MEMBER_TYPES.index(m.type) for m in el.members))
+    return buf
+
+
+def encode_block(elements, kind):
+    """Return a primitive block message for a list of elements of one kind."""
+    strings = StringTable()
+    group = bytearray()
+    if kind == "node":
+        write_field(group, 2, encode_dense(elements, strings))
+    else:
+        field = 3 if kind == "way" else 4
+        for el in elements:
+            write_field(group, field, encode_element(el, strings))
+    buf = bytearray()
+    write_field(buf, 1, strings.encode())
+    write_field(buf, 2, group)
+    return buf
+
+
+def get_lost_attributes(data):
+    """
+    Return the attributes of a data set that serialize can't store.
+
+    Args:
+        data (Osm): OSM data set
+
+    Returns:
+        list: names of the upload attribute, changeset tags and element
+        action and visible attributes present in data.
+    """
+    lost = []
+    if "upload" in data.attrs:
+        lost.append("upload")
+    if data.tags:
+        lost.append("changeset")
+    if any(el.id > 0 or el.action != "modify" for el in data.elements):
+        lost.append("action")
+    if any(el.visible != "true" for el in data.elements):
+        lost.append("visible")
+    return lost
+
+
+def serialize(outfile, data, sort=False):
+    """
+    Output PBF for an OSM data set.
+
+    Args:
+        outfile: binary file like object
+        data (Osm): OSM data set
+        sort (bool): sort elements by id
+    """
+    write_blob(outfile, "OSMHeader", encode_header(data))
+    for kind in MEMBER_TYPES:
+        elements = data.registry[kind]
+        if sort:
+            elements = sorted(elements, key=data.sort_key)
+        elements = list(elements)
+        for i in range(0, len(elements), BLOCK_SIZE):
+            block = encode_block(elements[i : i + BLOCK_SIZE], kind)
+            write_blob(outfile, "OSMData", block)
+
+
+def read_blobs(infile):
+    """Iterate over the (type, uncompressed message) pairs of a PBF file."""
+    while True:
+        size = infile.read(4)
+        if len(size) < 4:
+            break
+        header = dict(iter_fields(infile.read(struct.unpack(">I", size)[0])))
+        blob_type = bytes(header[1]).decode()
+        blob = dict(iter_fields(infile.read(header[3])))
+        if 1 in blob:
+            message = bytes(blob[1])
+        elif 3 in blob:
+            message = zlib.decompress(blob[3])
+        else:
+            raise CatIOError(_("Unsupported PBF compression"))
+        yield blob_type, message
+
+
+def decode_info(buf, strings, attrs):
+    """Add to attrs the metadata in an Info message."""
+    for field, value in iter_fields(buf):
+        if field == 1:
+            attrs["version"] = str(value)
+        elif field == 2 and value:
+            attrs["timestamp"] = to_timestamp(value)
+        elif field == 3 and value:
+            attrs["changeset"] = str(value)
+        elif field == 4 and value:
+            attrs["uid"] = str(value)
+        elif field == 5 and value:
+            attrs["user"] = strings[value]
+
+
+def decode_dense(buf, block, data, meta=True):
+    """Add to data the nodes in a DenseNodes message."""
+    fields = {field: value for field, value in iter_fields(buf)}
+    strings, granularity, lat_offset, lon_offset = block
+    ids = undelta(unpack(fields.get(1, b"")))
+    lats = undelta(unpack(fields.get(8, b"")))
+    lons = undelta(unpack(fields.get(9, b"")))
+    keys_vals = unpack(fields.get(10, b""))
+    info = {}
+    if meta and 5 in fields:
+        info = {field: unpack(value) for field, value in iter_fields(fields[5])}
+        for field in (2, 3, 4, 5):
+            if field in info:
+                info[field] = undelta(info[field])
+    kv = 0
+    for i, eid in enumerate(ids):
+        tags = {}
+        while kv < len(keys_vals) and keys_vals[kv] != 0:
+            tags[strings[keys_vals[kv]]] = strings[keys_vals[kv + 1]]
+            kv += 2
+        kv += 1
+        attrs = {"id": eid}
+        if info.get(1) and info[1][i]:
+            attrs["version"] = str(info[1][i])
+            if info.get(2) and info[2][i]:
+                attrs["timestamp"] = to_timestamp(info[2][i])
+            if info.get(3) and info[3][i]:
+                attrs["changeset"] = str(info[3][i])
+            if info.get(4) and info[4][i]:
+                attrs["uid"] = str(info[4][i])
+            if info.get(5) and info[5][i]:
+                attrs["user"] = strings[info[5][i]]
+        x = (lon_offset + granularity * lons[i]) / 1e9
+        y = (lat_offset + granularity * lats[i]) / 1e9
+        data.Node(x, y, tags=tags, attrs=attrs)
+
+
+def decode_element(buf, strings, meta=True):
+    """Return the attributes, tags and fields of a Way or Relation message."""
+    attrs = {}
+    keys = vals = []
+    fields = {}
+    for field, value in iter_fields(buf):
+        if field == 1:
+            attrs["id"] = to_signed(value)
+        elif field == 2:
+            keys = unpack(value)
+        elif field == 3:
+            vals = unpack(value)
+        elif field == 4 and meta:
+            decode_info(value, strings, attrs)
+        else:
+            fields[field] = value
+    tags = {strings[k]: strings[v] for k, v in zip(keys, vals)}
+    return attrs, tags, fields
+
+
+def decode_block(message, data, ways, relations, meta=True):
+    """Add to data the elements of a primitive block."""
+    groups = []
+    strings = []
+    granularity, lat_offset, lon_offset = GRANULARITY, 0, 0
+    for field, value in iter_fields(message):
+        if field == 1:
+            strings = [bytes(s).decode("utf-8") for f, s in iter_fields(value)]
+        elif field == 2:
+            groups.append(value)
+        elif field == 17:
+            granularity = value
+        elif field == 19:
+            lat_offset = to_signed(value)
+        elif field == 20:
+            lon_offset = to_signed(value)
+    block = (strings, granularity, lat_offset, lon_offset)
+    for group in groups:
+        for field, value in iter_fields(group):
+            if field == 1:
+                raise CatIOError(_("Only dense nodes are supported in PBF files"))
+            elif field == 2:
+                decode_dense(value, block, data, meta)
+            elif field == 3:
+                attrs, tags, fields = decode_element(value, strings, meta)
+                w = data.Way(tags=tags, attrs=attrs)
+                ways.append((w, undelta(unpack(fields.get(8, b"")))))
+            elif field == 4:
+                attrs, tags, fields = decode_element(value, strings, meta)
+                r = data.Relation(tags=tags, attrs=attrs)
+                roles = [strings[i] for i in unpack(fields.get(8, b""))]
+                refs = undelta(unpack(fields.get(9, b"")))
+                types = [MEMBER_TYPES[t][0] for t in unpack(fields.get(10, b""))]
+                relations.append((r, list(zip(types, refs, roles))))
+
+
+def deserialize(infile, data=None, meta=True):
+    """
+    Generate a OSM data set from OSM PBF or append to existing data.
+
+    Args:
+        infile: binary file like object
+        data (Osm): data set to append to, a new one if None
+        meta (bool): False to read only the id and not the other metadata
+            attributes (version, timestamp, user, ...)
+
+    Returns:
+        Osm: OSM data set
+    """
+    if data is None:
+        data = osm.Osm()
+    ways = []  # pairs of way and list of nodes ids
+    relations = []  # pairs of relation and list of (type, id, role) members
+    for blob_type, message in read_blobs(infile):
+        if blob_type == "OSMHeader":
+            for field, value in iter_fields(message):
+                if field == 4:
+                    feature = bytes(value).decode()
+                    if feature not in ("OsmSchema-V0.6", "DenseNodes"):
+                        msg = _("Unsupported PBF feature '%s'") % feature
+                        raise CatIOError(msg)
+                elif field == 16:
+                    data.generator = bytes(value).decode()
+        elif blob_type == "OSMData":
+            decode_block(message, data, ways, relations, meta)
+    data.resolve_references(ways, relations)
+    return data
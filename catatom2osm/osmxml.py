@@ -1,5 +1,7 @@
 """OSM XML format serializer."""
+import io
 import logging
+from array import array
 
 from lxml import etree
 
@@ -7,120 +9,183 @@ from catatom2osm import config, osm
 
 log = logging.getLogger(config.app_name)
 
+OSM_TYPES = ("node", "way", "relation")
+TOP_LEVEL_TAGS = ("osm", "changeset", "note", "meta") + OSM_TYPES
+
 
 def add_tags(item, elem):
     for key, value in elem.tags.items():
         etree.SubElement(item, "tag", dict(k=key, v=str(value)))
 
 
-def serialize(outfile, data):
-    """Output XML for an OSM data set."""
-    root = etree.Element("osm", data.attrs)
-    if data.note is not None:
-        etree.SubElement(root, "note").text = data.note
-    if data.meta is not None:
-        etree.SubElement(root, "meta", data.meta)
-    if data.tags:
-        cs = etree.SubElement(root, "changeset")
-        add_tags(cs, data)
-    for node in data.nodes:
-        e = etree.SubElement(root, "node", node.attrs)
-        add_tags(e, node)
-    for way in data.ways:
-        e = etree.SubElement(root, "way", way.attrs)
-        for nd in way.nodes:
-            etree.SubElement(e, "nd", {"ref": str(nd.id)})
-        add_tags(e, way)
-    for rel in data.relations:
-        e = etree.SubElement(root, "relation", rel.attrs)
-        for m in rel.members:
-            etree.SubElement(e, "member", m.attrs)
-        add_tags(e, rel)
-    options = dict(pretty_print=True, xml_declaration=True, encoding="utf-8")
-    output = etree.tostring(root, **options)
-    outfile.write(output.decode())
-
-
-def deserialize(infile, data=None):
-    """Generate a OSM data set from OSM XML or append to existing data."""
+def write_element(xf, elem):
+    """Write a top level element indented as in a pretty printed document."""
+    etree.indent(elem, space="  ", level=1)
+    xf.write("\n  ", elem)
+
+
+def serialize(outfile, data, sort=False):
+    """
+    Output XML for an OSM data set.
+
+    Each element is written as it is visited, so the document is never held
+    in memory. Elements are written in insertion order or sorted by id if
+    sort is True, so the same data set always gives the same output.
+
+    Args:
+        outfile: binary file like object
+        data (Osm): OSM data set
+        sort (bool): sort elements by id
+    """
+    if isinstance(outfile, io.TextIOBase):
+        raise TypeError(_("A binary file object is required to write OSM XML"))
+    nodes, ways, relations = data.nodes, data.ways, data.relations
+    if sort:
+        nodes = sorted(nodes, key=data.sort_key)
+        ways = sorted(ways, key=data.sort_key)
+        relations = sorted(relations, key=data.sort_key)
+    outfile.write(b"<?xml version='1.0' encoding='utf-8'?>\n")
+    if not (data.elements or data.tags) and data.note is None and data.meta is None:
+        outfile.write(etree.tostring(etree.Element("osm", data.attrs)) + b"\n")
+        return
+    with etree.xmlfile(outfile, encoding="utf-8") as xf:
+        with xf.element("osm", data.attrs):
+            if data.note is not None:
+                e = etree.Element("note")
+                e.text = data.note
+                write_element(xf, e)
+            if data.meta is not None:
+                write_element(xf, etree.Element("meta", data.meta))
+            if data.tags:
+                e = etree.Element("changeset")
+                add_tags(e, data)
+                write_element(xf, e)
+            for node in nodes:
+                e = etree.Element("node", node.attrs)
+                add_tags(e, node)
+                write_element(xf, e)
+            for way in ways:
+                e = etree.Element("way", way.attrs)
+                for nd in way.nodes:
+                    etree.SubElement(e, "nd", {"ref": str(nd.id)})
+                add_tags(e, way)
+                write_element(xf, e)
+            for rel in relations:
+                e = etree.Element("relation", rel.attrs)
+                for m in rel.members:
+                    etree.SubElement(e, "member", m.attrs)
+                add_tags(e, rel)
+                write_element(xf, e)
+            xf.write("\n")
+    outfile.write(b"\n")
+
+
+def get_tags(elem):
+    """Return the tags of a XML element as a dictionary."""
+    return {t.get("k"): t.get("v") for t in elem.iterchildren("tag")}
+
+
+def release(elem):
+    """Free the memory used by a top level XML element already read."""
+    elem.clear()
+    while elem.getprevious() is not None:
+        del elem.getparent()[0]
+
+
+def iter_tags(infile, query=None):
+    """
+    Read the tags of the elements in OSM XML without building a data set.
+
+    Args:
+        infile: binary file like object
+        query (func): function that takes the tags of an element and returns
+            a boolean deciding if it will be included or not
+
+    Yields:
+        tuple: element type, element id and tags dictionary
+    """
+    context = etree.iterparse(infile, events=("end",), tag=OSM_TYPES)
+    for event, elem in context:
+        tags = get_tags(elem)
+        if query is None or query(tags):
+            yield elem.tag, int(elem.get("id")), tags
+        release(elem)
+    del context
+
+
+def deserialize(infile, data=None, query=None, meta=True):
+    """
+    Generate a OSM data set from OSM XML or append to existing data.
+
+    Each element is released as soon as it is read. References in ways and
+    relations are kept as integer ids and resolved once the whole file has
+    been read. Missing references are discarded and the version of the
+    referencing element is increased.
+
+    Args:
+        infile: binary file like object
+        data (Osm): data set to append to, a new one if None
+        query (func): function that takes the tags of an element and returns
+            a boolean deciding if it will be included or not. The elements
+            not included are kept only if they are referenced by an included
+            element, directly or through other referenced elements
+        meta (bool): False to read only the id and not the other metadata
+            attributes (version, timestamp, user, ...)
+
+    Returns:
+        Osm: OSM data set
+    """
     if data is None:
         data = osm.Osm()
-    context = etree.iterparse(infile, events=("end",))
-    childs = []
-    tags = {}
+    ways = []  # pairs of way and array of nodes ids
+    relations = []  # pairs of relation and list of (type, id, role) members
+    spare = []  # elements not matching query
+    context = etree.iterparse(infile, events=("end",), tag=TOP_LEVEL_TAGS)
     for event, elem in context:
         if elem.tag == "osm":
             data.upload = elem.get("upload")
             data.version = elem.get("version")
             data.generator = elem.get("generator")
+            break
+        tags = get_tags(elem)
+        match = query is None or elem.tag not in OSM_TYPES or query(tags)
+        attrs = dict(elem.attrib) if meta else {"id": elem.get("id")}
+        if elem.tag == "node":
+            lon = float(elem.get("lon"))
+            lat = float(elem.get("lat"))
+            el = data.Node(lon, lat, tags=tags, attrs=attrs)
+        elif elem.tag == "way":
+            el = data.Way(tags=tags, attrs=attrs)
+            refs = array("q", (int(nd.get("ref")) for nd in elem.iterchildren("nd")))
+            ways.append((el, refs))
+        elif elem.tag == "relation":
+            el = data.Relation(tags=tags, attrs=attrs)
+            members = [
+                (m.get("type")[0].lower(), int(m.get("ref")), m.get("role"))
+                for m in elem.iterchildren("member")
+            ]
+            relations.append((el, members))
         elif elem.tag == "changeset":
             data.tags = tags
-            tags = {}
         elif elem.tag == "note":
             data.note = str(elem.text)
         elif elem.tag == "meta":
             data.meta = dict(elem.attrib)
-        elif elem.tag == "node":
-            lon = float(elem.get("lon"))
-            lat = float(elem.get("lat"))
-            n = data.Node(lon, lat, tags=tags, attrs=dict(elem.attrib))
-            tags = {}
-        elif elem.tag == "way":
-            w = data.Way(tags=tags, attrs=dict(elem.attrib))
-            w.nodes = childs
-            childs = []
-            tags = {}
-        elif elem.tag == "nd":
-            childs.append(elem.get("ref"))
-        elif elem.tag == "relation":
-            r = data.Relation(tags=tags, attrs=dict(elem.attrib))
-            r.members = childs
-            childs = []
-            tags = {}
-        elif elem.tag == "member":
-            childs.append(
-                {
-                    "ref": elem.get("ref"),
-                    "type": elem.get("type"),
-                    "role": elem.get("role"),
-                }
-            )
-        elif elem.tag == "tag":
-            tags[elem.get("k")] = elem.get("v")
-        elem.clear()
-        if hasattr(elem, "xpath"):
-            for ancestor in elem.xpath("ancestor-or-self::*"):
-                while ancestor.getprevious() is not None:
-                    del ancestor.getparent()[0]
+        if not match:
+            spare.append(el)
+        release(elem)
     del context
-    for way in data.ways:
-        missing = []
-        for i, ref in enumerate(way.nodes):
-            if isinstance(ref, str):
-                if "n{}".format(ref) in data.index:
-                    n = data.get(ref)
-                    way.nodes[i] = n
-                    data.parents[n].add(way)
-                else:
-                    missing.append(i)
-        if len(missing) > 0:
-            for i in sorted(missing, reverse=True):
-                way.nodes.pop(i)
-            if way.version is not None:
-                way.version = str(int(way.version) + 1)
-    for rel in data.relations:
-        missing = []
-        for i, m in enumerate(rel.members):
-            if isinstance(m, dict):
-                if m["type"][0].lower() + str(m["ref"]) in data.index:
-                    el = data.get(m["ref"], m["type"])
-                    rel.members[i] = osm.Relation.Member(el, m["role"])
-                    data.parents[el].add(rel)
-                else:
-                    missing.append(i)
-        if len(missing) > 0:
-            for i in sorted(missing, reverse=True):
-                rel.members.pop(i)
-            if rel.version is not None:
-                rel.version = str(int(rel.version) + 1)
+    data.resolve_references(ways, relations)
+    spare_ids = {id(el) for el in spare}  # elements compare by geometry
+    pending = [el for el in spare if not data.parents.get(el)]
+    while pending:  # release the references of the discarded elements
+        el = pending.pop()
+        if id(el) not in spare_ids:
+            continue
+        spare_ids.discard(id(el))
+        data.unregister(el)
+        for child in el.childs:
+            data.parents[child].discard(el)
+            if id(child) in spare_ids and not data.parents[child]:
+                pending.append(child)
     return data
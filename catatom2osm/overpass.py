@@ -1,14 +1,58 @@
 """Minimum Overpass API interface."""
+import hashlib
+import os
 import re
+import shutil
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import unquote
 
 from catatom2osm import config, download
 from catatom2osm.exceptions import CatIOError
 
+RUNTIME_ERROR = re.compile(rb'<remark>\s*runtime error|"remark"\s*:\s*"runtime error')
+
+_locks = defaultdict(threading.Lock)  # updates of the cache in progress
+_locks_lock = threading.Lock()
+
+
+def get_lock(path):
+    """Return the lock to update a path in the cache."""
+    with _locks_lock:
+        return _locks[path]
+
+
+def check_results(path):
+    """Raise CatIOError if a file is empty or has an Overpass runtime error."""
+    if os.path.getsize(path) == 0:
+        raise CatIOError(_("Empty Overpass response"))
+    tail = b""
+    with open(path, "rb") as fo:
+        for chunk in iter(lambda: fo.read(download.chunk_size), b""):
+            if RUNTIME_ERROR.search(tail + chunk):
+                raise CatIOError(_("Overpass runtime error in the query results"))
+            tail = chunk[-64:]
+
+
+def get_key(url):
+    """Return the key in the cache of a query url, independent of the server."""
+    query = unquote(url.split("?", 1)[-1]).strip()
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+def get_age(path):
+    """Return the seconds since a file was modified or None if it don't exists."""
+    try:
+        return time.time() - os.path.getmtime(path)
+    except OSError:
+        return None
+
 
 class Query(object):
     """Class for a query to Overpass."""
 
-    def __init__(self, search_area, output="xml", down=True, meta=True):
+    def __init__(self, search_area, output="xml", down=True, meta=True, kind="data"):
         """
         Construct a query.
 
@@ -17,8 +61,10 @@ class Query(object):
             output (str): xml (default) / json
             down (bool): True (default) to include recurse down elements
             meta (bool): True (default) to include metadata
+            kind (str): Type of query for the cache, data (default) / boundary
         """
         self.output = output
+        self.kind = kind
         self.down = "(._;>>;);" if down else ""
         self.meta = "out meta;" if meta else "out;"
         self.area_id = ""
@@ -76,8 +122,8 @@ class Query(object):
             )
         return self.url
 
-    def download(self, filename, log=False):
-        """Download query results to filename."""
+    def fetch(self, filename, log=False):
+        """Download query results to filename from the first available server."""
         for server in config.osm3s_servers:
             try:
                 url = self.get_url(server)
@@ -85,11 +131,88 @@ class Query(object):
                     log.debug(self.url)
                 download.wget(url, filename)
                 return
-            except IOError:
+            except (IOError, CatIOError):
                 pass
         raise CatIOError("Can't read from any Overpass server'")
 
+    def update_cache(self, path, log=False):
+        """
+        Download the query results to the cache.
+
+        The results are written to a temporary file and replace the cached
+        ones only if check_results accepts them.
+        """
+        tmp_path = path + ".new"
+        self.fetch(tmp_path, log)
+        try:
+            check_results(tmp_path)
+        except CatIOError:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+
+    def revalidate(self, path):
+        """Update the cached results in the background, once at a time."""
+        lock = get_lock(path)
+        if not lock.acquire(blocking=False):
+            return
+
+        def update():
+            try:
+                self.update_cache(path)
+            except CatIOError:
+                pass
+            finally:
+                lock.release()
+
+        threading.Thread(target=update).start()
+
+    def get_cache_path(self):
+        """Return the path of the query results in the cache."""
+        fn = get_key(self.get_url()) + "." + self.output
+        return os.path.join(config.overpass_cache_path, fn)
+
+    def cache(self, log=False):
+        """
+        Return the path of the query results in the cache.
+
+        The results are downloaded if they aren't in the cache or they are
+        older than the TTL for this kind of query plus the stale time. In the
+        stale time, the cached results are returned and updated in the
+        background. In offline mode only the cached results are used. Only
+        one update of each query runs at once, and results with errors don't
+        replace the cached ones.
+        """
+        path = self.get_cache_path()
+        age = get_age(path)
+        if config.overpass_offline:
+            if age is None:
+                msg = _("The Overpass query is not in the cache: %s")
+                raise CatIOError(msg % unquote(self.get_url()))
+            return path
+        ttl = config.overpass_ttl.get(self.kind, 0)
+        stale = config.overpass_stale.get(self.kind, 0)
+        if age is None or age >= ttl + stale:
+            os.makedirs(config.overpass_cache_path, exist_ok=True)
+            with get_lock(path):
+                age = get_age(path)  # could be updated while waiting
+                if age is None or age >= ttl + stale:
+                    self.update_cache(path, log)
+        elif age >= ttl:
+            self.revalidate(path)
+        return path
+
+    def download(self, filename, log=False):
+        """Download query results to filename."""
+        if not config.overpass_cache:
+            self.fetch(filename, log)
+            return
+        shutil.copyfile(self.cache(log), filename)
+
     def read(self):
         """Return query results."""
-        response = download.get_response(self.get_url())
-        return response.content
+        if not config.overpass_cache:
+            response = download.get_response(self.get_url())
+            return response.content
+        with open(self.cache(), "rb") as fo:
+            return fo.read()
@@ -0,0 +1,107 @@
+"""
+Parallel gzip writer.
+
+The data is split in blocks that are compressed as independent gzip members
+in a pool of threads (zlib releases the GIL while compressing). A file with
+several concatenated members is a valid gzip file for any reader.
+"""
+import os
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from catatom2osm import config
+
+BLOCK_SIZE = 128 * 1024  # Size of the uncompressed data in each member
+
+_executor = None
+
+
+def get_workers():
+    """Return the number of compression threads."""
+    return config.compression_threads or os.cpu_count() or 1
+
+
+def get_executor():
+    """Return the pool of threads shared by all the writers."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=get_workers())
+    return _executor
+
+
+def compress(data, level):
+    """Return data compressed as a gzip member with mtime=0."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class GzipWriter(object):
+    """
+    Write only binary file object that compresses blocks in parallel.
+
+    The output is the same for the same data, level and block size.
+    """
+
+    def __init__(self, filename, level=None, block_size=BLOCK_SIZE):
+        """
+        Open a file for writing.
+
+        Args:
+            filename (str): path of the output file
+            level (int): compression level, config.compression_level if None
+            block_size (int): size of the uncompressed data in each member
+        """
+        self.fileobj = open(filename, "wb")
+        self.level = config.compression_level if level is None else level
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.pending = deque()
+        self.members = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def closed(self):
+        return self.fileobj is None
+
+    def write(self, data):
+        """Add data to the output and return its length."""
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self.submit(bytes(self.buffer[: self.block_size]))
+            del self.buffer[: self.block_size]
+        return len(data)
+
+    def submit(self, block):
+        """Queue a block for compression and write the finished ones."""
+        self.pending.append(get_executor().submit(compress, block, self.level))
+        self.members += 1
+        while len(self.pending) > 2 * get_workers():
+            self.fileobj.write(self.pending.popleft().result())
+
+    def flush(self):
+        """Write the members already compressed."""
+        while self.pending and self.pending[0].done():
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        """Compress the remaining data and close the file."""
+        if self.fileobj is None:
+            return
+        try:
+            if self.buffer or self.members == 0:
+                if self.members == 0:
+                    self.fileobj.write(compress(bytes(self.buffer), self.level))
+                else:
+                    self.submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+        finally:
+            self.fileobj.close()
+            self.fileobj = None
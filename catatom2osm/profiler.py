@@ -0,0 +1,239 @@
+"""
+Time and memory usage of the processing stages.
+
+Optionally, the top-level stages are captured with cProfile or a sampling
+profiler. Each cProfile capture is saved in a .prof file, and the stacks of
+all the captures are saved in a collapsed-stack text file (one line per
+stack with the stage and the frames separated by semicolons and its
+weight, the input format of flamegraph.pl and speedscope).
+"""
+import cProfile
+import functools
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+import psutil
+
+from catatom2osm import config
+from catatom2osm.report import MEMORY_UNIT
+from catatom2osm.report import instance as report
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILERS = ("cprofile", "sample")
+STACKS_FILE = "profile_stacks.txt"
+
+_stack = []  # Names of the running stages
+_session = None  # Profiling session of the running application
+
+
+def get_peak_rss():
+    """Return the peak resident set size of the process in bytes."""
+    if resource is None:
+        return getattr(psutil.Process().memory_info(), "peak_wset", 0)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Stage(object):
+    """
+    Context manager to measure a processing stage.
+
+    Appends to the 'stages' report value the name, nesting level, wall time,
+    CPU time, resident memory delta and peak resident memory increase of the
+    stage, and the feature count of a layer before and after it, if
+    config.report_system_info is True. Captures the top-level stages if a
+    profiling session is started.
+    """
+
+    def __init__(self, name, layer=None):
+        """
+        Args:
+            name (str): Name of the stage.
+            layer (BaseLayer): Layer to count its features.
+        """
+        self.name = name
+        self.layer = layer
+        self.values = None
+
+    def __enter__(self):
+        self.capture = None
+        if _session is not None and not _stack:
+            self.capture = _session.capture(self.name)
+        _stack.append(self.name)
+        if not config.report_system_info:
+            return self
+        self.values = {"name": self.name, "level": len(_stack) - 1}
+        report.values.setdefault("stages", []).append(self.values)
+        if self.layer is not None:
+            self.features = self.layer.featureCount()
+        self.rss = psutil.Process().memory_info().rss
+        self.peak = get_peak_rss()
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        _stack.pop()
+        if self.values is not None:
+            self.values["wall"] = time.perf_counter() - self.wall
+            self.values["cpu"] = time.process_time() - self.cpu
+            rss = psutil.Process().memory_info().rss
+            self.values["rss"] = (rss - self.rss) / MEMORY_UNIT
+            self.values["peak"] = (get_peak_rss() - self.peak) / MEMORY_UNIT
+            if self.layer is not None:
+                self.values["features"] = [self.features, self.layer.featureCount()]
+        if self.capture is not None:
+            self.capture.stop()
+
+
+def stage(name=None, features=False):
+    """
+    Measure a method as a processing stage.
+
+    Args:
+        name (str): Name of the stage, the method name if None.
+        features (bool): The method belongs to a layer, prefix the stage name
+            with the layer name and count its features.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            label = name or func.__name__
+            layer = None
+            if features:
+                layer = self
+                label = self.name() + "." + label
+            with Stage(label, layer):
+                return func(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def get_label(code):
+    """Return the name of a function in the collapsed stacks."""
+    return os.path.basename(code.co_filename) + ":" + code.co_name
+
+
+def get_stats_label(func):
+    """Return the name of a pstats function in the collapsed stacks."""
+    (filename, line, name) = func
+    if filename == "~":
+        return name
+    return os.path.basename(filename) + ":" + name
+
+
+class CProfileCapture(object):
+    """Capture of a stage with cProfile."""
+
+    def __init__(self, session, name):
+        self.session = session
+        self.name = name
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        """
+        Save the capture in a .prof file and its stacks.
+
+        cProfile only records the caller of each function, so the stacks have
+        two frames weighted with the time spent in the callee (microseconds).
+        """
+        self.profile.disable()
+        self.profile.dump_stats(self.session.get_path(self.name, ".prof"))
+        stacks = Counter()
+        stats = pstats.Stats(self.profile).stats
+        for (func, (cc, nc, tt, ct, callers)) in stats.items():
+            label = get_stats_label(func)
+            if not callers:
+                stacks[label] += int(tt * 1e6)
+            for (caller, values) in callers.items():
+                stacks[get_stats_label(caller) + ";" + label] += int(values[2] * 1e6)
+        self.session.write_stacks(self.name, stacks)
+
+
+class SampleCapture(threading.Thread):
+    """Capture of a stage sampling the stack of the calling thread."""
+
+    def __init__(self, session, name):
+        super(SampleCapture, self).__init__(daemon=True)
+        self.session = session
+        self.name = name
+        self.ident_to_sample = threading.get_ident()
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.start()
+
+    def run(self):
+        while not self.stopped.wait(config.profile_interval):
+            frame = sys._current_frames().get(self.ident_to_sample)
+            stack = []
+            while frame is not None:
+                stack.append(get_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        """Stop sampling and save the stacks (weighted with the samples)."""
+        self.stopped.set()
+        self.join()
+        self.session.write_stacks(self.name, self.stacks)
+
+
+class Session(object):
+    """Profiling of the top-level stages of an application run."""
+
+    def __init__(self, kind, path):
+        """
+        Args:
+            kind (str): One of PROFILERS.
+            path (str): Folder for the output files.
+        """
+        if kind not in PROFILERS:
+            raise ValueError("Unknown profiler '%s'" % kind)
+        self.kind = kind
+        self.path = path
+        self.count = 0
+        self.stacks_path = os.path.join(path, STACKS_FILE)
+        open(self.stacks_path, "w").close()
+
+    def capture(self, name):
+        """Start the capture of a stage."""
+        self.count += 1
+        if self.kind == "cprofile":
+            return CProfileCapture(self, name)
+        return SampleCapture(self, name)
+
+    def get_path(self, name, ext):
+        """Return the path of an output file for the current stage."""
+        return os.path.join(self.path, "profile_%02d_%s%s" % (self.count, name, ext))
+
+    def write_stacks(self, name, stacks):
+        """Append the collapsed stacks of a stage to the stacks file."""
+        with open(self.stacks_path, "a") as fo:
+            for (stack, weight) in stacks.items():
+                if weight > 0:
+                    fo.write("%s;%s %d\n" % (name, stack, weight))
+
+
+def start(kind, path):
+    """Capture the next top-level stages with a profiler."""
+    global _session
+    _session = Session(kind, path)
+
+
+def stop():
+    """Stop capturing stages."""
+    global _session
+    _session = None
@@ -22,6 +22,9 @@ class FakeTqdm:
     def update(self, *args, **kwargs):
         pass
 
+    def reset(self, *args, **kwargs):
+        pass
+
     def close(self):
         pass
 
@@ -18,6 +18,25 @@ MEMORY_LABEL = "MB"
 int_format = lambda v: locale.format_string("%d", v, True)
 
 
+def stage_format(v):
+    output = TAB * v.get("level", 0) + v["name"] + SEP
+    output += locale.format_string(
+        "%.1f s, CPU %.1f s, RSS %+.1f %s, peak %+.1f %s",
+        (
+            v.get("wall", 0),
+            v.get("cpu", 0),
+            v.get("rss", 0),
+            MEMORY_LABEL,
+            v.get("peak", 0),
+            MEMORY_LABEL,
+        ),
+        True,
+    )
+    if "features" in v:
+        output += ", " + _("features") + " %d -> %d" % tuple(v["features"])
+    return output
+
+
 class Report(object):
     def __init__(self, **kwargs):
         self.titles = OrderedDict(
@@ -46,6 +65,8 @@ class Report(object):
                 ("memory", _("Total memory")),
                 ("rss", _("Physical memory usage")),
                 ("vms", _("Virtual memory usage")),
+                ("group_stages", _("Stages")),
+                ("stages", ""),
                 ("group_address", _("Addresses")),
                 ("subgroup_ad_cdau", "CDAU"),
                 ("inp_address_cdau", _("Feature count")),
@@ -154,6 +175,7 @@ class Report(object):
             "memory": lambda v: locale.format_string("%.2f ", v, True) + MEMORY_LABEL,
             "rss": lambda v: locale.format_string("%.2f ", v, True) + MEMORY_LABEL,
             "vms": lambda v: locale.format_string("%.2f ", v, True) + MEMORY_LABEL,
+            "stages": stage_format,
         }
         self.clear(**kwargs)
 
@@ -265,6 +287,13 @@ class Report(object):
     def inc(self, key, step=1):
         self.values[key] = self.get(key) + step
 
+    def merge(self, values):
+        for (key, value) in values.items():
+            if isinstance(value, Counter):
+                self.values.setdefault(key, Counter()).update(value)
+            else:
+                self.inc(key, value)
+
     def sum(self, *args):
         return sum(self.get(key) for key in args)
 
@@ -420,6 +449,8 @@ class Report(object):
                                 + config.eol
                             )
                         for value in self.values[key]:
+                            if key in self.formats:
+                                value = self.formats[key](value)
                             output += TAB + value + config.eol
                 else:
                     value = self.values[key]
@@ -0,0 +1,340 @@
+"""
+Parallel generation of tasks files.
+
+The tasks features are shipped to worker processes as WKB geometries with
+its OSM tags. Each worker builds the OSM data set, merges the addresses,
+collects the statistics and writes the compressed file. This module must not
+depend on QGIS so that the workers can be started without it. The helpers to
+build and write the OSM data sets are shared with the layers and the
+application.
+"""
+import os
+import struct
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from catatom2osm import config, osm, osmpbf, osmxml, pgzip
+from catatom2osm.report import Report
+
+WKB_POINT = 1
+WKB_POLYGON = 3
+WKB_MULTIPOLYGON = 6
+
+SETTINGS = ("show_refs", "sort_osm", "compression_level")
+
+
+def get_workers():
+    """Return the number of processes to generate tasks files."""
+    return config.task_processes or os.cpu_count() or 1
+
+
+def read_wkb(wkb):
+    """
+    Decode a Point, Polygon or MultiPolygon WKB geometry.
+
+    Z and M values are discarded.
+
+    Args:
+        wkb (bytes): geometry in WKB, ISO WKB or EWKB format
+
+    Returns:
+        tuple: geometry type and coordinates. A pair of coordinates for points,
+        a list of rings for polygons or a list of polygons for multipolygons.
+    """
+    (geom_type, coords, pos) = _read_geometry(memoryview(wkb), 0)
+    return geom_type, coords
+
+
+def _read_geometry(buf, pos):
+    bo = "<" if buf[pos] == 1 else ">"
+    (code,) = struct.unpack_from(bo + "I", buf, pos + 1)
+    pos += 5
+    dims = 2
+    if code & 0xE0000000:
+        dims += bool(code & 0x80000000) + bool(code & 0x40000000)
+        if code & 0x20000000:
+            pos += 4
+        code &= 0xFFFF
+    dims += (code // 1000 + 1) // 2
+    geom_type = code % 1000
+    point_fmt = bo + "d" * dims
+    point_size = 8 * dims
+    if geom_type == WKB_POINT:
+        coords = struct.unpack_from(point_fmt, buf, pos)[:2]
+        return geom_type, coords, pos + point_size
+    (count,) = struct.unpack_from(bo + "I", buf, pos)
+    pos += 4
+    if geom_type == WKB_POLYGON:
+        coords = []
+        for i in range(count):
+            (size,) = struct.unpack_from(bo + "I", buf, pos)
+            pos += 4
+            ring = [
+                p[:2]
+                for p in struct.iter_unpack(
+                    point_fmt, buf[pos : pos + size * point_size]
+                )
+            ]
+            coords.append(ring)
+            pos += size * point_size
+        return geom_type, coords, pos
+    if geom_type == WKB_MULTIPOLYGON:
+        coords = []
+        for i in range(count):
+            (part_type, part, pos) = _read_geometry(buf, pos)
+            coords.append(part)
+        return geom_type, coords, pos
+    raise ValueError("Unsupported WKB geometry type %d" % code)
+
+
+def new_osm(upload="never"):
+    """Return an empty OSM data set with the application as generator."""
+    generator = config.app_name + " " + config.app_version
+    return osm.Osm(upload, generator=generator)
+
+
+def add_element(data, geom_type, coords):
+    """
+    Add the OSM element for a geometry to a data set.
+
+    Polygons with only one ring are added as ways, the others as multipolygon
+    relations.
+
+    Args:
+        data (Osm): OSM data set
+        geom_type (int): WKB_POINT, WKB_POLYGON or WKB_MULTIPOLYGON
+        coords: coordinates of the geometry like in read_wkb
+
+    Returns:
+        Element: the node, way or relation added
+    """
+    if geom_type == WKB_POINT:
+        return data.Node(coords)
+    mp = [coords] if geom_type == WKB_POLYGON else coords
+    if len(mp) == 1:
+        if len(mp[0]) == 1:
+            return data.Way(mp[0][0])
+        return data.Polygon(mp[0])
+    return data.MultiPolygon(mp)
+
+
+def to_osm(features, tags, upload="yes"):
+    """
+    Build an OSM data set like BaseLayer.to_osm.
+
+    Args:
+        features (list): pairs of WKB geometry and tags for each feature
+        tags (dict): tags of the data set
+        upload (str): upload attribute of the data set
+
+    Returns:
+        Osm: OSM data set
+    """
+    data = new_osm(upload)
+    for (wkb, feat_tags) in features:
+        (geom_type, coords) = read_wkb(wkb)
+        e = add_element(data, geom_type, coords)
+        e.tags.update(feat_tags)
+    for (key, value) in tags.items():
+        data.tags[key] = value
+    return data
+
+
+def merge_address(building_osm, address_osm):
+    """
+    Copy address from address_osm to building_osm using 'ref' tag.
+
+    If there exists one building with the same 'ref' that an address, copy
+    the address tags to the building if it isn't a 'entrace' type address or
+    else to the entrance if there exist a node with the address coordinates
+    in the building.
+
+    Precondition: building.move_address deleted addresses belonging to multiple
+    buildings
+
+    Args:
+        building_osm (Osm): OSM data set with buildings
+        address_osm (Osm): OSM data set with addresses
+
+    Returns:
+        int: number of 'parcel' addresses not unique for its building
+    """
+    if "source:date" in address_osm.tags:
+        building_osm.tags["source:date:addr"] = address_osm.tags["source:date"]
+    address_index = defaultdict(list)
+    building_index = defaultdict(list)
+    for bu in building_osm.elements:
+        if "ref" in bu.tags:
+            building_index[bu.tags["ref"]].append(bu)
+    for ad in address_osm.nodes:
+        if ad.tags.get("ref", "") in building_index:
+            address_index[ad.tags["ref"]].append(ad)
+    md = 0
+    for (ref, group) in list(building_index.items()):
+        parcel_ad = []
+        entrance_count = 0
+        for ad in address_index[ref]:
+            entrance = False
+            if "entrance" in ad.tags:
+                for w in building_osm.get_outline(group):
+                    entrance = w.search_node(ad.x, ad.y)
+                    if entrance:
+                        entrance.tags.update(ad.tags)
+                        if not config.show_refs:
+                            entrance.tags.pop("ref", None)
+                        entrance.tags.pop("image", None)
+                        break
+            if entrance:
+                entrance_count += 1
+            else:
+                parcel_ad.append(ad)
+        if len(parcel_ad) == 1 and entrance_count == 0:
+            ad = parcel_ad.pop()
+            bu = group[0]
+            bu.tags.update(ad.tags)
+            bu.tags.pop("image", None)
+            bu.tags.pop("entrance", None)
+        md += len(parcel_ad)
+    return md
+
+
+def index_addresses(address_osm):
+    """Return the coordinates and tags of the address nodes indexed by 'ref'."""
+    index = defaultdict(list)
+    for ad in address_osm.nodes:
+        if "ref" in ad.tags:
+            index[ad.tags["ref"]].append((ad.x, ad.y, dict(ad.tags)))
+    return index
+
+
+def get_addresses(features, address_index):
+    """Return the addresses in address_index for the features references."""
+    refs = dict.fromkeys(tags["ref"] for (wkb, tags) in features if "ref" in tags)
+    return [ad for ref in refs for ad in address_index.get(ref, [])]
+
+
+def write_osm(data, osm_path):
+    """
+    Write an OSM data set to a XML or PBF file.
+
+    Removes the 'ref' tags unless config.show_refs and merges the duplicated
+    elements before.
+
+    Args:
+        data (Osm): OSM data set
+        osm_path (str): output file name (compress if ends with .gz, PBF if
+            ends with .pbf)
+    """
+    if not config.show_refs:
+        for e in data.elements:
+            if "ref" in e.tags:
+                del e.tags["ref"]
+    data.merge_duplicated()
+    if osm_path.endswith(".gz"):
+        file_obj = pgzip.GzipWriter(osm_path, config.compression_level)
+    else:
+        file_obj = open(osm_path, "wb")
+    writer = osmpbf if osm_path.endswith(".pbf") else osmxml
+    writer.serialize(file_obj, data, sort=config.sort_osm)
+    file_obj.close()
+
+
+def write_task(
+    osm_path,
+    features,
+    tags,
+    addresses=None,
+    address_tags=None,
+    address_stats=False,
+    building_stats=False,
+):
+    """
+    Generate a task file in a worker process.
+
+    Args:
+        osm_path (str): output file name
+        features (list): pairs of WKB geometry and tags for each feature
+        tags (dict): tags of the data set
+        addresses (list): coordinates and tags of the addresses to merge,
+            None to skip the merge
+        address_tags (dict): tags of the addresses data set
+        address_stats (bool): collect addresses statistics
+        building_stats (bool): collect buildings statistics
+
+    Returns:
+        tuple: output file name, report values and number of nodes, ways and
+        relations written
+    """
+    stats = Report()
+    task_osm = to_osm(features, tags)
+    if addresses is not None:
+        address_osm = osm.Osm()
+        address_osm.tags.update(address_tags or {})
+        for (x, y, ad_tags) in addresses:
+            address_osm.Node(x, y, ad_tags)
+        md = merge_address(task_osm, address_osm)
+        if md > 0:
+            stats.inc("not_unique_addresses", md)
+    if address_stats:
+        stats.address_stats(task_osm)
+    if building_stats:
+        stats.cons_stats(task_osm)
+        stats.osm_stats(task_osm)
+    write_osm(task_osm, osm_path)
+    values = {
+        k: v
+        for (k, v) in stats.values.items()
+        if isinstance(v, (int, float)) or (isinstance(v, Counter) and v)
+    }
+    counts = (len(task_osm.nodes), len(task_osm.ways), len(task_osm.relations))
+    return osm_path, values, counts
+
+
+def init_worker(settings):
+    """Apply the parent configuration settings in a worker process."""
+    for (key, value) in settings.items():
+        setattr(config, key, value)
+    config.report_system_info = False
+    config.compression_threads = 1
+
+
+class TaskPool(object):
+    """Pool of processes to generate tasks files."""
+
+    def __init__(self, workers=None):
+        """
+        Start the worker processes.
+
+        Args:
+            workers (int): number of processes, get_workers() if None
+        """
+        self.workers = workers or get_workers()
+        settings = {key: getattr(config, key) for key in SETTINGS}
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=get_context("spawn"),
+            initializer=init_worker,
+            initargs=(settings,),
+        )
+        self.pending = deque()
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.executor.shutdown(cancel_futures=args[0] is not None)
+
+    def submit(self, *args, **kwargs):
+        """Queue a task and keep the results of the finished ones."""
+        self.pending.append(self.executor.submit(write_task, *args, **kwargs))
+        while len(self.pending) > 2 * self.workers:
+            self.results.append(self.pending.popleft().result())
+
+    def close(self):
+        """Wait for the queued tasks and return the results of all them."""
+        while self.pending:
+            self.results.append(self.pending.popleft().result())
+        self.executor.shutdown()
+        return self.results
@@ -0,0 +1,57 @@
+"""
+Memory and throughput benchmark for the OSM data model.
+
+Builds a data set like a building task, with N nodes grouped in closed square
+ways of four nodes, and reports the elapsed time and the traced memory.
+With -m it also reports the time to merge duplicated geometries.
+
+Usage: python -m test.benchmark_osm [-n NODES] [-c] [-m]
+"""
+import argparse
+import time
+import tracemalloc
+
+from catatom2osm import osm
+
+
+def build(size, compact=False):
+    """Return a data set with size nodes in closed ways."""
+    kwargs = {"compact": True} if compact else {}
+    data = osm.Osm(upload="yes", **kwargs)
+    for i in range(size // 4):
+        x = (i % 1000) * 10.0
+        y = (i // 1000) * 10.0
+        nodes = [
+            data.Node(x, y),
+            data.Node(x + 5, y),
+            data.Node(x + 5, y + 5),
+            data.Node(x, y + 5),
+        ]
+        data.Way(nodes + nodes[:1], tags={"building": "yes"})
+    return data
+
+
+def run(size, compact=False, merge=False):
+    tracemalloc.start()
+    start = time.perf_counter()
+    data = build(size, compact)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"Elements: {len(data.elements)}")
+    print(f"Build time: {elapsed:.2f} s")
+    print(f"Memory: {current / 2**20:.1f} MiB (peak {peak / 2**20:.1f} MiB)")
+    if merge:
+        start = time.perf_counter()
+        data.merge_duplicated()
+        print(f"Merge time: {time.perf_counter() - start:.2f} s")
+    return data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--nodes", type=int, default=1000000)
+    parser.add_argument("-c", "--compact", action="store_true")
+    parser.add_argument("-m", "--merge", action="store_true")
+    args = parser.parse_args()
+    run(args.nodes, args.compact, args.merge)
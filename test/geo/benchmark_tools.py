@@ -0,0 +1,48 @@
+"""
+Throughput benchmark for merge_groups.
+
+Builds N groups of ids, each one split in overlapping pairs of ids like the
+contacts between adjacent polygons, shuffles the pairs and reports the time
+to merge them. With -r it also times the former algorithm (quadratic, use
+with a small N).
+
+Usage: python -m test.geo.benchmark_tools [-n GROUPS] [-s SIZE] [-r]
+"""
+import argparse
+import random
+import time
+from test.geo.test_tools import merge_groups_reference
+
+from catatom2osm.geo.tools import merge_groups
+
+
+def build(groups, size=5):
+    """Return the shuffled pairs of groups with size members."""
+    adjs = [
+        {g * size + i, g * size + i + 1} for g in range(groups) for i in range(size - 1)
+    ]
+    random.Random(0).shuffle(adjs)
+    return adjs
+
+
+def run(groups, size=5, reference=False):
+    adjs = build(groups, size)
+    print(f"Sets: {len(adjs)}")
+    start = time.perf_counter()
+    result = merge_groups(adjs)
+    print(f"Groups: {len(result)}")
+    print(f"Merge time: {time.perf_counter() - start:.2f} s")
+    if reference:
+        start = time.perf_counter()
+        expected = merge_groups_reference(list(adjs))
+        print(f"Reference time: {time.perf_counter() - start:.2f} s")
+        print("Same groups:", result == expected)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--groups", type=int, default=100000)
+    parser.add_argument("-s", "--size", type=int, default=5)
+    parser.add_argument("-r", "--reference", action="store_true")
+    args = parser.parse_args()
+    run(args.groups, args.size, args.reference)
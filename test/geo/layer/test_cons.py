@@ -5,7 +5,7 @@ from collections import Counter
 import mock
 from qgis.core import QgsExpression, QgsFeature, QgsFeatureRequest, QgsVectorLayer
 
-from catatom2osm import osm
+from catatom2osm import osm, taskpool
 from catatom2osm.app import QgsSingleton
 from catatom2osm.geo.geometry import Geometry
 from catatom2osm.geo.layer.address import AddressLayer
@@ -504,6 +504,18 @@ class TestConsLayer(unittest.TestCase):
         self.assertEqual(ways, len(data.ways))
         self.assertEqual(rels, len(data.relations))
 
+    def test_to_wkb(self):
+        features = self.layer.to_wkb()
+        self.assertEqual(len(features), self.layer.featureCount())
+        data = self.layer.to_osm(upload="yes")
+        result = taskpool.to_osm(features, data.tags)
+        self.assertEqual(len(result.nodes), len(data.nodes))
+        self.assertEqual(len(result.ways), len(data.ways))
+        self.assertEqual(len(result.relations), len(data.relations))
+        for (el, other) in zip(data.elements, result.elements):
+            self.assertEqual(other.tags, el.tags)
+            self.assertEqual(other.geometry(), el.geometry())
+
     @mock.patch("catatom2osm.geo.layer.base.log", m_log)
     @mock.patch("catatom2osm.geo.layer.cons.log", m_log)
     @mock.patch("catatom2osm.geo.layer.base.progressbar", mock.MagicMock())
@@ -40,6 +40,13 @@ class TestParcelLayer(unittest.TestCase):
         layer = ParcelLayer("38012")
         self.assertGreater(len(layer.fields().toList()), 0)
 
+    def test_get_tile_kwargs(self):
+        kwargs = self.parcel.get_tile_kwargs()
+        self.assertEqual(kwargs["mun_code"], "38012")
+        layer = ParcelLayer(**kwargs)
+        self.assertEqual(layer.mun_code, "38012")
+        self.assertEqual(layer.fields().names(), self.parcel.fields().names())
+
     def test_delete_void_parcels(self):
         self.parcel.delete_void_parcels(self.building)
         self.assertEqual(self.parcel.featureCount(), 110)
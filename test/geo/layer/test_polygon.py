@@ -8,6 +8,7 @@ from catatom2osm.app import QgsSingleton
 from catatom2osm.geo.geometry import Geometry
 from catatom2osm.geo.layer.polygon import PolygonLayer
 from catatom2osm.geo.point import Point
+from catatom2osm.geo.rings import CornerContext
 
 qgs = QgsSingleton()
 m_log = mock.MagicMock()
@@ -91,6 +92,14 @@ class TestPolygonLayer(unittest.TestCase):
             )
         )
         self.assertGreater(len(parents_per_vertex), 0)
+        self.assertTrue(
+            all(
+                [
+                    isinstance(vertex, tuple) and len(vertex) == 2
+                    for vertex in parents_per_vertex.keys()
+                ]
+            )
+        )
         self.assertTrue(
             all(
                 [
@@ -101,6 +110,41 @@ class TestPolygonLayer(unittest.TestCase):
             )
         )
 
+    def test_get_tile_kwargs(self):
+        kwargs = self.layer.get_tile_kwargs()
+        self.assertEqual(kwargs["providerLib"], "memory")
+        self.assertEqual(kwargs["baseName"], "building")
+        layer = PolygonLayer(**kwargs)
+        self.assertTrue(layer.isValid())
+        self.assertEqual(layer.wkbType(), self.layer.wkbType())
+        self.assertEqual(
+            [(f.name(), f.type()) for f in layer.fields()],
+            [(f.name(), f.type()) for f in self.layer.fields()],
+        )
+
+    def test_is_shared_segment(self):
+        ppv = {(0.0, 0.0): [1, 2, 3], (1.5, 0.0): [1, 2], (0.0, 1.5): [1, 3]}
+        va = Point(0, 0)
+        vb = Point(1.5, 0)
+        vc = Point(0, 1.5)
+        self.assertTrue(PolygonLayer.is_shared_segment(ppv, va, vb, 1))
+        self.assertTrue(PolygonLayer.is_shared_segment(ppv, va, vc, 1))
+        self.assertTrue(PolygonLayer.is_shared_segment(ppv, va, vb, 2))
+        self.assertFalse(PolygonLayer.is_shared_segment(ppv, vb, vc, 1))
+
+    @mock.patch("catatom2osm.geo.layer.base.log", m_log)
+    @mock.patch("catatom2osm.geo.layer.polygon.log", m_log)
+    @mock.patch("catatom2osm.geo.layer.base.progressbar", mock.MagicMock())
+    @mock.patch(
+        "catatom2osm.geo.layer.polygon.CornerContext", side_effect=CornerContext
+    )
+    def test_simplify_thresholds(self, m_corners):
+        self.layer.acute_thr = 12
+        self.layer.straight_thr = 3
+        self.layer.cath_thr = 0.05
+        self.layer.simplify()
+        m_corners.assert_called_once_with(mock.ANY, 12, 3, 0.05)
+
     @mock.patch("catatom2osm.geo.layer.base.log", m_log)
     @mock.patch("catatom2osm.geo.layer.base.progressbar", mock.MagicMock())
     def test_difference(self):
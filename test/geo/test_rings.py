@@ -0,0 +1,146 @@
+import random
+import unittest
+
+import mock
+from qgis.core import QgsGeometry
+
+from catatom2osm import config
+from catatom2osm.geo import Point
+from catatom2osm.geo.geometry import Geometry
+from catatom2osm.geo.rings import (
+    CornerContext,
+    SpikeContext,
+    get_corner_context,
+    get_positions,
+    get_rings,
+)
+
+
+class TestRings(unittest.TestCase):
+    def setUp(self):
+        self.square = [
+            Point(0, 0),
+            Point(50, 0.6),
+            Point(100, 0),
+            Point(105, 50),
+            Point(100, 100),
+            Point(2, 100.3),
+            Point(0, 100),
+            Point(0.3, 50),
+            Point(0, 1),
+            Point(-50, 0),
+            Point(0, 0),
+        ]
+        self.inner = [Point(10, 10), Point(20, 10), Point(20, 20), Point(10, 10)]
+        self.other = [Point(200, 0), Point(210, 0), Point(210, 10), Point(200, 0)]
+
+    def test_get_rings(self):
+        geom = Geometry.fromMultiPolygonXY([[self.square, self.inner], [self.other]])
+        rings = get_rings(geom)
+        self.assertEqual(len(rings), 3)
+        for (ring, expected) in zip(rings, [self.square, self.inner, self.other]):
+            self.assertEqual(ring.shape, (len(expected) - 1, 2))
+            self.assertEqual(ring.tolist(), [[p.x(), p.y()] for p in expected[:-1]])
+        geom = QgsGeometry.fromWkt("PolygonZ ((0 0 1, 1 0 2, 1 1 3, 0 0 1))")
+        self.assertEqual(get_rings(geom)[0].tolist(), [[0, 0], [1, 0], [1, 1]])
+
+    def test_get_positions(self):
+        rings = get_rings(Geometry.fromPolygonXY([self.square, self.inner]))
+        positions = get_positions(rings)
+        self.assertEqual(positions[(50, 0.6)], 1)
+        self.assertEqual(positions[(0, 0)], 0)
+        self.assertEqual(positions[(20, 10)], len(self.square))
+        rings = get_rings(Geometry.fromPolygonXY([self.inner, self.inner]))
+        self.assertEqual(get_positions(rings)[(10, 10)], 3)
+
+    def test_get_corner_context(self):
+        geom = Geometry.fromPolygonXY([self.square])
+        (angles, caths) = get_corner_context(get_rings(geom)[0])
+        for (i, p) in enumerate(self.square[:-1]):
+            (angle, is_acute, is_corner, cath) = p.get_corner_context(geom)
+            self.assertAlmostEqual(angles[i], angle)
+            self.assertAlmostEqual(caths[i], cath)
+
+    def test_corner_context(self):
+        ring = [Point(random.uniform(0, 100), random.uniform(0, 100)) for i in range(9)]
+        ring.append(ring[0])
+        geom = Geometry.fromPolygonXY([ring, self.inner])
+        geometries = {1: geom}
+        corners = CornerContext(geometries, 10, 5, 0.5)
+        for p in ring[:-1] + self.inner[:-1]:
+            self.assertEqual(
+                [round(v, 9) for v in corners.get_corner_context(1, (p.x(), p.y()))],
+                [round(v, 9) for v in p.get_corner_context(geom, 10, 5, 0.5)],
+            )
+        p = Point(1000, 1000)
+        self.assertEqual(
+            corners.get_corner_context(1, (1000, 1000)),
+            p.get_corner_context(geom, 10, 5, 0.5),
+        )
+        geometries[1] = Geometry.fromPolygonXY([self.other])
+        corners.reset(1)
+        p = self.other[1]
+        self.assertEqual(
+            corners.get_corner_context(1, (p.x(), p.y()))[2],
+            p.get_corner_context(geometries[1], 10, 5, 0.5)[2],
+        )
+
+    @mock.patch.object(config, "acute_thr", 11)
+    @mock.patch.object(config, "acute_inv", 6)
+    @mock.patch.object(config, "straight_thr", 3)
+    @mock.patch.object(config, "dist_thr", 0.03)
+    @mock.patch.object(config, "dist_inv", 0.2)
+    def test_context_defaults(self):
+        corners = CornerContext({})
+        self.assertEqual(
+            (corners.acute_thr, corners.straight_thr, corners.cath_thr), (11, 3, 0.03)
+        )
+        corners = CornerContext({}, 10, 5, 0.5)
+        self.assertEqual(
+            (corners.acute_thr, corners.straight_thr, corners.cath_thr), (10, 5, 0.5)
+        )
+        context = SpikeContext(Geometry.fromPolygonXY([self.inner]))
+        self.assertEqual(
+            (context.acute_thr, context.straight_thr, context.threshold), (6, 3, 0.2)
+        )
+
+    def test_spike_context(self):
+        ring = [
+            Point(0, 50),
+            Point(50, 50.4),
+            Point(49.9, 76),
+            Point(50, 74),
+            Point(50, 130),
+            Point(50.4, 100),
+            Point(75, 110),
+            Point(99, 100),
+            Point(100, 130),
+            Point(100.2, 60),
+            Point(100, 90),
+            Point(99.8, 0),
+            Point(99.5, 50),
+            Point(70, 55),
+            Point(60, 50),
+            Point(0, 50),
+        ]
+        geom = Geometry.fromPolygonXY([ring, self.inner])
+        for threshold in (0.5, 0.1):
+            context = SpikeContext(geom, 5, 5, threshold)
+            for p in ring[:-1] + self.inner[:-1]:
+                result = context.get_spike_context((p.x(), p.y()))
+                expected = p.get_spike_context(geom, 5, 5, threshold)
+                for (value, exp) in zip(result[:-1], expected[:-1]):
+                    if isinstance(exp, float):
+                        self.assertAlmostEqual(value, exp)
+                    else:
+                        self.assertEqual(value, exp)
+                if expected[-1] is None:
+                    self.assertIsNone(result[-1])
+                else:
+                    self.assertAlmostEqual(result[-1].x(), expected[-1].x())
+                    self.assertAlmostEqual(result[-1].y(), expected[-1].y())
+        p = Point(0, 50.1)
+        self.assertEqual(
+            context.get_spike_context((0, 50.1)),
+            p.get_spike_context(geom, 5, 5, 0.1),
+        )
@@ -0,0 +1,76 @@
+import unittest
+
+from catatom2osm.geo import Point
+from catatom2osm.geo.geometry import Geometry
+from catatom2osm.geo.snap import SnapIndex
+
+
+class TestSnapIndex(unittest.TestCase):
+    def setUp(self):
+        self.geometries = {
+            1: Geometry.fromPolygonXY(
+                [[Point(0, 0), Point(50, 0), Point(50, 50), Point(0, 50), Point(0, 0)]]
+            ),
+            2: Geometry.fromPolygonXY(
+                [
+                    [
+                        Point(50, 0),
+                        Point(100, 0),
+                        Point(100, 50),
+                        Point(50.3, 50),
+                        Point(50, 20.1),
+                        Point(50, 0),
+                    ]
+                ]
+            ),
+            3: Geometry.fromPolygonXY(
+                [
+                    [
+                        Point(200, 0),
+                        Point(300, 0),
+                        Point(300, 10),
+                        Point(200, 10),
+                        Point(200, 0),
+                    ]
+                ]
+            ),
+        }
+        self.snap = SnapIndex(self.geometries, 0.1, 0.5)
+
+    def test_init(self):
+        self.assertEqual(self.snap.cell_size, 10)
+        self.assertEqual(len(self.snap.rings[2][0]), 5)
+        self.assertEqual(self.snap.bboxes[3].tolist(), [200, 0, 300, 10])
+        self.assertIn(3, self.snap.grid[(25, 0)])
+        self.assertEqual(SnapIndex(self.geometries, 1, 20).cell_size, 40)
+
+    def test_get_fids(self):
+        self.assertEqual(sorted(self.snap.get_fids((50, 10))), [1, 2])
+        self.assertEqual(self.snap.get_fids((250, 10.05)), [3])
+        self.assertEqual(self.snap.get_fids((250, 10.2)), [])
+        self.assertEqual(self.snap.get_fids((150, 5)), [])
+
+    def test_get_candidates(self):
+        # Shared vertex without close adjacents
+        self.assertEqual(self.snap.get_candidates((50, 0), 0.5, 0.1), [])
+        # Vertex of 2 with a close vertex in 1 out of the search square
+        self.assertEqual(self.snap.get_candidates((50.3, 50), 0.5, 0.1), [])
+        # Vertex of 2 near a segment of 1
+        self.assertEqual(self.snap.get_candidates((50, 20.1), 0.5, 0.1), [1])
+        self.assertEqual(self.snap.get_candidates((250, 10.05), 0.5, 0.1), [3])
+        self.assertEqual(self.snap.get_candidates((250, 10.15), 0.5, 0.1), [])
+        # Vertex of 1 with a close vertex in 2
+        self.assertEqual(self.snap.get_candidates((50, 50), 0.5, 0.1), [2])
+        # Vertex with a close adjacent
+        candidates = self.snap.get_candidates((50, 20.1), 20.2, 0.1)
+        self.assertEqual(sorted(candidates), [1, 2])
+
+    def test_update(self):
+        geom = Geometry.fromPolygonXY(
+            [[Point(200, 0), Point(300, 0), Point(300, 30), Point(200, 0)]]
+        )
+        self.snap.update(3, geom)
+        self.assertEqual(len(self.snap.rings[3][0]), 3)
+        self.assertEqual(self.snap.get_candidates((300, 30.05), 0.5, 0.1), [])
+        self.assertEqual(self.snap.get_candidates((300, 9.95), 0.5, 0.1), [3])
+        self.assertEqual(self.snap.get_candidates((250, 10.05), 0.5, 0.1), [])
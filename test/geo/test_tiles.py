@@ -0,0 +1,132 @@
+import logging
+import unittest
+
+import mock
+from qgis.core import QgsCoordinateReferenceSystem, QgsFeature
+
+from catatom2osm import config
+from catatom2osm.geo import tiles
+from catatom2osm.geo.geometry import Geometry
+from catatom2osm.geo.layer.cons import ConsLayer
+from catatom2osm.geo.point import Point
+
+m_log = mock.MagicMock()
+m_log.app_level = logging.INFO
+
+
+class TestTiles(unittest.TestCase):
+    def setUp(self):
+        self.bboxes = {
+            1: (10, 10, 20, 20),
+            2: (90, 10, 110, 20),
+            3: (120, 10, 130, 20),
+            4: (110.03, 15, 115, 25),
+            5: (300, 300, 310, 310),
+        }
+
+    def test_get_clusters(self):
+        clusters = tiles.get_clusters(self.bboxes, 0.02, 5)
+        self.assertEqual(clusters, [[1], [2, 4], [3], [5]])
+        clusters = tiles.get_clusters(self.bboxes, 5, 5)
+        self.assertEqual(clusters, [[1], [2, 3, 4], [5]])
+        clusters = tiles.get_clusters(self.bboxes, 0.01, 100)
+        self.assertEqual(clusters, [[1], [2], [3], [4], [5]])
+        self.assertEqual(tiles.get_clusters({}, 0.02, 5), [])
+
+    def test_partition(self):
+        tls = tiles.partition(self.bboxes, 100)
+        self.assertEqual(dict(tls), {(0, 0): [1], (1, 0): [2, 3, 4], (3, 3): [5]})
+        tls = tiles.partition({1: (-5, 10, -1, 20)}, 100)
+        self.assertEqual(dict(tls), {(-1, 0): [1]})
+
+    @mock.patch.object(config, "clean_processes", 1)
+    def test_clean_in_tiles_serial(self):
+        layer = mock.MagicMock()
+        self.assertFalse(tiles.clean_in_tiles(layer))
+        layer.getFeatures.assert_not_called()
+
+    def test_clean_tile(self):
+        ring = [Point(0, 0), Point(10, 0), Point(10, 10), Point(0, 10), Point(0, 0)]
+        geom = Geometry.fromPolygonXY([ring])
+        small = Geometry.fromPolygonXY(
+            [[Point(20, 0), Point(20.1, 0), Point(20.1, 0.1), Point(20, 0)]]
+        )
+        other = Geometry.fromPolygonXY([[Point(p.x() + 50, p.y()) for p in ring]])
+        attrs = [None] * 12
+        features = [
+            (7, bytes(geom.asWkb()), ["1"] + attrs[1:]),
+            (9, bytes(small.asWkb()), ["2"] + attrs[1:]),
+            (11, bytes(other.asWkb()), ["3"] + attrs[1:]),
+        ]
+        (remaining, deleted, values) = tiles.clean_tile(
+            ConsLayer, {"baseName": "building"}, "EPSG:25830", features
+        )
+        self.assertEqual([f[0] for f in remaining], [7, 11])
+        self.assertEqual(remaining[0][2][0], "1")
+        self.assertEqual(deleted, [9])
+
+    @mock.patch.object(config, "clean_processes", 2)
+    @mock.patch.object(tiles, "log", m_log)
+    @mock.patch("catatom2osm.geo.layer.base.log", m_log)
+    @mock.patch("catatom2osm.geo.layer.polygon.log", m_log)
+    @mock.patch("catatom2osm.geo.layer.cons.log", m_log)
+    @mock.patch("catatom2osm.geo.layer.base.progressbar", mock.MagicMock())
+    def test_clean_in_tiles(self):
+        rings = {
+            # Across the border of the tiles with size 100
+            "A": [(90, 0), (100, 0), (100, 10), (90, 10)],
+            "B": [(100, 0), (110, 0), (110, 10), (100, 10), (100, 5.01)],
+            "C": [(110, 0), (120, 0), (120, 5), (120, 10.01), (110, 10)],
+            # Near to C but farther than the halo
+            "D": [(120.1, 0), (130, 0), (130, 10), (120.1, 10), (120.1, 7)],
+            "E": [(-150, 0), (-140, 0), (-140, 10), (-145, 10.001), (-150, 10)],
+            "F": [(300, 300), (310, 300), (310, 310), (300, 310)],
+        }
+        layers = []
+        for i in range(2):
+            layer = ConsLayer()
+            layer.setCrs(QgsCoordinateReferenceSystem("EPSG:25830"))
+            to_add = []
+            for (label, ring) in rings.items():
+                feat = QgsFeature(layer.fields())
+                points = [Point(*p) for p in ring + ring[:1]]
+                feat.setGeometry(Geometry.fromPolygonXY([points]))
+                feat["localId"] = label
+                to_add.append(feat)
+            layer.writer.addFeatures(to_add)
+            layers.append(layer)
+        self.assertTrue(tiles.clean_in_tiles(layers[0], 100))
+        with mock.patch.object(config, "clean_processes", 1):
+            layers[1].clean()
+        (tiled, serial) = [
+            {f["localId"]: f.geometry().asWkt() for f in layer.getFeatures()}
+            for layer in layers
+        ]
+        self.assertEqual(tiled, serial)
+        self.assertIn("100 5.01", serial["A"])
+        self.assertNotIn("120 5", serial["C"])
+
+    def test_clean_features_counters(self):
+        cls = mock.MagicMock()
+        layer = cls.return_value
+        layer.writer.addFeatures.return_value = (True, [])
+
+        def clean():
+            tiles.report.values["vertex_close_foo"] = 2
+
+        layer.clean.side_effect = clean
+        with mock.patch.object(tiles, "QgsCoordinateReferenceSystem"):
+            for i in range(2):
+                (__, __, values) = tiles.clean_features(cls, {}, "", [])
+                self.assertEqual(values, {"vertex_close_foo": 2})
+
+    def test_update_layer(self):
+        layer = mock.MagicMock()
+        originals = {1: (b"a", [1, 2]), 2: (b"b", [3, 4]), 3: (b"c", [5, 6])}
+        result = ([(1, b"a", [1, 5]), (2, b"b", [3, 4])], [3], {"foo": 2})
+        with mock.patch.object(tiles, "report") as m_report:
+            tiles.update_layer(layer, originals, result)
+            m_report.merge.assert_called_once_with({"foo": 2})
+        layer.writer.changeAttributeValues.assert_called_once_with({1: {1: 5}})
+        layer.writer.changeGeometryValues.assert_not_called()
+        layer.writer.deleteFeatures.assert_called_once_with([3])
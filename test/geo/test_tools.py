@@ -1,8 +1,27 @@
+import random
 import unittest
 
 from catatom2osm.geo.tools import merge_groups
 
 
+def merge_groups_reference(adjs):
+    """Former quadratic implementation of merge_groups."""
+    groups = []
+    while adjs:
+        group = set(adjs.pop())
+        lastlen = -1
+        while len(group) > lastlen:
+            lastlen = len(group)
+            for adj in adjs[:]:
+                for p in adj:
+                    if p in group:
+                        group |= set(adj)
+                        adjs.remove(adj)
+                        break
+        groups.append(group)
+    return groups
+
+
 class TestTools(unittest.TestCase):
     def test_merge_groups(self):
         groups = [[1, 1, 2, 3], [2, 4], [4, 5, 6], [7, 8, 9], [8, 9]]
@@ -11,3 +30,19 @@ class TestTools(unittest.TestCase):
         g1 = result[0]
         g2 = result[1]
         self.assertTrue(all([g not in g1 for g in g2]))
+
+    def test_merge_groups_reference(self):
+        rnd = random.Random(1)
+        for size in (0, 1, 5, 50, 500):
+            adjs = [
+                set(rnd.randrange(size * 2 + 1) for i in range(rnd.randrange(4)))
+                for j in range(size)
+            ]
+            expected = merge_groups_reference([set(adj) for adj in adjs])
+            self.assertEqual(merge_groups(adjs), expected)
+
+    def test_merge_groups_order(self):
+        adjs = [{1, 2}, set(), {3}, {2, 4}, {5, 6}, {6, 3}]
+        expected = merge_groups_reference(list(adjs))
+        self.assertEqual(merge_groups(adjs), expected)
+        self.assertEqual(expected, [{3, 5, 6}, {1, 2, 4}, set()])
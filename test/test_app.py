@@ -2,12 +2,13 @@ import logging
 import os
 import unittest
 from importlib import reload
+from io import BytesIO
 from optparse import Values
 
 import mock
 from qgis.core import QgsVectorLayer
 
-from catatom2osm import app, config, osm
+from catatom2osm import app, config, osm, osmxml
 from catatom2osm.exceptions import CatIOError
 
 qgs = app.QgsSingleton()
@@ -99,6 +100,30 @@ class TestCatAtom2Osm(unittest.TestCase):
         self.m_app.run = get_func(app.CatAtom2Osm.run)
         self.m_app.run(self.m_app)
         self.m_app.stop_address.assert_called_once_with()
+        self.m_app.cat.prefetch.assert_called_once_with(
+            self.m_app.get_prefetch_layers.return_value
+        )
+
+    def test_get_prefetch_layers(self):
+        self.m_app.cat.zip_code = "33333"
+        self.m_app.get_prefetch_layers = get_func(app.CatAtom2Osm.get_prefetch_layers)
+        self.m_app.is_new = True
+        layers = self.m_app.get_prefetch_layers(self.m_app)
+        self.assertEqual(layers, ["cadastralparcel", "building", "address"])
+        self.m_app.is_new = False
+        self.assertEqual(self.m_app.get_prefetch_layers(self.m_app), [])
+        self.m_app.options.info = True
+        layers = self.m_app.get_prefetch_layers(self.m_app)
+        self.assertEqual(layers, ["cadastralparcel", "building", "address"])
+        self.m_app.options.info = False
+        self.m_app.options.address = False
+        layers = self.m_app.get_prefetch_layers(self.m_app)
+        self.assertEqual(layers, ["cadastralparcel", "building"])
+        self.m_app.options.address = True
+        self.m_app.is_new = True
+        self.m_app.cat.zip_code = "08900"
+        layers = self.m_app.get_prefetch_layers(self.m_app)
+        self.assertEqual(layers, ["cadastralparcel", "building"])
 
     @mock.patch("catatom2osm.app.report", mock.MagicMock())
     def test_run_default_2nd(self):
@@ -134,6 +159,7 @@ class TestCatAtom2Osm(unittest.TestCase):
         self.m_app.building.move_address.assert_not_called()
 
     @mock.patch("catatom2osm.app.report", mock.MagicMock())
+    @mock.patch("catatom2osm.app.glob", mock.MagicMock(return_value=[]))
     @mock.patch("catatom2osm.app.os")
     def test_process_tasks(self, m_os):
         m_os.path.exists.return_value = True
@@ -161,6 +187,96 @@ class TestCatAtom2Osm(unittest.TestCase):
             task.to_osm.assert_called_with(upload="yes", tags={"comment": "X" + label})
         self.assertEqual(self.m_app.merge_address.call_count, 5)
 
+    @mock.patch("catatom2osm.app.report")
+    @mock.patch("catatom2osm.app.glob", mock.MagicMock(return_value=[]))
+    @mock.patch("catatom2osm.app.taskpool")
+    @mock.patch("catatom2osm.app.os")
+    def test_process_tasks_pool(self, m_os, m_tp, m_report):
+        m_os.path.exists.return_value = True
+        m_os.path.basename = os.path.basename
+        m_tp.get_workers.return_value = 2
+        pool = m_tp.TaskPool.return_value
+        pool.close.return_value = [("a", {"nodes": 1}, (1, 0, 0))] * 2
+        self.m_app.tasks_folder = "tasks"
+        self.m_app.get_tasks.return_value = {
+            "123456A": mock.MagicMock(),
+            "123456B": mock.MagicMock(),
+        }
+        self.m_app.parcel.getFeatures.return_value = [
+            {"localId": "123456B", "zone": "001"},
+            {"localId": "123456A", "zone": "00003"},
+        ]
+        self.m_app.get_task_comment = lambda x: "X" + x
+        self.m_app.process_tasks = get_func(app.CatAtom2Osm.process_tasks)
+        self.m_app.process_tasks(self.m_app, mock.MagicMock())
+        m_tp.index_addresses.assert_called_once_with(self.m_app.address_osm)
+        index = m_tp.index_addresses.return_value
+        for label, task in self.m_app.get_tasks.return_value.items():
+            task.to_osm.assert_not_called()
+            self.m_app.submit_task.assert_any_call(
+                pool, task, label, "X" + label, index
+            )
+            m_report.fixme_stats.assert_any_call(task, label)
+        self.m_app.merge_address.assert_not_called()
+        self.m_app.write_osm.assert_not_called()
+        m_report.merge.assert_has_calls([mock.call({"nodes": 1})] * 2)
+
+    @mock.patch("catatom2osm.app.report", mock.MagicMock())
+    @mock.patch("catatom2osm.app.geo", mock.MagicMock())
+    @mock.patch("catatom2osm.app.glob")
+    @mock.patch("catatom2osm.app.taskpool")
+    @mock.patch("catatom2osm.app.os")
+    def test_process_tasks_split(self, m_os, m_tp, m_glob):
+        m_os.path.exists.return_value = False
+        m_os.path.join = os.path.join
+        m_tp.get_workers.return_value = 2
+        m_tp.TaskPool.return_value.close.return_value = []
+        m_glob.return_value = ["33333/tasks/A.osm.gz"]
+        self.m_app.split = "foo"
+        self.m_app.tasks_folder = "tasks"
+        self.m_app.get_tasks.return_value = {
+            "A": mock.MagicMock(),
+            "A-1": mock.MagicMock(),
+            "B": mock.MagicMock(),
+        }
+        parcels = []
+        for label in ["A-1", "A", "B"]:
+            pa = mock.MagicMock()
+            pa.__getitem__.side_effect = {"localId": label, "zone": "001"}.get
+            parcels.append(pa)
+        self.m_app.parcel.getFeatures.return_value = parcels
+        self.m_app.process_tasks = get_func(app.CatAtom2Osm.process_tasks)
+        self.m_app.process_tasks(self.m_app, mock.MagicMock())
+        m_glob.assert_called_once_with("33333/tasks/*.osm.gz")
+        labels = [c.args[2] for c in self.m_app.submit_task.call_args_list]
+        self.assertEqual(labels, ["A-1", "A-2", "B"])
+        parcels[0].__setitem__.assert_not_called()
+        parcels[1].__setitem__.assert_called_once_with("localId", "A-2")
+        parcels[2].__setitem__.assert_not_called()
+
+    @mock.patch("catatom2osm.app.taskpool")
+    def test_submit_task(self, m_tp):
+        task = mock.MagicMock()
+        task.source_date = "1234"
+        task.to_wkb.return_value = [(b"wkb", {"ref": "1"})]
+        self.m_app.tasks_folder = "tasks"
+        self.m_app.address_osm.tags = {"source:date": "5678"}
+        pool = mock.MagicMock()
+        self.m_app.submit_task = get_func(app.CatAtom2Osm.submit_task)
+        self.m_app.submit_task(self.m_app, pool, task, "foo", "bar", "index")
+        m_tp.get_addresses.assert_called_once_with(task.to_wkb.return_value, "index")
+        tags = dict(config.changeset_tags, comment="bar")
+        tags["source:date"] = "1234"
+        pool.submit.assert_called_once_with(
+            "33333/tasks/foo.osm.gz",
+            task.to_wkb.return_value,
+            tags,
+            addresses=m_tp.get_addresses.return_value,
+            address_tags={"source:date": "5678"},
+            address_stats=True,
+            building_stats=True,
+        )
+
     @mock.patch("catatom2osm.app.report", mock.MagicMock())
     @mock.patch("catatom2osm.app.os")
     @mock.patch("catatom2osm.app.type")
@@ -238,52 +354,73 @@ class TestCatAtom2Osm(unittest.TestCase):
     @mock.patch("catatom2osm.app.os")
     @mock.patch("catatom2osm.app.log")
     @mock.patch("catatom2osm.app.open")
-    @mock.patch("catatom2osm.app.osmxml")
+    @mock.patch("catatom2osm.app.gzip")
     @mock.patch("catatom2osm.app.overpass")
-    def test_read_osm(self, m_overpass, m_xml, m_open, m_log, m_os):
-        self.m_app.read_osm = get_func(app.CatAtom2Osm.read_osm)
+    def test_open_osm(self, m_overpass, m_gz, m_open, m_log, m_os):
+        self.m_app.open_osm = get_func(app.CatAtom2Osm.open_osm)
         m_os.path.join = lambda *args: "/".join(args)
         m_os.path.exists.return_value = True
-        m_xml.deserialize.return_value.elements = []
-        self.m_app.read_osm(self.m_app, "bar", "taz")
+        fo = self.m_app.open_osm(self.m_app, "bar", "taz")
         m_overpass.Query.assert_not_called()
         m_open.assert_called_with("33333/bar/taz", "rb")
-        m_xml.deserialize.assert_called_once_with(m_open())
-        output = m_log.warning.call_args_list[0][0][0]
-        self.assertIn("No OSM data", output)
-        m_xml.deserialize.return_value.elements = [1]
-        self.m_app.boundary_search_area = "123456"
+        self.assertEqual(fo, m_open.return_value)
+        fo = self.m_app.open_osm(self.m_app, "taz.gz")
+        m_gz.open.assert_called_with("33333/taz.gz", "rb")
+        self.assertEqual(fo, m_gz.open.return_value)
         m_os.path.exists.return_value = False
-        data = self.m_app.read_osm(self.m_app, "taz", ql="bar")
+        self.assertEqual(self.m_app.open_osm(self.m_app, "taz"), None)
+        self.m_app.boundary_search_area = "123456"
+        self.m_app.open_osm(self.m_app, "taz", ql="bar")
         m_overpass.Query.assert_called_with("123456")
         m_overpass.Query().add.assert_called_once_with("bar")
-        self.assertEqual(data.elements, [1])
         output = m_log.info.call_args_list[0][0][0]
         self.assertIn("Downloading", output)
 
+    @mock.patch("catatom2osm.app.log")
+    @mock.patch("catatom2osm.app.osmpbf")
     @mock.patch("catatom2osm.app.osmxml")
-    @mock.patch("catatom2osm.app.codecs")
-    @mock.patch("catatom2osm.app.io")
-    @mock.patch("catatom2osm.app.gzip")
-    def test_write_osm(self, m_gz, m_io, m_codecs, m_xml):
-        m_xml.serialize.return_value = "taz"
+    def test_read_osm(self, m_xml, m_pbf, m_log):
+        self.m_app.read_osm = get_func(app.CatAtom2Osm.read_osm)
+        fo = self.m_app.open_osm.return_value
+        m_xml.deserialize.return_value.elements = []
+        self.m_app.read_osm(self.m_app, "bar", "taz")
+        self.m_app.open_osm.assert_called_once_with("bar", "taz", ql=False)
+        m_xml.deserialize.assert_called_once_with(fo, query=None, meta=True)
+        fo.close.assert_called_once_with()
+        output = m_log.warning.call_args_list[0][0][0]
+        self.assertIn("No OSM data", output)
+        m_xml.deserialize.return_value.elements = [1]
+        data = self.m_app.read_osm(self.m_app, "taz", ql="bar", meta=False)
+        self.m_app.open_osm.assert_called_with("taz", ql="bar")
+        m_xml.deserialize.assert_called_with(fo, query=None, meta=False)
+        self.assertEqual(data.elements, [1])
+        output = m_log.info.call_args_list[0][0][0]
+        self.assertIn("Read", output)
+        m_pbf.deserialize.assert_not_called()
+        data = self.m_app.read_osm(self.m_app, "taz.osm.pbf")
+        m_pbf.deserialize.assert_called_once_with(fo, meta=True)
+        self.assertEqual(data, m_pbf.deserialize.return_value)
+        self.m_app.open_osm.return_value = None
+        self.assertEqual(self.m_app.read_osm(self.m_app, "taz"), None)
+
+    @mock.patch("catatom2osm.app.log")
+    @mock.patch("catatom2osm.app.report")
+    @mock.patch("catatom2osm.app.taskpool")
+    def test_write_osm(self, m_tp, m_report, m_log):
+        m_report.warnings = []
         data = osm.Osm()
-        data.Node(0, 0, {"ref": "1"})
-        data.Node(1, 1, {"ref": "2"})
-        data.Node(2, 2)
+        data.Node(0, 0)
         self.m_app.write_osm = get_func(app.CatAtom2Osm.write_osm)
-        self.m_app.write_osm(self.m_app, data, "bar")
-        self.assertNotIn(
-            "ref", [k for el in data.elements for k in list(el.tags.keys())]
-        )
-        m_io.open.assert_called_once_with("33333/bar", "w", encoding="utf-8")
-        file_obj = m_io.open.return_value
-        m_xml.serialize.assert_called_once_with(file_obj, data)
-        m_xml.reset_mock()
-        self.m_app.write_osm(self.m_app, data, "bar.gz")
-        m_gz.open.assert_called_once_with("33333/bar.gz", "w")
-        f_gz = m_gz.open.return_value
-        m_codecs.getwriter.return_value.assert_called_once_with(f_gz)
+        self.m_app.write_osm(self.m_app, data, "bar.osm.gz")
+        m_tp.write_osm.assert_called_once_with(data, "33333/bar.osm.gz")
+        m_log.warning.assert_not_called()
+        self.m_app.write_osm(self.m_app, data, "bar.osm.pbf")
+        m_tp.write_osm.assert_called_with(data, "33333/bar.osm.pbf")
+        self.assertEqual(len(m_report.warnings), 1)
+        m_log.warning.assert_called_once_with(m_report.warnings[0])
+        data.upload = "yes"
+        self.m_app.write_osm(self.m_app, data, "bar.osm.pbf")
+        self.assertEqual(len(m_report.warnings), 1)
 
     @mock.patch("catatom2osm.app.cdau")
     def test_get_auxiliary_addresses(self, m_cdau):
@@ -394,13 +531,25 @@ class TestCatAtom2Osm(unittest.TestCase):
         d.Node(0, 0, {"addr:housenumber": "12", "addr:street": "foobar"})
         d.Node(1, 1, {"addr:housenumber": "14", "addr:street": "foobar"})
         d.Node(2, 2, {"addr:housenumber": "10", "addr:place": "bartaz"})
+        fo = BytesIO()
+        osmxml.serialize(fo, d)
         self.m_app.get_current_ad_osm = get_func(app.CatAtom2Osm.get_current_ad_osm)
-        self.m_app.read_osm.return_value = d
+        self.m_app.open_osm.return_value = BytesIO(fo.getvalue())
         address = self.m_app.get_current_ad_osm(self.m_app)
         self.assertEqual(address, set(["foobar14", "foobar12", "bartaz10"]))
         self.assertNotIn("osm_addresses_whithout_number", m_report)
         d.Node(3, 3, {"addr:street": "x"})
         d.Node(4, 4, {"addr:place": "y"})
-        self.m_app.read_osm.return_value = d
+        fo = BytesIO()
+        osmxml.serialize(fo, d)
+        self.m_app.open_osm.return_value = BytesIO(fo.getvalue())
         address = self.m_app.get_current_ad_osm(self.m_app)
         self.assertEqual(m_report.osm_addresses_without_number, 2)
+        m_report.warnings = []
+        fo = BytesIO()
+        osmxml.serialize(fo, osm.Osm())
+        self.m_app.open_osm.return_value = BytesIO(fo.getvalue())
+        address = self.m_app.get_current_ad_osm(self.m_app)
+        self.assertEqual(address, set())
+        self.assertEqual(len(m_report.warnings), 1)
+        m_log.warning.assert_called_with(m_report.warnings[0])
@@ -3,6 +3,7 @@ import os
 import random
 import unittest
 import zipfile
+from tempfile import TemporaryDirectory
 
 import mock
 from requests.exceptions import ConnectionError
@@ -142,21 +143,64 @@ class TestCatAtom(unittest.TestCase):
         ns = m_etree.fromstring().find.call_args_list[0][0][1]
         self.assertEqual(set(ns.keys()), {"gco", "gmd"})
 
+    @mock.patch("catatom2osm.catatom.download")
+    def test_get_feed(self, m_download):
+        catatom.get_feed.cache_clear()
+        m_download.get_response.return_value.text = "foo"
+        self.assertEqual(catatom.get_feed("bar"), "foo")
+        self.assertEqual(catatom.get_feed("bar"), "foo")
+        m_download.get_response.assert_called_once_with("bar")
+        catatom.get_feed("taz")
+        self.assertEqual(m_download.get_response.call_count, 2)
+        catatom.get_feed.cache_clear()
+
+    @mock.patch("catatom2osm.catatom.get_feed")
+    def test_get_atom_url(self, m_feed):
+        self.m_cat.get_atom_url = get_func(catatom.Reader.get_atom_url)
+        self.m_cat.zip_code = "38001"
+        url = config.prov_url["BU"].format(code="38")
+        m_feed.return_value = "xxxxhttpfobar/38001bar  tazzipxxx"
+        zip_url = self.m_cat.get_atom_url(self.m_cat, url)
+        self.assertEqual(zip_url, "httpfobar/38001bar tazzip")
+        m_feed.assert_called_once_with(url)
+        self.m_cat.zip_code = "38002"
+        with self.assertRaises(CatValueError):
+            self.m_cat.get_atom_url(self.m_cat, url)
+
     @mock.patch("catatom2osm.catatom.download")
     def test_get_atom_file(self, m_download):
         self.m_cat.get_atom_file = get_func(catatom.Reader.get_atom_file)
-        self.m_cat.path = "lorem"
-        self.m_cat.zip_code = "38001"
         self.m_cat.get_path = lambda x: "lorem/" + x
-        url = config.prov_url["BU"].format(code="38")
-        m_download.get_response.return_value.text = "xxxxhttpfobar/38001bartazzipxxx"
-        self.m_cat.get_atom_file(self.m_cat, url)
+        self.m_cat.get_atom_url.return_value = "httpfobar/38001bartazzip"
+        self.m_cat.get_atom_file(self.m_cat, "foo")
+        self.m_cat.get_atom_url.assert_called_once_with("foo")
         m_download.wget.assert_called_once_with(
             "httpfobar/38001bartazzip", "lorem/38001bartazzip"
         )
-        self.m_cat.zip_code = "38002"
-        with self.assertRaises(CatValueError):
-            self.m_cat.get_atom_file(self.m_cat, url)
+
+    @mock.patch("catatom2osm.catatom.os")
+    def test_get_downloads(self, m_os):
+        self.m_cat.get_downloads = get_func(catatom.Reader.get_downloads)
+        self.m_cat.get_layer_paths = lambda ln: ("md", ln + ".gml", ln + ".zip", ln)
+        self.m_cat.prov_code = "38"
+        self.m_cat.get_path = lambda x: "lorem/" + x
+        self.m_cat.get_atom_url = lambda url: url + ".zip"
+        m_os.path.exists = lambda path: path == "CP.zip"
+        layers = ["BU", "CP", "AD"]
+        with mock.patch.dict(config.prov_url, {g: g for g in layers}):
+            downloads = self.m_cat.get_downloads(self.m_cat, layers)
+            self.assertEqual(
+                downloads, [("BU.zip", "lorem/BU.zip"), ("AD.zip", "lorem/AD.zip")]
+            )
+            downloads = self.m_cat.get_downloads(self.m_cat, layers + ["BU"], True)
+            self.assertEqual(
+                downloads,
+                [
+                    ("BU.zip", "lorem/BU.zip"),
+                    ("CP.zip", "lorem/CP.zip"),
+                    ("AD.zip", "lorem/AD.zip"),
+                ],
+            )
 
     def test_get_layer_paths(self):
         self.m_cat.get_layer_paths = get_func(catatom.Reader.get_layer_paths)
@@ -212,6 +256,7 @@ class TestCatAtom(unittest.TestCase):
         self.m_cat.crs_ref = "32628"
         self.m_cat.prov_code = "99"
         self.m_cat.src_date = "bar"
+        self.m_cat.read_cache.return_value = None
         m_layer.BaseLayer.return_value.isValid.return_value = False
         gml = self.m_cat.read(self.m_cat, "foobar")
         self.m_cat.get_layer_paths.assert_called_once_with("foobar")
@@ -221,6 +266,8 @@ class TestCatAtom(unittest.TestCase):
         m_crs = m_qgscrs.return_value
         gml.setCrs.assert_called_once_with(m_crs)
         self.assertEqual(gml.source_date, "bar")
+        key = self.m_cat.get_cache_key.return_value
+        self.m_cat.write_cache.assert_called_once_with("foobar", key, gml)
 
         url = config.prov_url[g].format(code="99")
         m_os.path.exists.return_value = False
@@ -252,6 +299,90 @@ class TestCatAtom(unittest.TestCase):
             self.m_cat.read(self.m_cat, "foobar")
         self.assertIn("Failed to load", str(cm.exception))
 
+    @mock.patch("catatom2osm.catatom.os")
+    @mock.patch("catatom2osm.catatom.log")
+    @mock.patch("catatom2osm.catatom.geo")
+    @mock.patch("catatom2osm.catatom.QgsCoordinateReferenceSystem.fromEpsgId")
+    def test_read_cached(self, m_qgscrs, m_layer, m_log, m_os):
+        self.m_cat.read = get_func(catatom.Reader.read)
+        self.m_cat.get_layer_paths.return_value = ("1", "2", "3", "CP")
+        m_os.path.exists.return_value = True
+        m_qgscrs.return_value.isValid.return_value = True
+        self.m_cat.src_date = "bar"
+        gml = self.m_cat.read(self.m_cat, "cadastralparcel")
+        self.assertEqual(gml, self.m_cat.read_cache.return_value)
+        key = self.m_cat.get_cache_key.return_value
+        self.m_cat.get_cache_key.assert_called_once_with("2", "3")
+        self.m_cat.read_cache.assert_called_once_with("cadastralparcel", key)
+        self.m_cat.get_metadata.assert_called_once_with("1", "3")
+        self.m_cat.fix_encoding.assert_not_called()
+        self.m_cat.is_empty.assert_not_called()
+        m_layer.BaseLayer.assert_not_called()
+        self.m_cat.write_cache.assert_not_called()
+        gml.setCrs.assert_called_once_with(m_qgscrs.return_value)
+        self.assertEqual(gml.source_date, "bar")
+
+    def test_get_cache_key(self):
+        self.m_cat.get_cache_key = get_func(catatom.Reader.get_cache_key)
+        self.m_cat.src_date = "2021-01-01"
+        with TemporaryDirectory() as tmp_dir:
+            zip_path = os.path.join(tmp_dir, "foo.zip")
+            gml_path = os.path.join(tmp_dir, "foo.gml")
+            with open(gml_path, "w") as fo:
+                fo.write("12345")
+            key = self.m_cat.get_cache_key(self.m_cat, gml_path, zip_path)
+            self.assertEqual(key["size"], 5)
+            self.assertEqual(key["mtime"], os.stat(gml_path).st_mtime_ns)
+            self.assertEqual(key["date"], "2021-01-01")
+            with open(zip_path, "w") as fo:
+                fo.write("123")
+            key = self.m_cat.get_cache_key(self.m_cat, gml_path, zip_path)
+            self.assertEqual(key["size"], 3)
+
+    @mock.patch("catatom2osm.catatom.log")
+    @mock.patch("catatom2osm.catatom.geo")
+    def test_read_cache(self, m_geo, m_log):
+        self.m_cat.read_cache = get_func(catatom.Reader.read_cache)
+        with TemporaryDirectory() as tmp_dir:
+            cache_path = os.path.join(tmp_dir, "foo.gpkg")
+            key_path = os.path.join(tmp_dir, "foo.json")
+            self.m_cat.get_cache_paths.return_value = (cache_path, key_path)
+            key = {"size": 1, "mtime": 2, "date": "bar"}
+            self.assertIsNone(self.m_cat.read_cache(self.m_cat, "foo", key))
+            open(cache_path, "w").close()
+            with open(key_path, "w") as fo:
+                fo.write('{"size": 1, "mtime": 3, "date": "bar"}')
+            self.assertIsNone(self.m_cat.read_cache(self.m_cat, "foo", key))
+            with open(key_path, "w") as fo:
+                fo.write('{"size": 1, "mtime": 2, "date": "bar"}')
+            gml = self.m_cat.read_cache(self.m_cat, "foo", key)
+            self.assertEqual(gml, m_geo.BaseLayer.return_value)
+            m_geo.BaseLayer.assert_called_once_with(cache_path, "foo.gml", "ogr")
+            m_geo.BaseLayer.return_value.isValid.return_value = False
+            self.assertIsNone(self.m_cat.read_cache(self.m_cat, "foo", key))
+            with mock.patch.object(config, "gml_cache", False):
+                m_geo.BaseLayer.return_value.isValid.return_value = True
+                self.assertIsNone(self.m_cat.read_cache(self.m_cat, "foo", key))
+
+    @mock.patch("catatom2osm.catatom.log")
+    def test_write_cache(self, m_log):
+        self.m_cat.write_cache = get_func(catatom.Reader.write_cache)
+        gml = mock.MagicMock()
+        with TemporaryDirectory() as tmp_dir:
+            cache_path = os.path.join(tmp_dir, "cache", "foo.gpkg")
+            key_path = os.path.join(tmp_dir, "cache", "foo.json")
+            self.m_cat.get_cache_paths.return_value = (cache_path, key_path)
+            key = {"size": 1, "mtime": 2, "date": "bar"}
+            gml.export.return_value = True
+            self.m_cat.write_cache(self.m_cat, "foo", key, gml)
+            gml.export.assert_called_once_with(cache_path, "GPKG")
+            with open(key_path) as fo:
+                self.assertEqual(fo.read(), '{"size": 1, "mtime": 2, "date": "bar"}')
+            gml.export.return_value = False
+            self.m_cat.write_cache(self.m_cat, "foo", key, gml)
+            self.assertFalse(os.path.exists(key_path))
+            m_log.warning.assert_called_once()
+
     def test_is_empty(self):
         with zipfile.ZipFile("test/fixtures/empty.zip", "r") as zf:
             fo = zf.open("empty.gml", "r")
@@ -294,6 +425,66 @@ class TestCatAtom(unittest.TestCase):
             n = self.m_cat.get_path_from_zip(self.m_cat, zf, "taz")
         self.assertIn("There is no item", str(cm.exception))
 
+    def test_is_fixed(self):
+        with TemporaryDirectory() as tmp_dir:
+            reader = catatom.Reader(os.path.join(tmp_dir, "38001"))
+            gml_path = reader.get_path("foo.gml")
+            zip_path = reader.get_path("foo.zip")
+            with open(zip_path, "w") as fo:
+                fo.write("123")
+            self.assertFalse(reader.is_fixed(gml_path, zip_path, "fix_amp"))
+            reader.set_fixed(gml_path, zip_path, "fix_amp")
+            self.assertTrue(os.path.exists(gml_path + ".fix_amp"))
+            self.assertTrue(reader.is_fixed(gml_path, zip_path, "fix_amp"))
+            self.assertFalse(reader.is_fixed(gml_path, zip_path, "fix_encoding"))
+            with open(gml_path, "w") as fo:
+                fo.write("1234")
+            self.assertFalse(reader.is_fixed(gml_path, zip_path, "fix_amp"))
+
+    @mock.patch.object(config, "gml_chunk_size", 4)
+    def test_fix_encoding(self):
+        with TemporaryDirectory() as tmp_dir:
+            reader = catatom.Reader(os.path.join(tmp_dir, "38001"))
+            gml_path = reader.get_path("foo.gml")
+            with open(gml_path, "wb") as fo:
+                fo.write("<a>Ca\xf1ada</a>".encode("ISO-8859-1"))
+            reader.fix_encoding(gml_path, "")
+            with open(gml_path, "rb") as fo:
+                self.assertEqual(fo.read().decode("utf-8"), "<a>Ca\xf1ada</a>")
+            self.assertTrue(reader.is_fixed(gml_path, "", "fix_encoding"))
+            self.assertFalse(os.path.exists(gml_path + ".part"))
+            with mock.patch.object(reader, "get_file_object") as m_gfo:
+                reader.fix_encoding(gml_path, "")
+                m_gfo.assert_not_called()
+
+    @mock.patch.object(config, "gml_chunk_size", 4)
+    def test_fix_amp(self):
+        with TemporaryDirectory() as tmp_dir:
+            reader = catatom.Reader(os.path.join(tmp_dir, "38001"))
+            gml_path = reader.get_path("foo.gml")
+            with open(gml_path, "wb") as fo:
+                fo.write(b"<a>x&</a><b>abc&FOO</b><c>&amp;</c>&&")
+            reader.fix_amp(gml_path, "")
+            with open(gml_path, "rb") as fo:
+                self.assertEqual(
+                    fo.read(), b"<a>x&amp;</a><b>abc&amp;FOO</b><c>&amp;</c>&&"
+                )
+            self.assertTrue(reader.is_fixed(gml_path, "", "fix_amp"))
+            with mock.patch.object(reader, "get_file_object") as m_gfo:
+                reader.fix_amp(gml_path, "")
+                m_gfo.assert_not_called()
+
+    def test_fix_amp_unchanged(self):
+        with TemporaryDirectory() as tmp_dir:
+            reader = catatom.Reader(os.path.join(tmp_dir, "38001"))
+            gml_path = reader.get_path("foo.gml")
+            with open(gml_path, "wb") as fo:
+                fo.write(b"<a>x&amp;</a>")
+            mtime = os.stat(gml_path).st_mtime_ns
+            reader.fix_amp(gml_path, "")
+            self.assertEqual(os.stat(gml_path).st_mtime_ns, mtime)
+            self.assertTrue(reader.is_fixed(gml_path, "", "fix_amp"))
+
     @mock.patch("catatom2osm.catatom.zipfile")
     @mock.patch("catatom2osm.catatom.geo")
     def test_get_gml_from_zip(self, m_layer, m_zip):
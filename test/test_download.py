@@ -1,56 +1,274 @@
+import os
+import re
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import TemporaryDirectory
 
 import mock
+import requests
 
-from catatom2osm import config
-from catatom2osm.download import chunk_size, get_response, wget
+from catatom2osm import config, download
+from catatom2osm.download import get_response, wget
 
 config.install_gettext("catato2osm", "")
 
 
+@mock.patch("catatom2osm.download.time", mock.MagicMock())
+@mock.patch("catatom2osm.download.get_session")
 class TestGetResponse(unittest.TestCase):
-    @mock.patch("catatom2osm.download.requests")
-    def test_get_response_ok(self, mock_requests):
+    def test_get_response_ok(self, m_session):
         mock_response = mock.MagicMock()
         mock_response.status_code = 200
-        mock_requests.codes.ok = 200
-        mock_requests.get.return_value = mock_response
+        m_session.return_value.get.return_value = mock_response
         r = get_response("foo", "bar")
         self.assertEqual(r, mock_response)
-        mock_requests.get.assert_called_once_with("foo", stream="bar", timeout=30)
+        m_session.return_value.get.assert_called_once_with(
+            "foo", stream="bar", timeout=30, headers=None
+        )
 
-    @mock.patch("catatom2osm.download.requests")
-    def test_get_response_bad(self, mock_requests):
+    def test_get_response_bad(self, m_session):
+        mock_response = mock.MagicMock()
+        mock_response.status_code = 503
+        mock_response.raise_for_status.side_effect = requests.HTTPError
+        m_session.return_value.get.return_value = mock_response
+        with self.assertRaises(requests.HTTPError):
+            get_response("foo", "bar")
+        self.assertEqual(m_session.return_value.get.call_count, 3)
+        mock_response.raise_for_status.assert_called_once_with()
+        self.assertEqual(mock_response.close.call_count, 3)
+        self.assertEqual(
+            download.time.sleep.call_args_list, [mock.call(1), mock.call(2)]
+        )
+
+    def test_get_response_not_found(self, m_session):
         mock_response = mock.MagicMock()
         mock_response.status_code = 404
-        mock_requests.codes.ok = 200
-        mock_requests.get.return_value = mock_response
-        get_response("foo", "bar")
-        self.assertEqual(mock_requests.get.call_count, 3)
+        mock_response.raise_for_status.side_effect = requests.HTTPError
+        m_session.return_value.get.return_value = mock_response
+        with self.assertRaises(requests.HTTPError):
+            get_response("foo")
+        self.assertEqual(m_session.return_value.get.call_count, 1)
         mock_response.raise_for_status.assert_called_once_with()
+        mock_response.close.assert_called_once_with()
+
+    def test_get_response_unexpected(self, m_session):
+        mock_response = mock.MagicMock()
+        mock_response.status_code = 204
+        m_session.return_value.get.return_value = mock_response
+        with self.assertRaises(requests.HTTPError) as cm:
+            get_response("foo")
+        self.assertIs(cm.exception.response, mock_response)
+        self.assertIn("204", str(cm.exception))
+        self.assertEqual(m_session.return_value.get.call_count, 1)
+        mock_response.close.assert_called_once_with()
+
+    def test_get_response_connection_error(self, m_session):
+        mock_response = mock.MagicMock()
+        mock_response.status_code = 200
+        m_session.return_value.get.side_effect = [
+            requests.ConnectionError,
+            mock_response,
+        ]
+        self.assertEqual(get_response("foo"), mock_response)
+        m_session.return_value.get.side_effect = requests.ConnectionError
+        with self.assertRaises(requests.ConnectionError):
+            get_response("foo")
+
+
+class TestSession(unittest.TestCase):
+    def test_get_session(self):
+        with mock.patch.object(download, "_session", None):
+            session = download.get_session()
+            self.assertIsInstance(session, requests.Session)
+            self.assertIs(download.get_session(), session)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Local stand-in of a download server.
+
+    Counts the concurrent requests, supports Range and If-Range requests and
+    closes the connection after sending server.cut bytes once.
+    """
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.active += 1
+            self.server.peak = max(self.server.peak, self.server.active)
+            self.server.requests.append(dict(self.headers))
+        time.sleep(0.05)
+        body = self.server.files.get(self.path, self.path.encode())
+        offset = 0
+        s = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range", self.server.etag)
+        if s and if_range == self.server.etag:
+            offset = int(s.group(1))
+        if offset >= len(body) > 0:
+            self.send_response(416)
+            self.end_headers()
+        else:
+            self.send_response(206 if offset else 200)
+            self.send_header("Content-Length", str(len(body) - offset))
+            if offset:
+                self.send_header(
+                    "Content-Range",
+                    "bytes %d-%d/%d" % (offset, len(body) - 1, len(body)),
+                )
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", self.server.etag)
+            self.end_headers()
+            if self.server.cut:
+                self.wfile.write(body[offset : offset + self.server.cut])
+                self.server.cut = 0
+            else:
+                self.wfile.write(body[offset:])
+        with self.server.lock:
+            self.server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+class ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(config, "show_progress_bars", False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.lock = threading.Lock()
+        self.server.active = 0
+        self.server.peak = 0
+        self.server.requests = []
+        self.server.files = {}
+        self.server.etag = '"1"'
+        self.server.cut = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = "http://127.0.0.1:%d/" % self.server.server_port
+        self.tmp_dir = TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, "foo.zip")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.tmp_dir.cleanup()
+
+
+@mock.patch("catatom2osm.download.time.sleep", mock.MagicMock())
+class TestWget(ServerTestCase):
+    def setUp(self):
+        super(TestWget, self).setUp()
+        self.data = bytes(range(256)) * 100
+        self.server.files["/foo.zip"] = self.data
+
+    def read(self):
+        with open(self.filename, "rb") as fo:
+            return fo.read()
+
+    def test_wget(self):
+        wget(self.url + "foo.zip", self.filename)
+        self.assertEqual(self.read(), self.data)
+        self.assertFalse(os.path.exists(self.filename + ".part"))
+        self.assertFalse(os.path.exists(self.filename + ".part.json"))
+        self.assertNotIn("Range", self.server.requests[0])
+
+    @mock.patch.object(download, "chunk_size", 100)
+    def test_wget_resume(self):
+        self.server.cut = 1000
+        wget(self.url + "foo.zip", self.filename)
+        self.assertEqual(self.read(), self.data)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[1]["Range"], "bytes=1000-")
+        self.assertEqual(self.server.requests[1]["If-Range"], '"1"')
+
+    def test_wget_resume_next_run(self):
+        with open(self.filename + ".part", "wb") as fo:
+            fo.write(self.data[:500])
+        download.write_part(self.filename + ".part", self.url + "foo.zip", '"1"')
+        wget(self.url + "foo.zip", self.filename)
+        self.assertEqual(self.read(), self.data)
+        self.assertEqual(self.server.requests[0]["Range"], "bytes=500-")
+
+    def test_wget_changed(self):
+        with open(self.filename + ".part", "wb") as fo:
+            fo.write(b"x" * 500)
+        download.write_part(self.filename + ".part", self.url + "foo.zip", '"0"')
+        wget(self.url + "foo.zip", self.filename)
+        self.assertEqual(self.read(), self.data)
+
+    def test_wget_complete_part(self):
+        with open(self.filename + ".part", "wb") as fo:
+            fo.write(self.data)
+        download.write_part(self.filename + ".part", self.url + "foo.zip", '"1"')
+        wget(self.url + "foo.zip", self.filename)
+        self.assertEqual(self.read(), self.data)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_wget_not_resumable(self):
+        with open(self.filename + ".part", "wb") as fo:
+            fo.write(b"x" * 500)
+        wget(self.url + "foo.zip", self.filename)
+        self.assertEqual(self.read(), self.data)
+        self.assertNotIn("Range", self.server.requests[0])
+
+    @mock.patch.object(download, "chunk_size", 100)
+    def test_wget_incomplete(self):
+        self.server.cut = 1000
+        with mock.patch.object(download, "number_of_retries", 1):
+            with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+                wget(self.url + "foo.zip", self.filename)
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertEqual(os.path.getsize(self.filename + ".part"), 1000)
+        self.assertIsNotNone(
+            download.read_part(self.filename + ".part", self.url + "foo.zip")
+        )
+
+
+class TestWgetAll(ServerTestCase):
+    @mock.patch.object(download, "host_connections", 2)
+    def test_wget_all(self):
+        with TemporaryDirectory() as tmp_dir:
+            downloads = [
+                (self.url + "f%d" % i, os.path.join(tmp_dir, "f%d" % i))
+                for i in range(6)
+            ]
+            download.wget_all(downloads)
+            for (url, filename) in downloads:
+                with open(filename) as fo:
+                    self.assertEqual(fo.read(), "/" + os.path.basename(filename))
+        self.assertEqual(self.server.peak, 2)
+
+    @mock.patch.object(download, "max_workers", 3)
+    def test_wget_all_positions(self):
+        running = set()
+        overlaps = []
+        lock = threading.Lock()
+
+        def wget(url, filename, position=None):
+            with lock:
+                overlaps.append(position in running)
+                running.add(position)
+            time.sleep(0.01)
+            with lock:
+                running.discard(position)
 
+        downloads = [(self.url + "f%d" % i, "f%d" % i) for i in range(9)]
+        with mock.patch.object(download, "wget", side_effect=wget) as m_wget:
+            download.wget_all(downloads)
+        positions = {c[1]["position"] for c in m_wget.call_args_list}
+        self.assertEqual(m_wget.call_count, 9)
+        self.assertTrue(positions <= {0, 1, 2})
+        self.assertFalse(any(overlaps))
 
-class TestWget(unittest.TestCase):
-    @mock.patch("catatom2osm.download.progressbar", mock.MagicMock())
-    @mock.patch("catatom2osm.download.get_response")
-    @mock.patch("catatom2osm.download.open")
-    def test_wget(self, mock_open, mock_gr):
-        mock_gr.return_value = mock.MagicMock()
-        mock_gr.return_value.iter_content = range
-        mock_gr.return_value.headers = {"Content-Length": "99999"}
-        file_mock = mock.MagicMock()
-        mock_open.return_value.__enter__.return_value = file_mock
-        wget("foo", "bar")
-        self.assertEqual(file_mock.write.call_count, chunk_size)
-
-    @mock.patch("catatom2osm.download.progressbar", mock.MagicMock())
-    @mock.patch("catatom2osm.download.get_response")
-    @mock.patch("catatom2osm.download.open")
-    def test_wget0(self, mock_open, mock_gr):
-        mock_gr.return_value = mock.MagicMock()
-        mock_gr.return_value.iter_content = range
-        mock_gr.return_value.headers = {}
-        file_mock = mock.MagicMock()
-        mock_open.return_value.__enter__.return_value = file_mock
-        wget("foo", "bar")
-        self.assertEqual(file_mock.write.call_count, chunk_size)
+    def test_wget_all_error(self):
+        with TemporaryDirectory() as tmp_dir:
+            downloads = [
+                (self.url + "foo", os.path.join(tmp_dir, "foo")),
+                (self.url + "bar", os.path.join(tmp_dir, "missing", "bar")),
+            ]
+            with self.assertRaises(FileNotFoundError):
+                download.wget_all(downloads)
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, "foo")))
@@ -80,21 +80,47 @@ class TestMain(unittest.TestCase):
         self.options.address = False
         self.compareOptions(options)
 
+    @mock.patch(
+        "catatom2osm.__main__.sys.argv",
+        ["catatom2osm.py", "33333", "--profile", "sample"],
+    )
+    @mock.patch("catatom2osm.__main__.QgsSingleton", mock.MagicMock)
+    @mock.patch("catatom2osm.__main__.CatAtom2Osm.create_and_run")
+    def test_profile(self, mockcat):
+        __main__.run()
+        options = mockcat.call_args_list[0][0][1]
+        self.assertEqual(options.profile, "sample")
+        with mock.patch("catatom2osm.__main__.sys.argv", ["x", "33333", "--profile"]):
+            __main__.run()
+        options = mockcat.call_args_list[1][0][1]
+        self.assertEqual(options.profile, "cprofile")
+
+    @mock.patch(
+        "catatom2osm.__main__.sys.argv", ["catatom2osm.py", "33333", "--offline"]
+    )
+    @mock.patch("catatom2osm.__main__.QgsSingleton", mock.MagicMock)
+    @mock.patch("catatom2osm.__main__.CatAtom2Osm.create_and_run")
+    @mock.patch.object(config, "overpass_offline", False)
+    def test_offline(self, mockcat):
+        __main__.run()
+        options = mockcat.call_args_list[0][0][1]
+        self.assertTrue(options.offline)
+        self.assertTrue(config.overpass_offline)
+
     @mock.patch("catatom2osm.__main__.sys.argv", ["catatom2osm.py", "-w", "33333"])
+    @mock.patch("catatom2osm.__main__.download")
     @mock.patch("catatom2osm.__main__.Reader")
-    def test_download(self, mockcat):
+    def test_download(self, mockcat, m_download):
         cat = mock.MagicMock()
+        cat.get_downloads.return_value = [("foo", "bar")]
         mockcat.return_value = cat
         __main__.run()
         self.options.args = "-w 33333"
         mockcat.assert_called_once_with("33333")
-        cat.download.assert_has_calls(
-            [
-                mock.call("address"),
-                mock.call("cadastralzoning"),
-                mock.call("building"),
-            ]
+        cat.get_downloads.assert_called_once_with(
+            ["address", "cadastralzoning", "building"], force=True
         )
+        m_download.wget_all.assert_called_once_with([("foo", "bar")])
 
     @mock.patch("catatom2osm.__main__.sys.argv", ["catatom2osm.py", "-l", "01"])
     @mock.patch("catatom2osm.__main__.log.error")
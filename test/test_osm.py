@@ -1,6 +1,7 @@
 import random
 import unittest
 from collections import Counter
+from io import BytesIO
 
 from catatom2osm import osm, osmxml
 
@@ -13,7 +14,7 @@ class OsmTestCase(unittest.TestCase):
 class TestOsm(OsmTestCase):
     def test_init(self):
         self.assertEqual(self.d.counter, 0)
-        self.assertEqual(self.d.elements, set())
+        self.assertEqual(self.d.elements, {})
 
     def test_getattr(self):
         n = self.d.Node(1, 1)
@@ -27,8 +28,16 @@ class TestOsm(OsmTestCase):
         w = self.d.Way([(1, 2), (2, 3), (3, 2), (1, 2)])
         r = self.d.Relation([n1, w])
         self.assertEqual(len(self.d.nodes), 6)
-        self.assertEqual(self.d.ways, [w])
-        self.assertEqual(self.d.relations, [r])
+        self.assertEqual(list(self.d.ways), [w])
+        self.assertEqual(list(self.d.relations), [r])
+        self.assertIn(n1, self.d.nodes)
+        self.d.remove(r)
+        self.assertEqual(len(self.d.relations), 0)
+        self.assertEqual(len(self.d.ways), 0)
+        self.assertEqual(list(self.d.nodes), [self.d.get(-2)])
+        n3 = osm.Osm().Node(2, 2)
+        self.d.replace(self.d.get(-2), n3)
+        self.assertEqual(list(self.d.nodes), [n3])
 
     def test_remove(self):
         n0 = self.d.Node(0, 0)
@@ -62,6 +71,48 @@ class TestOsm(OsmTestCase):
         self.assertEqual(len(self.d.parents[n1]), 0)
         self.assertEqual(len(self.d.elements), 0)
 
+    def test_remove_many(self):
+        n0 = self.d.Node(0, 0)
+        n1 = self.d.Node(1, 0)
+        n2 = self.d.Node(1, 1)
+        n3 = self.d.Node(0, 1)
+        n4 = self.d.Node(2, 0)
+        n5 = self.d.Node(2, 1)
+        w1 = self.d.Way((n0, n1, n2, n3, n0))
+        w2 = self.d.Way((n1, n4, n5, n2))
+        w3 = self.d.Way((n4, n5))
+        r1 = self.d.Relation((w1, w2))
+        r2 = self.d.Relation((w3,))
+        self.d.remove_many([w2, n4, w2])
+        self.assertEqual(list(self.d.elements), [n0, n1, n2, n3, n5, w1, w3, r1, r2])
+        self.assertEqual(w3.nodes, [n5])
+        self.assertEqual([m.element for m in r1.members], [w1])
+        self.assertNotIn(w2, self.d.parents)
+        self.assertEqual(self.d.parents[n1], {w1})
+        self.assertEqual(self.d.parents[n5], {w3})
+        self.d.remove_many([r1, r2])
+        self.assertEqual(len(self.d.elements), 0)
+        self.assertEqual(len(self.d.index), 0)
+        self.assertEqual(len(self.d.ways), 0)
+
+    def test_elements_order(self):
+        nodes = [self.d.Node(i, i) for i in range(100)]
+        w = self.d.Way(nodes[10:20])
+        r = self.d.Relation([w])
+        self.assertEqual(list(self.d.elements), nodes + [w, r])
+        self.d.remove(nodes[50])
+        self.assertEqual(list(self.d.elements), nodes[:50] + nodes[51:] + [w, r])
+        n = self.d.Node(0, 0)
+        self.assertEqual(list(self.d.elements)[-1], n)
+
+    def test_sort_key(self):
+        n1 = self.d.Node(1, 1)
+        n2 = self.d.Node(2, 2)
+        n3 = self.d.Node(3, 3, attrs={"id": "7"})
+        n4 = self.d.Node(4, 4, attrs={"id": "5"})
+        result = sorted(self.d.nodes, key=self.d.sort_key)
+        self.assertEqual(result, [n4, n3, n1, n2])
+
     def test_replace(self):
         n1 = self.d.Node(1, 1)
         d2 = osm.Osm()
@@ -245,6 +296,21 @@ class TestOsmElement(OsmTestCase):
         self.assertEqual(e.action, "Delete")
         self.assertFalse(hasattr(e, "foo"))
 
+    def test_slots(self):
+        e = osm.Element(self.d)
+        self.assertFalse(hasattr(e, "__dict__"))
+        self.assertIsNone(e._tags)
+        self.assertIsNone(e._meta)
+        e.version = "2"
+        self.assertEqual(e._meta, {"version": "2"})
+        e.version = None
+        self.assertIsNone(e._meta)
+        self.assertEqual(e.tags, {})
+        self.assertEqual(e._tags, {})
+        self.assertFalse(hasattr(self.d.Node(1, 1), "__dict__"))
+        for cls in (osm.Way, osm.Relation, osm.Polygon, osm.MultiPolygon):
+            self.assertFalse(hasattr(cls(self.d), "__dict__"))
+
 
 class TestOsmNode(OsmTestCase):
     def test_init(self):
@@ -377,6 +443,15 @@ class TestOsmWay(OsmTestCase):
         self.assertNotIn(n, w.nodes)
         self.assertNotIn(w, self.d.parents[n])
 
+    def test_remove_childs(self):
+        n1 = self.d.Node(1, 1)
+        n2 = self.d.Node(2, 2)
+        w = self.d.Way((n1, (3, 3), n2, (4, 4), n1))
+        w.remove_childs({n1, n2})
+        self.assertEqual(w.geometry(), ((3, 3), (4, 4)))
+        self.assertNotIn(w, self.d.parents[n1])
+        self.assertNotIn(w, self.d.parents[n2])
+
     def test_replace(self):
         n1 = self.d.Node(1, 1)
         n2 = self.d.Node(1, 2)
@@ -442,6 +517,24 @@ class TestOsmWay(OsmTestCase):
         self.assertEqual(w2.geometry(), g)
         self.assertEqual(w3.geometry(), g[:4])
         self.assertEqual(w4.geometry(), w1.geometry())
+        self.assertIs(w1.geometry(), w1.geometry())
+
+    def test_geometry_cache(self):
+        n = self.d.Node(2, 2)
+        w = self.d.Way([(0, 0), (1, 1), n])
+        r = self.d.Relation([w])
+        self.assertEqual(r.geometry(), (((0, 0), (1, 1), (2, 2)),))
+        w.append((3, 3))
+        self.assertEqual(w.geometry(), ((0, 0), (1, 1), (2, 2), (3, 3)))
+        self.assertEqual(r.geometry(), (w.geometry(),))
+        w.remove(n)
+        self.assertEqual(w.geometry(), ((0, 0), (1, 1), (3, 3)))
+        self.assertEqual(r.geometry(), (w.geometry(),))
+        w.replace(w.nodes[1], self.d.Node(4, 4))
+        self.assertEqual(w.geometry(), ((0, 0), (4, 4), (3, 3)))
+        self.assertEqual(r.geometry(), (w.geometry(),))
+        w.nodes = w.nodes[:2]
+        self.assertEqual(r.geometry(), (((0, 0), (4, 4)),))
 
     def test_clean_duplicated_nodes(self):
         w = self.d.Way([(0, 0), (1, 1), (1, 1), (2, 2)])
@@ -539,6 +632,13 @@ class TestOsmRelation(OsmTestCase):
         n = self.d.Node(4, 4)
         r = self.d.Relation([w1, w2, n])
         self.assertEqual(r.geometry(), (g1, g2, (4, 4)))
+        self.assertIs(r.geometry(), r.geometry())
+        r.remove(n)
+        self.assertEqual(r.geometry(), (g1, g2))
+        r.append(n)
+        self.assertEqual(r.geometry(), (g1, g2, (4, 4)))
+        r.replace(n, w1)
+        self.assertEqual(r.geometry(), (g1, g2, g1))
 
     def test_childs(self):
         n = self.d.Node(3, 3)
@@ -566,6 +666,15 @@ class TestOsmRelation(OsmTestCase):
         self.assertNotIn(n, r.childs)
         self.assertNotIn(r, self.d.parents[n])
 
+    def test_remove_childs(self):
+        n = self.d.Node(1, 1)
+        w = self.d.Way(((1, 1), (2, 2)))
+        r = self.d.Relation([n, w, self.d.Node(3, 3), n])
+        r.remove_childs({n, w})
+        self.assertEqual(r.geometry(), ((3, 3),))
+        self.assertNotIn(r, self.d.parents[n])
+        self.assertNotIn(r, self.d.parents[w])
+
     def test_replace(self):
         n1 = self.d.Node(1, 1)
         n2 = self.d.Node(1, 2)
@@ -685,3 +794,136 @@ class TestOsmMultiPolygon(OsmTestCase):
         self.assertEqual(p.members[2].role, "outer")
         self.assertEqual(p.members[3].element, w4)
         self.assertEqual(p.members[3].role, "inner")
+
+
+class TestOsmStoredNode(unittest.TestCase):
+    def setUp(self):
+        self.d = osm.Osm(compact=True)
+
+    def test_init(self):
+        n1 = self.d.Node(1, 2, {"foo": "bar"})
+        n2 = self.d.Node((3, 4), attrs={"id": "5", "version": "2"})
+        self.assertIsInstance(n1, osm.StoredNode)
+        self.assertEqual(len(self.d.node_store), 2)
+        self.assertEqual((n1.x, n1.y), (1, 2))
+        self.assertEqual(n1.tags, {"foo": "bar"})
+        self.assertEqual(n1.id, -1)
+        self.assertEqual(n1.fid, "n-1")
+        self.assertEqual(n1.type, "node")
+        self.assertEqual(n2.id, 5)
+        self.assertEqual(n2.version, "2")
+        self.assertIs(self.d.get(5), n2)
+        self.assertIs(self.d.get(-1), n1)
+        self.assertNotIn(1, self.d.node_store.tags)
+        self.assertFalse(hasattr(n1, "__dict__") and n1.__dict__)
+
+    def test_transient(self):
+        w = self.d.Way([(0, 0), (1, 0), (1, 1)])
+        self.assertEqual(len(self.d.node_store.proxies), 0)
+        self.assertEqual(len(self.d.index), 4)
+        self.assertEqual(len(self.d.elements), 4)
+        n = w.nodes[1]
+        self.assertIs(n, w.nodes[1])
+        self.assertEqual(len(self.d.node_store.proxies), 1)
+        self.assertIs(self.d.get(n.id), n)
+        self.assertIn(n, self.d.elements)
+        self.assertIn(w, self.d.parents[n])
+        del n
+        self.assertEqual(len(self.d.node_store.proxies), 0)
+        self.assertEqual([n.geometry() for n in self.d.nodes], list(w.geometry()))
+
+    def test_tags(self):
+        n = self.d.Node(1, 2)
+        self.assertEqual(n.tags, {})
+        self.assertEqual(self.d.node_store.tags, {})
+        n.tags["a"] = "b"
+        n.tags.update({"c": "d"})
+        self.assertEqual(self.d.node_store.tags[0], {"a": "b", "c": "d"})
+        del n.tags["a"]
+        n.tags.pop("c")
+        self.assertEqual(self.d.node_store.tags, {})
+        n.tags = {"e": "f"}
+        self.assertEqual(dict(n.tags), {"e": "f"})
+        n.tags = {}
+        self.assertEqual(self.d.node_store.tags, {})
+
+    def test_attrs(self):
+        n = self.d.Node(1, 2)
+        self.assertEqual(self.d.node_store.meta, {})
+        attrs = dict(id="-1", action="modify", visible="true", lon="1.0", lat="2.0")
+        self.assertEqual(n.attrs, attrs)
+        n.attrs = dict(id="3", user="foo", lon="4", lat="5")
+        self.assertEqual((n.id, n.user, n.x, n.y), (3, "foo", 4, 5))
+        self.assertIs(self.d.get(3), n)
+        self.assertNotIn("n-1", self.d.index)
+        self.assertEqual(self.d.node_store.meta[0], {"user": "foo"})
+        n.user = None
+        self.assertEqual(self.d.node_store.meta, {})
+
+    def test_eq(self):
+        n1 = self.d.Node(1, 2)
+        n2 = self.d.Node(1, 2)
+        self.assertEqual(n1, (1, 2))
+        self.assertEqual(n1, n2)
+        n1.tags["a"] = "1"
+        n2.tags["a"] = "2"
+        self.assertNotEqual(n1, n2)
+        n3 = osm.Osm().Node(1, 2, {"a": "1"})
+        self.assertEqual(n3, n1)
+        self.assertEqual(n1, n3)
+
+    def test_way(self):
+        n = self.d.Node(1, 1)
+        w = self.d.Way([n, (2, 2), (3, 3), n])
+        self.assertTrue(all(isinstance(n, osm.StoredNode) for n in w.nodes))
+        self.assertEqual(list(w._nodes), [0, 1, 2, 0])
+        self.assertEqual(len(self.d.node_store), 3)
+        self.assertTrue(w.is_closed())
+        self.assertEqual(w.geometry(), ((1, 1), (2, 2), (3, 3), (1, 1)))
+        self.assertIn(w, self.d.parents[w.nodes[1]])
+        w.remove(w.nodes[1])
+        self.assertEqual(len(w.nodes), 3)
+
+    def test_remove(self):
+        w = self.d.Way([(0, 0), (1, 0), (1, 1), (0, 0)])
+        self.d.Way([w.nodes[1], (2, 2)])
+        self.d.remove(w)
+        self.assertEqual(len(self.d.nodes), 2)
+        self.assertEqual(len(self.d.elements), 3)
+
+    def test_merge_duplicated(self):
+        w1 = self.d.Way([(0, 0), (1, 0), (1, 1), (0, 0)])
+        w2 = self.d.Way([(1, 0), (1, 1), (2, 1), (1, 0)])
+        self.assertEqual(len(self.d.nodes), 8)
+        self.d.merge_duplicated()
+        self.assertEqual(len(self.d.nodes), 4)
+        self.assertIs(w1.nodes[1], w2.nodes[0])
+        self.assertIs(w1.nodes[2], w2.nodes[1])
+
+    def test_clean_duplicated_nodes(self):
+        w1 = self.d.Way([(0, 0), (1, 0), (1, 0), (1, 1), (0, 0)])
+        w1.clean_duplicated_nodes()
+        self.assertEqual(w1.geometry(), ((0, 0), (1, 0), (1, 1), (0, 0)))
+        w2 = self.d.Way([(0, 0), (1, 0), (1, 1), (0, 0)])
+        slots = w2._nodes
+        w2.clean_duplicated_nodes()
+        self.assertIs(w2._nodes, slots)
+        self.assertEqual(len(self.d.node_store.proxies), 0)
+
+    def test_serialize(self):
+        n = self.d.Node(1.5, 2.5, {"entrance": "yes"})
+        self.d.Way([n, (2, 2), (3, 3)], {"highway": "path"})
+        fo = BytesIO()
+        osmxml.serialize(fo, self.d)
+        fo.seek(0)
+        result = osmxml.deserialize(fo, osm.Osm(compact=True))
+        self.assertEqual(len(result.nodes), 3)
+        self.assertEqual(result.get(n.id).tags, {"entrance": "yes"})
+        way = next(iter(result.ways))
+        self.assertEqual(way.geometry(), ((1.5, 2.5), (2, 2), (3, 3)))
+        self.assertEqual(fo.getvalue(), self.serialize(result))
+
+    def serialize(self, data):
+        fo = BytesIO()
+        osmxml.serialize(fo, data)
+        return fo.getvalue()
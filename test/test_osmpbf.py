@@ -0,0 +1,157 @@
+import unittest
+from io import BytesIO
+
+import mock
+
+from catatom2osm import osm, osmpbf
+from catatom2osm.exceptions import CatIOError
+
+
+class OsmpbfTest(unittest.TestCase):
+    def get_data(self):
+        data = osm.Osm()
+        n = data.Node(-3.7038, 40.4168, {"entrance": "yes"})
+        n.tags["addr:street"] = "Calle la Ñ"
+        w = data.Way([(12, 0), (14, 0), (14, 2), (12, 2), (12, 0)])
+        w.tags["leisure"] = "swimming_pool"
+        mp1 = [(0, 0), (10, 0), (10, 6), (0, 6), (0, 0)]
+        mp2 = [(8, 1), (9, 1), (9, 2), (8, 2), (8, 1)]
+        r = data.MultiPolygon([[mp1, mp2]])
+        r.tags["building"] = "residential"
+        data.Relation([n, w, r], tags={"type": "site"})
+        attrs = dict(
+            id="123",
+            version="4",
+            timestamp="2020-01-02T03:04:05Z",
+            changeset="789",
+            uid="55",
+            user="Fulano",
+        )
+        data.Node(1.5, 2.5, attrs=attrs)
+        data.Way([n], attrs=dict(attrs, id="7"))
+        return data
+
+    def test_zigzag(self):
+        for value in (0, 1, -1, 2, -2, 2**62, -(2**62)):
+            self.assertGreaterEqual(osmpbf.zigzag(value), 0)
+            self.assertEqual(osmpbf.unzigzag(osmpbf.zigzag(value)), value)
+
+    def test_varint(self):
+        for value in (0, 1, 127, 128, 300, 2**40, -1, -(2**40)):
+            buf = bytearray()
+            osmpbf.write_varint(buf, value)
+            result, pos = osmpbf.read_varint(buf, 0)
+            self.assertEqual(osmpbf.to_signed(result), value)
+            self.assertEqual(pos, len(buf))
+        buf = bytearray()
+        osmpbf.write_varint(buf, 300)
+        self.assertEqual(buf, b"\xac\x02")
+
+    def test_delta(self):
+        values = [5, 3, -10, 100, 100]
+        self.assertEqual(osmpbf.undelta(osmpbf.delta(values)), values)
+
+    def test_fields(self):
+        buf = bytearray()
+        osmpbf.write_field(buf, 1, 150)
+        osmpbf.write_field(buf, 2, "testing")
+        osmpbf.write_packed(buf, 4, [3, 270, 86942])
+        self.assertEqual(buf[:3], b"\x08\x96\x01")
+        fields = list(osmpbf.iter_fields(buf))
+        self.assertEqual(fields[0], (1, 150))
+        self.assertEqual(fields[1][0], 2)
+        self.assertEqual(bytes(fields[1][1]), b"testing")
+        self.assertEqual(osmpbf.unpack(fields[2][1]), [3, 270, 86942])
+
+    def test_timestamp(self):
+        ts = "2020-01-02T03:04:05Z"
+        self.assertEqual(osmpbf.to_timestamp(osmpbf.to_epoch(ts)), ts)
+        self.assertEqual(osmpbf.to_epoch(None), 0)
+        self.assertEqual(osmpbf.to_epoch("foobar"), 0)
+
+    def test_serialize(self):
+        data = self.get_data()
+        fo = BytesIO()
+        osmpbf.serialize(fo, data)
+        fo.seek(0)
+        result = osmpbf.deserialize(fo)
+        self.assertEqual(len(result.nodes), len(data.nodes))
+        self.assertEqual(len(result.ways), len(data.ways))
+        self.assertEqual(len(result.relations), len(data.relations))
+        self.assertEqual(result.generator, data.generator or "CatAtom2Osm")
+        for el in data.elements:
+            other = result.get(el.id, el.kind)
+            self.assertEqual(other.tags, el.tags)
+            for key in osm.Element._attr_list:
+                self.assertEqual(getattr(other, key), getattr(el, key))
+            self.assertEqual(other.geometry(), el.geometry())
+        n = result.get(123)
+        self.assertEqual(n.version, "4")
+        self.assertEqual(n.timestamp, "2020-01-02T03:04:05Z")
+        self.assertEqual(n.user, "Fulano")
+        site = [r for r in result.relations if r.tags.get("type") == "site"][0]
+        self.assertEqual([m.type for m in site.members], ["node", "way", "relation"])
+        mp = site.members[2].element
+        self.assertEqual([m.role for m in mp.members], ["outer", "inner"])
+        self.assertIn(site, result.parents[mp])
+
+    def test_serialize_sort(self):
+        data = osm.Osm()
+        data.Node(1, 1)
+        data.Node(2, 2, attrs={"id": "3"})
+        data.Node(3, 3, attrs={"id": "2"})
+        fo = BytesIO()
+        osmpbf.serialize(fo, data, sort=True)
+        fo.seek(0)
+        result = osmpbf.deserialize(fo)
+        self.assertEqual([n.id for n in result.nodes], [2, 3, -1])
+
+    @mock.patch("catatom2osm.osmpbf.BLOCK_SIZE", 3)
+    def test_serialize_blocks(self):
+        data = self.get_data()
+        fo = BytesIO()
+        osmpbf.serialize(fo, data)
+        fo.seek(0)
+        blobs = list(osmpbf.read_blobs(fo))
+        self.assertEqual(blobs[0][0], "OSMHeader")
+        self.assertGreater(len(blobs), 5)
+        fo.seek(0)
+        result = osmpbf.deserialize(fo)
+        self.assertEqual(len(result.elements), len(data.elements))
+
+    def test_deserialize(self):
+        data = self.get_data()
+        fo = BytesIO()
+        osmpbf.serialize(fo, data)
+        fo.seek(0)
+        result = osm.Osm()
+        n = result.Node(0, 0)
+        osmpbf.deserialize(fo, result, meta=False)
+        self.assertIn(n, result.elements)
+        self.assertEqual(len(result.nodes), len(data.nodes) + 1)
+        self.assertEqual(result.get(123).version, None)
+        self.assertEqual(result.get(7, "w").user, None)
+
+    def test_deserialize_feature(self):
+        buf = bytearray()
+        osmpbf.write_field(buf, 4, "HistoricalInformation")
+        fo = BytesIO()
+        osmpbf.write_blob(fo, "OSMHeader", buf)
+        fo.seek(0)
+        with self.assertRaises(CatIOError):
+            osmpbf.deserialize(fo)
+
+    def test_get_lost_attributes(self):
+        data = osm.Osm(upload="yes")
+        n = data.Node(0, 0)
+        self.assertEqual(osmpbf.get_lost_attributes(data), [])
+        data.upload = "never"
+        data.tags["comment"] = "foo"
+        self.assertEqual(osmpbf.get_lost_attributes(data), ["upload", "changeset"])
+        data = osm.Osm(upload="yes")
+        n = data.Node(0, 0, attrs={"id": "1"})
+        self.assertEqual(osmpbf.get_lost_attributes(data), ["action"])
+        n.id = -1
+        n.action = "delete"
+        n.visible = "false"
+        self.assertEqual(osmpbf.get_lost_attributes(data), ["action", "visible"])
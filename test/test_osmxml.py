@@ -1,3 +1,4 @@
+import gzip
 import unittest
 from io import BytesIO, StringIO
 
@@ -18,9 +19,9 @@ class OsmxmlTest(unittest.TestCase):
         mp2 = [(8, 1), (9, 1), (9, 2), (8, 2), (8, 1)]
         r = data.MultiPolygon([[mp1, mp2]])
         r.tags["building"] = "residential"
-        fo = StringIO()
+        fo = BytesIO()
         osmxml.serialize(fo, data)
-        result = bytes(fo.getvalue().encode("utf-8"))
+        result = fo.getvalue()
         root = etree.fromstring(result)
         for (xmlnode, osmnode) in zip(root.findall("node"), data.nodes):
             self.assertEqual(float(xmlnode.get("lon")), osmnode.x)
@@ -51,9 +52,9 @@ class OsmxmlTest(unittest.TestCase):
         data.note = "foobar"
         data.meta = {"foo": "bar"}
         data.tags["type"] = "import"
-        fo = StringIO()
+        fo = BytesIO()
         osmxml.serialize(fo, data)
-        result = bytes(fo.getvalue().encode("utf-8"))
+        result = fo.getvalue()
         root = etree.fromstring(result)
         self.assertEqual(root.find("note").text, "foobar")
         self.assertEqual(root.find("meta").get("foo"), "bar")
@@ -61,6 +62,81 @@ class OsmxmlTest(unittest.TestCase):
             self.assertEqual(xmltag.get("k"), osmtag[0])
             self.assertEqual(xmltag.get("v"), osmtag[1])
 
+    def test_serialize_sort(self):
+        data = osm.Osm()
+        n1 = data.Node(1, 1)
+        data.Node(2, 2, attrs={"id": "3"})
+        data.Node(3, 3, attrs={"id": "2"})
+        data.Way([n1, (4, 4)], attrs={"id": "5"})
+        data.Way([n1, (5, 5)])
+        fo = BytesIO()
+        osmxml.serialize(fo, data)
+        root = etree.fromstring(fo.getvalue())
+        ids = [e.get("id") for e in root.findall("node") + root.findall("way")]
+        self.assertEqual(ids, ["-1", "3", "2", "-2", "-4", "5", "-3"])
+        fo = BytesIO()
+        osmxml.serialize(fo, data, sort=True)
+        output = fo.getvalue()
+        root = etree.fromstring(output)
+        ids = [e.get("id") for e in root.findall("node") + root.findall("way")]
+        self.assertEqual(ids, ["2", "3", "-1", "-2", "-4", "5", "-3"])
+        fo = BytesIO()
+        osmxml.serialize(fo, data, sort=True)
+        self.assertEqual(fo.getvalue(), output)
+
+    def test_serialize_layout(self):
+        data = osm.Osm()
+        data.tags["comment"] = "foo"
+        n = data.Node(0, 0, {"entrance": "yes"})
+        data.Way([n, (1, 0)])
+        fo = BytesIO()
+        osmxml.serialize(fo, data)
+        self.assertEqual(
+            fo.getvalue().decode().split("\n"),
+            [
+                "<?xml version='1.0' encoding='utf-8'?>",
+                '<osm upload="never" version="0.6">',
+                "  <changeset>",
+                '    <tag k="comment" v="foo"/>',
+                "  </changeset>",
+                '  <node id="-1" action="modify" visible="true" lon="0" lat="0">',
+                '    <tag k="entrance" v="yes"/>',
+                "  </node>",
+                '  <node id="-3" action="modify" visible="true" lon="1" lat="0"/>',
+                '  <way id="-2" action="modify" visible="true">',
+                '    <nd ref="-1"/>',
+                '    <nd ref="-3"/>',
+                "  </way>",
+                "</osm>",
+                "",
+            ],
+        )
+        fo = BytesIO()
+        osmxml.serialize(fo, osm.Osm())
+        self.assertEqual(
+            fo.getvalue(),
+            b"<?xml version='1.0' encoding='utf-8'?>\n"
+            b'<osm upload="never" version="0.6"/>\n',
+        )
+
+    def test_serialize_text(self):
+        with self.assertRaises(TypeError):
+            osmxml.serialize(StringIO(), osm.Osm())
+
+    def test_serialize_gzip(self):
+        data = osm.Osm()
+        data.Way([(0, 0), (1, 0), (1, 1)], {"name": "Calle la Ñ"})
+        fo = BytesIO()
+        with gzip.GzipFile(fileobj=fo, mode="wb", mtime=0) as gz:
+            osmxml.serialize(gz, data)
+        fo.seek(0)
+        with gzip.GzipFile(fileobj=fo, mode="rb") as gz:
+            result = osmxml.deserialize(gz)
+        self.assertEqual(len(result.nodes), 3)
+        way = next(iter(result.ways))
+        self.assertEqual(way.tags["name"], "Calle la Ñ")
+        self.assertEqual(way.geometry(), ((0, 0), (1, 0), (1, 1)))
+
     def test_deserialize(self):
         attrs = dict(upload="1", version="2", generator="3")
         root = etree.Element("osm", attrs)
@@ -178,3 +254,67 @@ class OsmxmlTest(unittest.TestCase):
         self.assertEqual(len(result.relations), 3)
         self.assertEqual(result.get(-103, "w").version, "2")
         self.assertEqual(result.get(-202, "r").version, None)
+
+    def get_filter_data(self):
+        data = osm.Osm()
+        n = data.Node(0, 0, {"entrance": "yes"}, attrs={"version": "3"})
+        data.Node(9, 9, {"amenity": "cafe"})
+        data.Way([n, (1, 0), (1, 1), n], {"building": "yes"})
+        data.Way([(5, 5), (6, 6)], {"highway": "residential"})
+        w = data.Way([(7, 7), (8, 8), (7, 8), (7, 7)])
+        data.Polygon([w], tags={"building": "house"})
+        data.Way([(10, 10), (11, 11)])
+        fo = BytesIO()
+        osmxml.serialize(fo, data)
+        fo.seek(0)
+        return fo
+
+    def test_iter_tags(self):
+        fo = self.get_filter_data()
+        result = list(osmxml.iter_tags(fo, lambda tags: "building" in tags))
+        self.assertEqual(
+            [(etype, tags) for etype, eid, tags in result],
+            [
+                ("way", {"building": "yes"}),
+                ("relation", {"building": "house", "type": "multipolygon"}),
+            ],
+        )
+        self.assertTrue(all(isinstance(eid, int) for etype, eid, tags in result))
+        fo.seek(0)
+        self.assertEqual(len(list(osmxml.iter_tags(fo))), 17)
+
+    def test_deserialize_query(self):
+        fo = self.get_filter_data()
+        query = lambda tags: "building" in tags or "entrance" in tags  # noqa: E731
+        result = osmxml.deserialize(fo, query=query, meta=False)
+        self.assertEqual(len(result.nodes), 7)
+        self.assertEqual(len(result.ways), 2)
+        self.assertEqual(len(result.relations), 1)
+        self.assertEqual(len(result.index), 10)
+        self.assertNotIn((9, 9), [n.geometry() for n in result.nodes])
+        n = result.get(-1)
+        self.assertEqual(n.tags, {"entrance": "yes"})
+        self.assertEqual(n.version, None)
+        r = next(iter(result.relations))
+        self.assertEqual(len(r.members), 1)
+        self.assertEqual(len(r.members[0].element.nodes), 4)
+
+    def test_deserialize_query_references(self):
+        fo = self.get_filter_data()
+        query = lambda tags: tags.get("building") == "yes"  # noqa: E731
+        result = osmxml.deserialize(fo, query=query)
+        self.assertEqual(len(result.ways), 1)
+        self.assertEqual(len(result.relations), 0)
+        w = next(iter(result.ways))
+        self.assertEqual(len(w.nodes), 4)
+        self.assertEqual(w.nodes[0], w.nodes[-1])
+        self.assertEqual(w.nodes[0].tags, {"entrance": "yes"})
+        self.assertEqual(w.nodes[0].version, "3")
+        self.assertEqual(w.version, None)
+        self.assertEqual(len(result.nodes), 3)
+        fo.seek(0)
+        query = lambda tags: tags.get("building") == "house"  # noqa: E731
+        result = osmxml.deserialize(fo, query=query)
+        self.assertEqual(len(result.relations), 1)
+        self.assertEqual(len(result.ways), 1)
+        self.assertEqual(len(result.nodes), 4)
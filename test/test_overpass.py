@@ -1,11 +1,17 @@
+import os
+import time
 import unittest
+from tempfile import TemporaryDirectory
 
 import mock
 
+from catatom2osm import config, overpass
 from catatom2osm.config import osm3s_servers
 from catatom2osm.exceptions import CatIOError
 from catatom2osm.overpass import Query
 
+config.install_gettext("catato2osm", "")
+
 
 class TestQuery(unittest.TestCase):
     @mock.patch.object(Query, "set_search_area")
@@ -65,6 +71,7 @@ class TestQuery(unittest.TestCase):
         url = "taz?data=[out:json][timeout:250];(foo(1,2,3,4);" "bar(1,2,3,4););out;"
         self.assertEqual(q.get_url("taz?"), url)
 
+    @mock.patch.object(config, "overpass_cache", False)
     @mock.patch("catatom2osm.overpass.download")
     def test_download(self, m_download):
         def raises_io(*args):
@@ -83,6 +90,7 @@ class TestQuery(unittest.TestCase):
         m_download.wget = raises_io1
         q.download("bar")
 
+    @mock.patch.object(config, "overpass_cache", False)
     @mock.patch("catatom2osm.overpass.download")
     def test_read(self, m_download):
         m_download.get_response.return_value.content = "bar"
@@ -90,3 +98,149 @@ class TestQuery(unittest.TestCase):
         out = q.read()
         m_download.get_response.assert_called_once_with(q.get_url())
         self.assertEqual(out, "bar")
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmp_dir.name, "cache")
+        patcher = mock.patch.object(config, "overpass_cache_path", self.cache_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.query = Query("1,2,3,4").add("foo")
+        self.path = self.query.get_cache_path()
+
+    def fetch(self, filename, log=False):
+        with open(filename, "w") as fo:
+            fo.write("bar")
+
+    def set_age(self, age):
+        t = time.time() - age
+        os.utime(self.path, (t, t))
+
+    def test_get_key(self):
+        key = overpass.get_key("foo?data=[out:xml];(node(1,2,3,4););")
+        self.assertEqual(len(key), 64)
+        self.assertEqual(key, overpass.get_key("bar?data=[out:xml];(node(1,2,3,4););"))
+        self.assertEqual(
+            key, overpass.get_key("bar?data=[out:xml];(node(1%2C2%2C3%2C4););")
+        )
+        self.assertNotEqual(key, overpass.get_key("foo?data=[out:xml];(way;);"))
+
+    def test_get_age(self):
+        self.assertIsNone(overpass.get_age(self.path))
+        with open(os.path.join(self.tmp_dir.name, "foo"), "w"):
+            pass
+        self.assertLess(overpass.get_age(os.path.join(self.tmp_dir.name, "foo")), 5)
+
+    def test_get_cache_path(self):
+        self.assertEqual(os.path.dirname(self.path), self.cache_path)
+        self.assertTrue(self.path.endswith(".xml"))
+        query = Query("1,2,3,4", "json").add("foo")
+        self.assertNotEqual(query.get_cache_path(), self.path)
+
+    def test_download(self):
+        filename = os.path.join(self.tmp_dir.name, "current.osm")
+        with mock.patch.object(self.query, "fetch", side_effect=self.fetch) as m_fetch:
+            self.query.download(filename)
+            m_fetch.assert_called_once_with(self.path + ".new", False)
+            with open(filename) as fo:
+                self.assertEqual(fo.read(), "bar")
+            self.query.download(filename)
+            m_fetch.assert_called_once()
+
+    def test_read(self):
+        with mock.patch.object(self.query, "fetch", side_effect=self.fetch) as m_fetch:
+            self.assertEqual(self.query.read(), b"bar")
+            self.assertEqual(self.query.read(), b"bar")
+            m_fetch.assert_called_once()
+
+    @mock.patch.dict(config.overpass_ttl, {"data": 100})
+    @mock.patch.dict(config.overpass_stale, {"data": 50})
+    def test_cache(self):
+        with mock.patch.object(self.query, "fetch", side_effect=self.fetch) as m_fetch:
+            self.query.cache()
+            self.set_age(99)
+            self.query.cache()
+            self.assertEqual(m_fetch.call_count, 1)
+            self.set_age(151)
+            self.query.cache()
+            self.assertEqual(m_fetch.call_count, 2)
+        self.assertLess(overpass.get_age(self.path), 5)
+
+    @mock.patch.dict(config.overpass_ttl, {"data": 100})
+    @mock.patch.dict(config.overpass_stale, {"data": 50})
+    def test_cache_stale(self):
+        self.query.fetch = self.fetch
+        self.query.cache()
+        self.set_age(120)
+        with mock.patch.object(self.query, "revalidate") as m_revalidate:
+            self.assertEqual(self.query.cache(), self.path)
+            m_revalidate.assert_called_once_with(self.path)
+
+    def test_revalidate(self):
+        os.makedirs(self.cache_path)
+        with mock.patch.object(self.query, "fetch", side_effect=self.fetch):
+            with mock.patch("catatom2osm.overpass.threading.Thread") as m_thread:
+                self.query.revalidate(self.path)
+                m_thread.return_value.start.assert_called_once_with()
+                m_thread.call_args[1]["target"]()
+        self.assertTrue(os.path.exists(self.path))
+        with mock.patch.object(self.query, "fetch", side_effect=CatIOError):
+            with mock.patch("catatom2osm.overpass.threading.Thread") as m_thread:
+                self.query.revalidate(self.path)
+                m_thread.call_args[1]["target"]()
+
+    def test_revalidate_once(self):
+        os.makedirs(self.cache_path)
+        with mock.patch.object(self.query, "fetch", side_effect=self.fetch):
+            with mock.patch("catatom2osm.overpass.threading.Thread") as m_thread:
+                self.query.revalidate(self.path)
+                self.query.revalidate(self.path)
+                m_thread.assert_called_once()
+                m_thread.call_args[1]["target"]()
+                self.query.revalidate(self.path)
+                self.assertEqual(m_thread.call_count, 2)
+                m_thread.call_args[1]["target"]()
+
+    def test_check_results(self):
+        fn = os.path.join(self.tmp_dir.name, "foo")
+        for content in (b"", b"<osm>\n  <remark> runtime error: Query timed out"):
+            with open(fn, "wb") as fo:
+                fo.write(content)
+            with self.assertRaises(CatIOError):
+                overpass.check_results(fn)
+        with open(fn, "wb") as fo:
+            fo.write(b'{"elements": [], "remark": "runtime error: out of memory"}')
+        with self.assertRaises(CatIOError):
+            overpass.check_results(fn)
+        with open(fn, "wb") as fo:
+            fo.write(b'<osm>\n  <node id="1" lon="0" lat="0"/>\n</osm>\n')
+        overpass.check_results(fn)
+
+    def test_update_cache_invalid(self):
+        os.makedirs(self.cache_path)
+        self.fetch(self.path)
+
+        def fetch(filename, log=False):
+            with open(filename, "w") as fo:
+                fo.write("<remark> runtime error: timeout </remark>")
+
+        with mock.patch.object(self.query, "fetch", side_effect=fetch):
+            with self.assertRaises(CatIOError):
+                self.query.update_cache(self.path)
+        with open(self.path) as fo:
+            self.assertEqual(fo.read(), "bar")
+        self.assertFalse(os.path.exists(self.path + ".new"))
+
+    @mock.patch.object(config, "overpass_offline", True)
+    def test_cache_offline(self):
+        with self.assertRaises(CatIOError):
+            self.query.cache()
+        os.makedirs(self.cache_path)
+        self.fetch(self.path)
+        self.set_age(365 * 86400)
+        with mock.patch.object(self.query, "fetch") as m_fetch:
+            self.assertEqual(self.query.cache(), self.path)
+            m_fetch.assert_not_called()
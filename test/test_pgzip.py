@@ -0,0 +1,61 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+import mock
+
+from catatom2osm import pgzip
+
+
+class TestGzipWriter(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".gz")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def get_data(self, size):
+        return b"".join(b"<node id='%d'/>\n" % i for i in range(size))
+
+    def test_write(self):
+        data = self.get_data(10000)
+        with pgzip.GzipWriter(self.path, block_size=4096) as fo:
+            for i in range(0, len(data), 1000):
+                chunk = data[i : i + 1000]
+                self.assertEqual(fo.write(chunk), len(chunk))
+        self.assertTrue(fo.closed)
+        self.assertEqual(fo.members, len(data) // 4096 + 1)
+        with gzip.open(self.path, "rb") as fo:
+            self.assertEqual(fo.read(), data)
+
+    def test_deterministic(self):
+        data = self.get_data(10000)
+        with pgzip.GzipWriter(self.path, level=1, block_size=4096) as fo:
+            fo.write(data)
+        with open(self.path, "rb") as fo:
+            output = fo.read()
+        with pgzip.GzipWriter(self.path, level=1, block_size=4096) as fo:
+            fo.write(data)
+        with open(self.path, "rb") as fo:
+            self.assertEqual(fo.read(), output)
+        with pgzip.GzipWriter(self.path, level=9, block_size=4096) as fo:
+            fo.write(data)
+        with open(self.path, "rb") as fo:
+            self.assertLess(len(fo.read()), len(output))
+
+    def test_empty(self):
+        fo = pgzip.GzipWriter(self.path)
+        fo.close()
+        fo.close()
+        self.assertEqual(fo.members, 0)
+        with gzip.open(self.path, "rb") as fo:
+            self.assertEqual(fo.read(), b"")
+
+    @mock.patch("catatom2osm.pgzip.config")
+    def test_level(self, m_config):
+        m_config.compression_level = 3
+        fo = pgzip.GzipWriter(self.path)
+        fo.close()
+        self.assertEqual(fo.level, 3)
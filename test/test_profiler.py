@@ -0,0 +1,135 @@
+import os
+import time
+import unittest
+from tempfile import TemporaryDirectory
+
+import mock
+
+from catatom2osm import config, profiler
+from catatom2osm.report import Report
+
+
+class Foo(object):
+    def __init__(self):
+        self.count = 5
+
+    def name(self):
+        return "foo"
+
+    def featureCount(self):
+        return self.count
+
+    @profiler.stage(features=True)
+    def delete(self, n):
+        self.count -= n
+        self.bar()
+        return self.count
+
+    @profiler.stage("taz")
+    def bar(self):
+        return [0] * 1000
+
+
+@mock.patch.object(config, "report_system_info", True)
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(profiler, "report", Report())
+        self.report = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_peak_rss(self):
+        self.assertGreater(profiler.get_peak_rss(), 0)
+
+    def test_stage(self):
+        with profiler.Stage("foo") as s1:
+            with profiler.Stage("bar"):
+                sum(range(1000))
+        stages = self.report.values["stages"]
+        self.assertEqual([s["name"] for s in stages], ["foo", "bar"])
+        self.assertEqual([s["level"] for s in stages], [0, 1])
+        self.assertIs(stages[0], s1.values)
+        for s in stages:
+            self.assertGreaterEqual(s["wall"], 0)
+            self.assertGreaterEqual(s["cpu"], 0)
+            self.assertGreaterEqual(s["peak"], 0)
+            self.assertIn("rss", s)
+            self.assertNotIn("features", s)
+        self.assertGreaterEqual(stages[0]["wall"], stages[1]["wall"])
+        self.assertEqual(profiler._stack, [])
+
+    def test_stage_error(self):
+        with self.assertRaises(ValueError):
+            with profiler.Stage("foo"):
+                raise ValueError
+        self.assertIn("wall", self.report.values["stages"][0])
+        self.assertEqual(profiler._stack, [])
+
+    def test_stage_disabled(self):
+        with mock.patch.object(config, "report_system_info", False):
+            with profiler.Stage("foo"):
+                pass
+        self.assertNotIn("stages", self.report.values)
+
+    def test_decorator(self):
+        foo = Foo()
+        self.assertEqual(foo.delete(2), 3)
+        self.assertEqual(foo.delete.__name__, "delete")
+        stages = self.report.values["stages"]
+        self.assertEqual([s["name"] for s in stages], ["foo.delete", "taz"])
+        self.assertEqual(stages[0]["features"], [5, 3])
+        self.assertEqual(stages[1]["level"], 1)
+        self.assertNotIn("features", stages[1])
+
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp = tmp_dir.name
+        self.addCleanup(profiler.stop)
+
+    def read_stacks(self):
+        with open(os.path.join(self.tmp, profiler.STACKS_FILE)) as fo:
+            return fo.read().splitlines()
+
+    def test_cprofile(self):
+        profiler.start("cprofile", self.tmp)
+        foo = Foo()
+        foo.delete(1)
+        foo.bar()
+        profiler.stop()
+        foo.bar()
+        self.assertEqual(
+            sorted(os.listdir(self.tmp)),
+            ["profile_01_foo.delete.prof", "profile_02_taz.prof", "profile_stacks.txt"],
+        )
+        stacks = self.read_stacks()
+        self.assertTrue(
+            all(line.split(";")[0] in ("foo.delete", "taz") for line in stacks)
+        )
+        self.assertTrue(
+            any(
+                line.startswith("foo.delete;test_profiler.py:delete;")
+                for line in stacks
+            )
+        )
+        for line in stacks:
+            self.assertGreater(int(line.rsplit(" ", 1)[1]), 0)
+
+    @mock.patch.object(config, "profile_interval", 0.001)
+    def test_sample(self):
+        profiler.start("sample", self.tmp)
+        with profiler.Stage("foo"):
+            start = time.perf_counter()
+            while time.perf_counter() - start < 0.1:
+                sum(range(1000))
+        profiler.stop()
+        self.assertEqual(os.listdir(self.tmp), [profiler.STACKS_FILE])
+        stacks = self.read_stacks()
+        self.assertGreater(len(stacks), 0)
+        self.assertTrue(any("test_profiler.py:test_sample" in line for line in stacks))
+        self.assertTrue(all(line.startswith("foo;") for line in stacks))
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            profiler.start("foo", self.tmp)
@@ -40,6 +40,15 @@ class TestReport(unittest.TestCase):
         r.inc("nodes", 2)
         self.assertEqual(r.nodes, 3)
 
+    def test_merge(self):
+        r = report.Report()
+        r.inc("nodes", 2)
+        r.building_counter["house"] = 1
+        r.merge({"nodes": 3, "ways": 1, "building_counter": Counter(house=2, a=1)})
+        self.assertEqual(r.nodes, 5)
+        self.assertEqual(r.ways, 1)
+        self.assertEqual(r.building_counter, Counter(house=3, a=1))
+
     def test_validate1(self):
         r = report.Report()
         r.inp_address_entrance = 7
@@ -215,6 +224,33 @@ class TestReport(unittest.TestCase):
         if os.path.exists(fn):
             os.remove(fn)
 
+    def test_to_string_stages(self):
+        r = report.Report()
+        r.start_time = None
+        r.stages = [
+            {"name": "foo", "level": 0, "wall": 2, "cpu": 1.5, "rss": 1, "peak": 2},
+            {
+                "name": "bar.taz",
+                "level": 1,
+                "wall": 1,
+                "cpu": 1,
+                "rss": -0.5,
+                "peak": 0,
+                "features": [10, 8],
+            },
+        ]
+        output = r.to_string()
+        self.assertIn(config.eol + "=Stages=" + config.eol, output)
+        self.assertIn(
+            report.TAB + "foo: 2.0 s, CPU 1.5 s, RSS +1.0 MB, peak +2.0 MB", output
+        )
+        self.assertIn(
+            report.TAB * 2
+            + "bar.taz: 1.0 s, CPU 1.0 s, RSS -0.5 MB, peak +0.0 MB, "
+            + "features 10 -> 8",
+            output,
+        )
+
     def test_address_stats(self):
         ad = osm.Osm()
         ad.Node(0, 0, {"addr:street": "s1"})
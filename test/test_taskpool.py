@@ -0,0 +1,202 @@
+import gzip
+import os
+import struct
+import unittest
+from collections import Counter
+from tempfile import TemporaryDirectory
+
+import mock
+
+from catatom2osm import config, osm, osmxml, taskpool
+
+
+def wkb_point(x, y, bo="<"):
+    return struct.pack(bo + "BIdd", bo == "<", 1, x, y)
+
+
+def wkb_polygon(rings, bo="<", code=3, dims=2):
+    wkb = struct.pack(bo + "BII", bo == "<", code, len(rings))
+    for ring in rings:
+        wkb += struct.pack(bo + "I", len(ring))
+        for p in ring:
+            wkb += struct.pack(bo + "d" * dims, *(tuple(p) + (0,) * (dims - 2)))
+    return wkb
+
+
+def wkb_multipolygon(polygons, bo="<"):
+    wkb = struct.pack(bo + "BII", bo == "<", 6, len(polygons))
+    return wkb + b"".join(wkb_polygon(rings, bo) for rings in polygons)
+
+
+class TestTaskPool(unittest.TestCase):
+    def setUp(self):
+        self.ring1 = [(0, 0), (10, 0), (10, 6), (0, 6), (0, 0)]
+        self.ring2 = [(8, 1), (9, 1), (9, 2), (8, 2), (8, 1)]
+        self.ring3 = [(12, 0), (14, 0), (14, 2), (12, 2), (12, 0)]
+
+    def get_features(self):
+        return [
+            (wkb_polygon([self.ring3]), {"leisure": "swimming_pool", "ref": "2"}),
+            (wkb_polygon([self.ring1, self.ring2]), {"building": "yes", "ref": "1"}),
+            (
+                wkb_multipolygon([[self.ring1], [self.ring3]]),
+                {"building": "house", "ref": "3"},
+            ),
+        ]
+
+    def test_read_wkb(self):
+        self.assertEqual(taskpool.read_wkb(wkb_point(1.5, 2)), (1, (1.5, 2)))
+        self.assertEqual(taskpool.read_wkb(wkb_point(1.5, 2, ">")), (1, (1.5, 2)))
+        rings = [self.ring1, self.ring2]
+        self.assertEqual(taskpool.read_wkb(wkb_polygon(rings)), (3, rings))
+        self.assertEqual(taskpool.read_wkb(wkb_polygon(rings, ">")), (3, rings))
+        wkb = wkb_multipolygon([rings, [self.ring3]])
+        self.assertEqual(taskpool.read_wkb(wkb), (6, [rings, [self.ring3]]))
+
+    def test_read_wkb_dims(self):
+        rings = [self.ring1]
+        self.assertEqual(
+            taskpool.read_wkb(wkb_polygon(rings, code=1003, dims=3))[1], rings
+        )
+        self.assertEqual(
+            taskpool.read_wkb(wkb_polygon(rings, code=3003, dims=4))[1], rings
+        )
+        wkb = wkb_polygon(rings, code=0x80000003, dims=3)
+        self.assertEqual(taskpool.read_wkb(wkb)[1], rings)
+        wkb = struct.pack("<BIIdd", 1, 0x20000001, 25830, 1, 2)
+        self.assertEqual(taskpool.read_wkb(wkb), (1, (1, 2)))
+        with self.assertRaises(ValueError):
+            taskpool.read_wkb(struct.pack("<BII", 1, 2, 0))
+
+    def test_to_osm(self):
+        features = self.get_features() + [(wkb_point(4, 5), {"entrance": "yes"})]
+        data = taskpool.to_osm(features, {"comment": "foo", "source:date": "bar"})
+        self.assertEqual(data.upload, "yes")
+        self.assertEqual(data.tags, {"comment": "foo", "source:date": "bar"})
+        self.assertEqual(len(data.ways), 5)
+        self.assertEqual(len(data.relations), 2)
+        self.assertEqual(len(data.nodes), 26)
+        el = [e for e in data.elements if e.tags.get("ref") == "2"][0]
+        self.assertEqual(el.kind, "way")
+        self.assertEqual(el.geometry(), tuple(self.ring3))
+        el = [e for e in data.elements if e.tags.get("ref") == "1"][0]
+        self.assertEqual(el.kind, "relation")
+        self.assertEqual([m.role for m in el.members], ["outer", "inner"])
+        el = [e for e in data.elements if "entrance" in e.tags][0]
+        self.assertEqual(el.geometry(), (4, 5))
+
+    def test_add_element(self):
+        data = taskpool.new_osm()
+        self.assertEqual(data.upload, "never")
+        n = taskpool.add_element(data, taskpool.WKB_POINT, (4, 5))
+        self.assertEqual(n.geometry(), (4, 5))
+        w = taskpool.add_element(data, taskpool.WKB_MULTIPOLYGON, [[self.ring3]])
+        self.assertEqual(w.kind, "way")
+        r = taskpool.add_element(data, taskpool.WKB_POLYGON, [self.ring1, self.ring2])
+        self.assertEqual([m.role for m in r.members], ["outer", "inner"])
+        mp = [[self.ring1], [self.ring3]]
+        r = taskpool.add_element(data, taskpool.WKB_MULTIPOLYGON, mp)
+        self.assertEqual([m.role for m in r.members], ["outer", "outer"])
+
+    @mock.patch("catatom2osm.taskpool.osmpbf")
+    @mock.patch("catatom2osm.taskpool.osmxml")
+    @mock.patch("catatom2osm.taskpool.open", create=True)
+    @mock.patch("catatom2osm.taskpool.pgzip")
+    def test_write_osm(self, m_gz, m_open, m_xml, m_pbf):
+        data = osm.Osm()
+        data.Node(0, 0, {"ref": "1"})
+        data.Node(1, 1, {"ref": "2"})
+        data.Node(2, 2)
+        taskpool.write_osm(data, "bar")
+        self.assertNotIn(
+            "ref", [k for el in data.elements for k in list(el.tags.keys())]
+        )
+        m_open.assert_called_once_with("bar", "wb")
+        file_obj = m_open.return_value
+        m_xml.serialize.assert_called_once_with(file_obj, data, sort=False)
+        file_obj.close.assert_called_once_with()
+        m_xml.reset_mock()
+        taskpool.write_osm(data, "bar.gz")
+        m_gz.GzipWriter.assert_called_once_with("bar.gz", 6)
+        f_gz = m_gz.GzipWriter.return_value
+        m_xml.serialize.assert_called_once_with(f_gz, data, sort=False)
+        m_xml.reset_mock()
+        m_open.reset_mock()
+        taskpool.write_osm(data, "bar.osm.pbf")
+        m_open.assert_called_once_with("bar.osm.pbf", "wb")
+        m_pbf.serialize.assert_called_once_with(file_obj, data, sort=False)
+        m_xml.serialize.assert_not_called()
+
+    def test_get_addresses(self):
+        address = osm.Osm()
+        address.Node(0, 0, {"ref": "1", "addr:street": "a"})
+        address.Node(1, 0, {"ref": "3", "addr:street": "b"})
+        address.Node(2, 0, {"ref": "1", "addr:street": "c"})
+        address.Node(3, 0, {"ref": "4", "addr:street": "d"})
+        address.Node(4, 0, {"addr:street": "e"})
+        index = taskpool.index_addresses(address)
+        self.assertEqual(sorted(index.keys()), ["1", "3", "4"])
+        addresses = taskpool.get_addresses(self.get_features(), index)
+        self.assertEqual(
+            [(x, y, tags["addr:street"]) for (x, y, tags) in addresses],
+            [(0, 0, "a"), (2, 0, "c"), (1, 0, "b")],
+        )
+
+    @mock.patch.object(config, "show_refs", False)
+    def test_write_task(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        tmp = tmp_dir.name
+        osm_path = os.path.join(tmp, "task.osm.gz")
+        addresses = [
+            (10, 6, {"ref": "1", "addr:street": "a", "entrance": "yes"}),
+            (12, 0, {"ref": "2", "addr:street": "b", "image": "foo"}),
+            (0, 0, {"ref": "3", "addr:street": "c"}),
+            (1, 1, {"ref": "3", "addr:street": "d"}),
+        ]
+        (fn, values, counts) = taskpool.write_task(
+            osm_path,
+            self.get_features(),
+            {"comment": "foo"},
+            addresses=addresses,
+            address_tags={"source:date": "bar"},
+            address_stats=True,
+            building_stats=True,
+        )
+        self.assertEqual(fn, osm_path)
+        self.assertEqual(values["not_unique_addresses"], 2)
+        self.assertEqual(values["out_address"], 2)
+        self.assertEqual(values["out_address_entrance"], 1)
+        self.assertEqual(values["out_pools"], 1)
+        self.assertEqual(values["out_buildings"], 2)
+        self.assertEqual(values["building_counter"], Counter(yes=1, house=1))
+        self.assertEqual(values["relations"], 2)
+        self.assertNotIn("date", values)
+        with gzip.open(osm_path) as fo:
+            data = osmxml.deserialize(fo)
+        self.assertEqual(counts, (len(data.nodes), len(data.ways), len(data.relations)))
+        self.assertEqual(data.tags["source:date:addr"], "bar")
+        self.assertNotIn("ref", [k for el in data.elements for k in el.tags])
+        pool = [el for el in data.elements if "leisure" in el.tags][0]
+        self.assertEqual(pool.tags["addr:street"], "b")
+        self.assertNotIn("image", pool.tags)
+        entrance = [el for el in data.nodes if "entrance" in el.tags][0]
+        self.assertEqual(entrance.geometry(), (10, 6))
+
+    def test_pool(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        tmp = tmp_dir.name
+        with taskpool.TaskPool(2) as pool:
+            for i in range(5):
+                fn = os.path.join(tmp, f"{i}.osm.gz")
+                pool.submit(fn, self.get_features()[i % 3 :], {"comment": str(i)})
+            results = pool.close()
+        self.assertEqual(len(results), 5)
+        for (i, (fn, values, counts)) in enumerate(results):
+            self.assertEqual(fn, os.path.join(tmp, f"{i}.osm.gz"))
+            self.assertEqual(values, {})
+            with gzip.open(fn) as fo:
+                data = osmxml.deserialize(fo)
+            self.assertEqual(data.tags["comment"], str(i))
+            self.assertEqual(len(data.ways), counts[1])